@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# Benchmarks for gdbaudy against the fake gdb module in this directory.
+#
+# Usage: python3 bench/benchmark.py [--scale N] [--repeat N] [--calls] [NAME...]
+#
+# For each scenario we build a synthetic workload (not timed), then run the
+# command under test, reporting the best wall-clock time over --repeat runs,
+# how many gdb API calls it made, and its peak python memory (measured on a
+# separate run under tracemalloc, since tracing skews the timing).  NAMEs
+# restrict the run to scenarios whose name starts with one of them.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# our fake gdb first, then the repo root for pyflam and gdbaudy.
+sys.path[0:0] = [BENCH_DIR, os.path.dirname(BENCH_DIR)]
+
+import gdb
+import pyflam
+import workloads
+
+import gdbaudy.bt
+import gdbaudy.mozhash
+import gdbaudy.pp
+import gdbaudy.tricelog
+
+# Nobody wants to see thousands of lines of colorized output.
+pyflam.pout.fout = open(os.devnull, 'w')
+# (and there's no terminal to ask the width of)
+pyflam.pout._get_terminal_columns = lambda: 100
+
+
+### Scenarios
+# Each takes the scale and returns the callable to time.
+
+def cbt_scenario(args, depth=200, symbols=6, threads=1):
+    def setup(scale):
+        workloads.build_stack(depth * scale, symbols, threads)
+        cmd = gdbaudy.bt.ColorFilteringBacktrace()
+        return lambda: cmd.invoke(args, False)
+    return setup
+
+def cbt_recursion(scale):
+    workloads.build_recursion(5000 * scale)
+    cmd = gdbaudy.bt.ColorFilteringBacktrace()
+    return lambda: cmd.invoke('', False)
+
+def cbt_json(scale):
+    workloads.build_stack(200 * scale, 6)
+    cmd = gdbaudy.bt.ColorFilteringBacktrace()
+    path = os.path.join(tempfile.gettempdir(), 'gdbaudy-bench-cbt.json')
+    return lambda: cmd.invoke('json ' + path + ' args', False)
+
+def pp_startup(scale):
+    return lambda: gdbaudy.pp.PrettyPrintCommand()
+
+def pp_scenario(builder, count, expr):
+    def setup(scale):
+        builder(count * scale)
+        cmd = gdbaudy.pp.PrettyPrintCommand()
+        return lambda: cmd.invoke(expr, False)
+    return setup
+
+def pp_diff(scale):
+    '''pp /diff of 20 channels against a snapshot of them; nothing's changed.'''
+    workloads.build_channels(20 * scale)
+    cmd = gdbaudy.pp.PrettyPrintCommand()
+    cmd.invoke('/snap bench gChannels', False)
+    return lambda: cmd.invoke('/diff bench gChannels', False)
+
+def hashtable_collisions(scale):
+    '''
+    pp TABLE[KEY] on keys whose probe sequences collide, in the newer layout
+    with the key hashes ahead of the entries.
+    '''
+    workloads.build_hashtables(5000 * scale, hashes_ahead=True)
+    keys = workloads.colliding_keys(4)
+    # (following the wrong probe sequence misses these, so make sure we don't
+    # before timing anything)
+    table = gdb.parse_and_eval('gCollisions')
+    for i, key in enumerate(keys):
+        entry, probed = gdbaudy.mozhash.lookup(table, key)
+        if entry is None or int(entry['mData']) != i:
+            raise AssertionError('gCollisions[%d] not found' % key)
+    cmd = gdbaudy.pp.PrettyPrintCommand()
+    return lambda: cmd.invoke('gCollisions[%d]' % keys[-1], False)
+
+CAPTURE_TRAVERSALS = [
+    ['aChannel', 'mURI', 'mRawPtr', 'mSpec'],
+    ['aChannel', 'mStatus'],
+    ['aChannel', 'mLoadInfo', 'mLoadingPrincipal', 'mCodebase'],
+    ['aChannel', 'mRequestHead', 'mMethod'],
+    ['aStatus']]
+
+def capture(scale):
+    workloads.build_capture_frame(1)
+    gdbaudy.tricelog.capture_memo.clear()
+    def run():
+        for i in range(100 * scale):
+            # (a new stop, and so a new rr event, each time round)
+            gdb.events.stop._fire(None)
+            for traversal in CAPTURE_TRAVERSALS:
+                gdbaudy.tricelog.magic_capture(traversal)
+    return run
+
+def capture_revisit(scale):
+    '''capture, going back and forth over the same 20 rr events.'''
+    workloads.build_capture_frame(1)
+    gdbaudy.tricelog.capture_memo.clear()
+    event = [0]
+    gdb._execute_handlers['when'] = \
+        lambda rest: 'Current event: %d\n' % event[0]
+    def run():
+        for i in range(100 * scale):
+            event[0] = 41000 + i % 20
+            gdb.events.stop._fire(None)
+            for traversal in CAPTURE_TRAVERSALS:
+                gdbaudy.tricelog.magic_capture(traversal)
+    return run
+
+class FakeOwner(object):
+    ofile = None
+
+def trice_gather(scale):
+    workloads.build_capture_frame(1)
+    gdbaudy.tricelog.capture_memo.clear()
+    bp = gdbaudy.tricelog.LoggingBreakpoint(FakeOwner(), {
+        'spec': 'mozilla::net::nsHttpChannel::OnStartRequest',
+        'capture': [['aChannel', 'mURI', 'mRawPtr', 'mSpec'],
+                    ['aStatus']],
+        'stack': True})
+    def run():
+        for i in range(100 * scale):
+            # (gdb resuming from the last hit)
+            gdb.events.cont._fire(None)
+            bp._gather_data()
+    return run
+
+SCENARIOS = [
+    ('cbt', cbt_scenario('')),
+    ('cbt-terse', cbt_scenario('terse')),
+    ('cbt-full', cbt_scenario('full', depth=50)),
+    ('cbt-recursion', cbt_recursion),
+    ('cbt-json', cbt_json),
+    ('pp-startup', pp_startup),
+    ('pp-channel', pp_scenario(workloads.build_channels, 1, 'gChannel')),
+    ('pp-channels', pp_scenario(workloads.build_channels, 20, 'gChannels')),
+    ('pp-channels-json', pp_scenario(
+        workloads.build_channels, 20,
+        '/json ' + os.path.join(tempfile.gettempdir(), 'gdbaudy-bench-pp.json')
+        + ' gChannels')),
+    ('pp-channels-fit', pp_scenario(workloads.build_channels, 20,
+                                    '/lines=50 gChannels')),
+    ('pp-channels-snap', pp_scenario(workloads.build_channels, 20,
+                                     '/snap bench gChannels')),
+    ('pp-channels-diff', pp_diff),
+    ('pp-int-array', pp_scenario(workloads.build_int_array, 2000, 'gInts')),
+    ('pp-linked-list', pp_scenario(workloads.build_linked_list, 200, 'gList')),
+    ('pp-hashtable-lookup', pp_scenario(
+        workloads.build_hashtables, 5000,
+        'gRegistrations["https://example.com/scope/1234/"]')),
+    ('pp-hashtable-collisions', hashtable_collisions),
+    ('capture', capture),
+    ('capture-revisit', capture_revisit),
+    ('trice-gather', trice_gather),
+]
+
+
+def run_scenario(setup, scale, repeat):
+    best = None
+    for i in range(repeat):
+        fn = setup(scale)
+        gdb.calls.clear()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+        counts = dict(gdb.calls)
+
+    fn = setup(scale)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, counts, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--calls', action='store_true',
+                        help='list every gdb API call count per scenario')
+    parser.add_argument('names', nargs='*')
+    args = parser.parse_args()
+
+    print('%-16s %10s %12s %10s  %s' % ('scenario', 'time (s)', 'gdb calls',
+                                         'peak KiB', 'busiest calls'))
+    for name, setup in SCENARIOS:
+        if args.names and not any(name.startswith(n) for n in args.names):
+            continue
+        elapsed, counts, peak = run_scenario(setup, args.scale, args.repeat)
+        api = dict((k, v) for k, v in counts.items() if ':' not in k)
+        ranked = sorted(api.items(), key=lambda pair: -pair[1])
+        print('%-16s %10.4f %12d %10d  %s' % (
+            name, elapsed, sum(api.values()), peak // 1024,
+            ', '.join('%s=%d' % pair for pair in ranked[:3])))
+        if args.calls:
+            for key, count in sorted(counts.items()):
+                print('    %-40s %d' % (key, count))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+# A cut down gdb/FrameDecorator.py; cbt only asks for the inferior frame.
+
+class FrameDecorator(object):
+    def __init__(self, base):
+        self._base = base
+
+    def inferior_frame(self):
+        if hasattr(self._base, 'inferior_frame'):
+            return self._base.inferior_frame()
+        return self._base
+
+    def function(self):
+        return self._base.name()
@@ -0,0 +1,21 @@
+# Same as gdb's gdb/FrameIterator.py.
+
+class FrameIterator(object):
+    """An iterator that iterates over frames."""
+
+    def __init__(self, frame_obj):
+        "Initialize a FrameIterator.  FRAME_OBJ is the starting frame."
+        super(FrameIterator, self).__init__()
+        self.frame = frame_obj
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        result = self.frame
+        if result is None:
+            raise StopIteration
+        self.frame = result.older()
+        return result
+
+    __next__ = next
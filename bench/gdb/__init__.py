@@ -0,0 +1,1211 @@
+# A stand-in for gdb's python module so that gdbaudy can be exercised (and
+# measured) without a live gdb.  Only the subset of the API that gdbaudy uses
+# is implemented, but it is implemented for real: values live in a fake
+# inferior's memory (a bytearray) and are decoded from it according to their
+# types, frames have blocks of symbols whose values are read from that memory,
+# etc.  Every API entry point bumps a counter in `calls` so that benchmarks
+# can report how chatty the code under test is with gdb.
+#
+# Workloads are built with the helpers at the bottom of this file (see
+# bench/workloads.py) and installed with `reset()`.
+
+import collections
+import operator as _ops
+import shlex
+import struct
+
+calls = collections.Counter()
+
+def _counted(fn):
+    key = fn.__qualname__
+    def wrapper(*args, **kwargs):
+        calls[key] += 1
+        return fn(*args, **kwargs)
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+def _counted_property(fn):
+    return property(_counted(fn))
+
+
+### Constants
+
+(TYPE_CODE_PTR, TYPE_CODE_ARRAY, TYPE_CODE_STRUCT, TYPE_CODE_UNION,
+ TYPE_CODE_ENUM, TYPE_CODE_FLAGS, TYPE_CODE_FUNC, TYPE_CODE_INT,
+ TYPE_CODE_FLT, TYPE_CODE_VOID, TYPE_CODE_SET, TYPE_CODE_RANGE,
+ TYPE_CODE_STRING, TYPE_CODE_BITSTRING, TYPE_CODE_ERROR, TYPE_CODE_METHOD,
+ TYPE_CODE_METHODPTR, TYPE_CODE_MEMBERPTR, TYPE_CODE_REF, TYPE_CODE_RVALUE_REF,
+ TYPE_CODE_CHAR, TYPE_CODE_BOOL, TYPE_CODE_COMPLEX, TYPE_CODE_TYPEDEF,
+ TYPE_CODE_NAMESPACE, TYPE_CODE_DECFLOAT, TYPE_CODE_INTERNAL_FUNCTION) = \
+    range(1, 28)
+
+(NORMAL_FRAME, DUMMY_FRAME, INLINE_FRAME, TAILCALL_FRAME, SIGTRAMP_FRAME,
+ ARCH_FRAME, SENTINEL_FRAME) = range(7)
+
+(SYMBOL_LOC_UNDEF, SYMBOL_LOC_CONST, SYMBOL_LOC_STATIC, SYMBOL_LOC_REGISTER,
+ SYMBOL_LOC_ARG, SYMBOL_LOC_REF_ARG, SYMBOL_LOC_LOCAL, SYMBOL_LOC_TYPEDEF,
+ SYMBOL_LOC_LABEL, SYMBOL_LOC_BLOCK, SYMBOL_LOC_CONST_BYTES,
+ SYMBOL_LOC_UNRESOLVED, SYMBOL_LOC_OPTIMIZED_OUT, SYMBOL_LOC_COMPUTED) = \
+    range(14)
+
+(COMMAND_NONE, COMMAND_RUNNING, COMMAND_DATA, COMMAND_STACK, COMMAND_FILES,
+ COMMAND_SUPPORT, COMMAND_STATUS, COMMAND_BREAKPOINTS, COMMAND_TRACEPOINTS,
+ COMMAND_OBSCURE, COMMAND_MAINTENANCE, COMMAND_USER) = range(12)
+
+(COMPLETE_NONE, COMPLETE_FILENAME, COMPLETE_LOCATION, COMPLETE_COMMAND,
+ COMPLETE_SYMBOL, COMPLETE_EXPRESSION) = range(6)
+
+
+### Exceptions
+
+class error(RuntimeError):
+    pass
+
+class MemoryError(error):
+    pass
+
+class GdbError(Exception):
+    pass
+
+
+### Events
+
+class EventRegistry(object):
+    def __init__(self):
+        self.listeners = []
+
+    def connect(self, fn):
+        self.listeners.append(fn)
+
+    def disconnect(self, fn):
+        if fn in self.listeners:
+            self.listeners.remove(fn)
+
+    def _fire(self, event):
+        for fn in list(self.listeners):
+            fn(event)
+
+class _Events(object):
+    def __init__(self):
+        for name in ('stop', 'cont', 'new_objfile', 'clear_objfiles',
+                     'new_thread', 'memory_changed'):
+            setattr(self, name, EventRegistry())
+
+events = _Events()
+
+class NewObjFileEvent(object):
+    def __init__(self, new_objfile):
+        self.new_objfile = new_objfile
+
+class NewThreadEvent(object):
+    def __init__(self, inferior_thread):
+        self.inferior_thread = inferior_thread
+
+
+### Types
+
+class Field(object):
+    def __init__(self, name, type, bitpos=None, bitsize=0, enumval=None,
+                 is_base_class=False, artificial=False, parent_type=None):
+        self.name = name
+        self.type = type
+        # Static members have no bitpos in gdb, so we don't either.
+        if bitpos is not None:
+            self.bitpos = bitpos
+        self.bitsize = bitsize
+        if enumval is not None:
+            self.enumval = enumval
+        self.is_base_class = is_base_class
+        self.artificial = artificial
+        self.parent_type = parent_type
+
+class Type(object):
+    def __init__(self, code, name=None, sizeof=0, target=None, fields=None,
+                 template_args=None, signed=False, length=None):
+        self.code = code
+        self.name = name
+        self.tag = name if code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION,
+                                    TYPE_CODE_ENUM) else None
+        self.sizeof = sizeof
+        self._target = target
+        self._fields = fields or []
+        self._template_args = template_args or []
+        self._signed = signed
+        self._length = length
+        self._pointer = None
+        self._reference = None
+        self._arrays = {}
+
+    def __str__(self):
+        if self.name:
+            return self.name
+        if self.code == TYPE_CODE_PTR:
+            return str(self._target) + ' *'
+        if self.code == TYPE_CODE_REF:
+            return str(self._target) + ' &'
+        if self.code == TYPE_CODE_ARRAY:
+            return '%s [%d]' % (self._target, self._length)
+        return '<anonymous>'
+
+    def __repr__(self):
+        return '<fake gdb.Type %s>' % self
+
+    @_counted
+    def fields(self):
+        return list(self._fields)
+
+    def keys(self):
+        return [f.name for f in self._fields]
+
+    @_counted
+    def strip_typedefs(self):
+        return self._strip()
+
+    @_counted
+    def unqualified(self):
+        return self
+
+    @_counted
+    def target(self):
+        if self._target is None:
+            raise RuntimeError('Type does not have a target.')
+        return self._target
+
+    @_counted
+    def pointer(self):
+        if self._pointer is None:
+            self._pointer = Type(TYPE_CODE_PTR, sizeof=8, target=self)
+        return self._pointer
+
+    @_counted
+    def reference(self):
+        if self._reference is None:
+            self._reference = Type(TYPE_CODE_REF, sizeof=8, target=self)
+        return self._reference
+
+    @_counted
+    def array(self, n1, n2=None):
+        if n2 is None:
+            n1, n2 = 0, n1
+        length = n2 - n1 + 1
+        if length not in self._arrays:
+            self._arrays[length] = Type(TYPE_CODE_ARRAY,
+                                        sizeof=self.sizeof * length,
+                                        target=self, length=length)
+        return self._arrays[length]
+
+    @_counted
+    def range(self):
+        if self.code != TYPE_CODE_ARRAY:
+            raise RuntimeError('This type does not have a range.')
+        return (0, self._length - 1)
+
+    @_counted
+    def template_argument(self, n):
+        if n >= len(self._template_args):
+            raise RuntimeError('Template argument number %d out of range.' % n)
+        return self._template_args[n]
+
+    ## helpers (not gdb API)
+    def _strip(self):
+        t = self
+        while t.code == TYPE_CODE_TYPEDEF:
+            t = t._target
+        return t
+
+    def _find_field(self, name):
+        '''
+        Return (byte offset, Field) for `name`, searching base classes the way
+        gdb does.
+        '''
+        t = self._strip()
+        for f in t._fields:
+            if f.name == name and not f.is_base_class:
+                return getattr(f, 'bitpos', 0) // 8, f
+        for f in t._fields:
+            if f.is_base_class:
+                found = f.type._find_field(name)
+                if found:
+                    return f.bitpos // 8 + found[0], found[1]
+        return None
+
+_INT_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+
+### Values
+
+def _to_int(v):
+    if isinstance(v, Value):
+        return v._as_int()
+    return int(v)
+
+class Value(object):
+    '''
+    A value of some type that either lives in inferior memory at an address
+    (an lvalue) or is a free-standing bag of bytes.
+    '''
+    def __init__(self, val, type=None, address=None):
+        calls['Value.__init__'] += 1
+        if isinstance(val, Value):
+            self._type, self._address, self._bytes = \
+                val._type, val._address, val._bytes
+            return
+        if type is None and address is None:
+            if isinstance(val, bool):
+                type = _builtin('bool')
+            elif isinstance(val, int):
+                type = _builtin('long')
+            elif isinstance(val, float):
+                type = _builtin('double')
+            elif isinstance(val, str):
+                data = val.encode('utf-8') + b'\0'
+                type = _builtin('char').array(len(data) - 1)
+                self._type, self._address, self._bytes = type, None, data
+                return
+        self._type = type
+        self._address = address
+        self._bytes = None
+        if address is None:
+            self._bytes = _encode(type, val)
+
+    @classmethod
+    def _at(cls, type, address):
+        v = cls.__new__(cls)
+        v._type = type
+        v._address = address
+        v._bytes = None
+        return v
+
+    @classmethod
+    def _of(cls, pyval, type):
+        return cls._from_bytes(type, _encode(type, pyval))
+
+    @classmethod
+    def _from_bytes(cls, type, data):
+        v = cls.__new__(cls)
+        v._type = type
+        v._address = None
+        v._bytes = data
+        return v
+
+    def _data(self):
+        if self._bytes is None:
+            self._bytes = _inferior._read(self._address,
+                                          self._type._strip().sizeof)
+        return self._bytes
+
+    def _as_int(self):
+        t = self._type._strip()
+        if t.code == TYPE_CODE_FLT:
+            return int(self._as_float())
+        if t.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION, TYPE_CODE_ARRAY):
+            raise error('Cannot convert value to long.')
+        data = self._data()
+        signed = t._signed and t.code not in (TYPE_CODE_PTR, TYPE_CODE_REF)
+        return int.from_bytes(data[:t.sizeof], 'little', signed=signed)
+
+    def _as_float(self):
+        t = self._type._strip()
+        return struct.unpack(t.sizeof == 4 and '<f' or '<d', self._data())[0]
+
+    def _is_float(self):
+        return self._type._strip().code == TYPE_CODE_FLT
+
+    @_counted_property
+    def type(self):
+        return self._type
+
+    @_counted_property
+    def dynamic_type(self):
+        t = self._type._strip()
+        if t.code in (TYPE_CODE_PTR, TYPE_CODE_REF):
+            pointee = self._as_int()
+            dyn = _inferior._dynamic_types.get(pointee)
+            if dyn is not None:
+                return t.code == TYPE_CODE_PTR and dyn.pointer() or \
+                       dyn.reference()
+        elif self._address is not None:
+            dyn = _inferior._dynamic_types.get(self._address)
+            if dyn is not None:
+                return dyn
+        return self._type
+
+    @_counted_property
+    def address(self):
+        if self._address is None:
+            return None
+        return Value._from_bytes(self._type.pointer(),
+                                 self._address.to_bytes(8, 'little'))
+
+    @_counted_property
+    def is_optimized_out(self):
+        return False
+
+    @_counted_property
+    def is_lazy(self):
+        return self._bytes is None
+
+    @_counted
+    def fetch_lazy(self):
+        self._data()
+
+    @_counted
+    def cast(self, type):
+        src = self._type._strip()
+        dst = type._strip()
+        if dst.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION):
+            if self._address is None:
+                raise error('Invalid cast.')
+            return Value._at(type, self._address)
+        if src.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION):
+            raise error('Invalid cast.')
+        if dst.code == TYPE_CODE_FLT:
+            return Value._of(float(self), type)
+        return Value._of(self._as_int(), type)
+
+    reinterpret_cast = cast
+    dynamic_cast = cast
+
+    @_counted
+    def dereference(self):
+        t = self._type._strip()
+        if t.code not in (TYPE_CODE_PTR, TYPE_CODE_REF):
+            raise error('Attempt to take contents of a non-pointer value.')
+        return Value._at(t._target, self._as_int())
+
+    @_counted
+    def referenced_value(self):
+        t = self._type._strip()
+        if t.code not in (TYPE_CODE_PTR, TYPE_CODE_REF):
+            raise error('Trying to get the referenced value from a value '
+                        'which is neither a pointer nor a reference.')
+        return Value._at(t._target, self._as_int())
+
+    @_counted
+    def __getitem__(self, key):
+        t = self._type._strip()
+        if isinstance(key, (int, Value)):
+            idx = _to_int(key)
+            if t.code == TYPE_CODE_ARRAY:
+                base = self._address
+                if base is None:
+                    elt = t._target._strip().sizeof
+                    return Value._from_bytes(t._target,
+                                             self._bytes[idx * elt:
+                                                         (idx + 1) * elt])
+                return Value._at(t._target,
+                                 base + idx * t._target._strip().sizeof)
+            if t.code == TYPE_CODE_PTR:
+                return Value._at(t._target, self._as_int() +
+                                 idx * t._target._strip().sizeof)
+            raise error('Cannot subscript requested type.')
+        if t.code in (TYPE_CODE_PTR, TYPE_CODE_REF):
+            # gdb lets you use "." on pointers in the python API too.
+            return self.dereference()[key]
+        found = t._find_field(key)
+        if not found:
+            raise error('There is no member named %s.' % key)
+        offset, field = found
+        if not hasattr(field, 'bitpos'):
+            return _inferior._statics[(t.name, key)]
+        if self._address is None:
+            size = field.type._strip().sizeof
+            return Value._from_bytes(field.type,
+                                     self._bytes[offset:offset + size])
+        return Value._at(field.type, self._address + offset)
+
+    @_counted
+    def string(self, encoding=None, errors=None, length=-1):
+        t = self._type._strip()
+        if t.code == TYPE_CODE_ARRAY:
+            addr = self._address
+        else:
+            addr = self._as_int()
+        if addr is None:
+            data = self._bytes
+            end = data.find(b'\0')
+            return data[:end if end >= 0 else None].decode(encoding or 'utf-8')
+        return _inferior._read_cstring(addr, length).decode(
+            encoding or 'utf-8', errors or 'strict')
+
+    @_counted
+    def format_string(self, **kwargs):
+        return _format(self, 0)
+
+    @_counted
+    def __str__(self):
+        return _format(self, 0)
+
+    def __repr__(self):
+        return '<fake gdb.Value %s>' % _format(self, 0)
+
+    @_counted
+    def __bool__(self):
+        t = self._type._strip()
+        if t.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION, TYPE_CODE_ARRAY):
+            # gdb considers all other values true.
+            return True
+        if t.code == TYPE_CODE_FLT:
+            return self._as_float() != 0.0
+        return self._as_int() != 0
+
+    __nonzero__ = __bool__
+
+    @_counted
+    def __int__(self):
+        return self._as_int()
+
+    @_counted
+    def __index__(self):
+        return self._as_int()
+
+    @_counted
+    def __float__(self):
+        if self._is_float():
+            return self._as_float()
+        return float(self._as_int())
+
+    def _binop(self, other, op):
+        calls['Value.' + op.__name__] += 1
+        t = self._type._strip()
+        if t.code == TYPE_CODE_PTR and op.__name__ in ('add', 'sub'):
+            if isinstance(other, Value) and \
+               other._type._strip().code == TYPE_CODE_PTR:
+                return Value._of((self._as_int() - other._as_int()) //
+                                 (t._target._strip().sizeof or 1),
+                                 _builtin('long'))
+            step = t._target._strip().sizeof or 1
+            return Value._of(op(self._as_int(), _to_int(other) * step),
+                             self._type)
+        if self._is_float() or isinstance(other, float):
+            return Value._of(op(float(self), float(other)), _builtin('double'))
+        return Value._of(op(self._as_int(), _to_int(other)), self._type)
+
+    def __add__(self, other):
+        return self._binop(other, _ops.add)
+    def __radd__(self, other):
+        return self._binop(other, _ops.add)
+    def __sub__(self, other):
+        return self._binop(other, _ops.sub)
+    def __mul__(self, other):
+        return self._binop(other, _ops.mul)
+    def __or__(self, other):
+        return self._binop(other, _ops.or_)
+    def __and__(self, other):
+        return self._binop(other, _ops.and_)
+    def __lshift__(self, other):
+        return self._binop(other, _ops.lshift)
+    def __rshift__(self, other):
+        return self._binop(other, _ops.rshift)
+
+    def _cmp_key(self):
+        if self._is_float():
+            return self._as_float()
+        return self._as_int()
+
+    @_counted
+    def __eq__(self, other):
+        if other is None:
+            return False
+        if isinstance(other, Value):
+            return self._cmp_key() == other._cmp_key()
+        return self._cmp_key() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        return self._cmp_key() < _to_int(other)
+
+    def __gt__(self, other):
+        return self._cmp_key() > _to_int(other)
+
+    __hash__ = object.__hash__
+
+def _encode(type, val):
+    t = type._strip()
+    if t.code == TYPE_CODE_FLT:
+        return struct.pack(t.sizeof == 4 and '<f' or '<d', float(val))
+    if t.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION, TYPE_CODE_ARRAY):
+        if isinstance(val, (bytes, bytearray)):
+            return bytes(val)
+        raise error('Cannot create a free-standing %s' % type)
+    size = t.sizeof
+    return (_to_int(val) & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+
+def _format_scalar(v, t):
+    code = t.code
+    if code == TYPE_CODE_BOOL:
+        return v._as_int() and 'true' or 'false'
+    if code == TYPE_CODE_FLT:
+        return repr(v._as_float())
+    if code == TYPE_CODE_ENUM:
+        num = v._as_int()
+        for f in t._fields:
+            if f.enumval == num:
+                return f.name
+        return '%d' % num
+    if code in (TYPE_CODE_PTR, TYPE_CODE_REF):
+        addr = v._as_int()
+        s = '0x%x' % addr
+        target = t._target._strip()
+        if target.code == TYPE_CODE_INT and target.sizeof == 1 and addr:
+            try:
+                s += ' "%s"' % _inferior._read_cstring(addr, 200).decode(
+                    'utf-8', 'replace')
+            except MemoryError:
+                s += ' <error: Cannot access memory at address 0x%x>' % addr
+        if code == TYPE_CODE_REF:
+            s = '@' + s + ': ' + _format(Value._at(t._target, addr), 0)
+        return s
+    num = v._as_int()
+    if code == TYPE_CODE_INT and t.sizeof == 1:
+        return "%d '%s'" % (num, chr(num & 0xff) if 32 <= (num & 0xff) < 127
+                            else '\\%03o' % (num & 0xff))
+    return '%d' % num
+
+def _format(v, depth):
+    '''gdb-ish "print" formatting, recursing into aggregates the way gdb does'''
+    t = v._type._strip()
+    if t.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION):
+        bits = []
+        for f in t._fields:
+            if not hasattr(f, 'bitpos'):
+                continue
+            fv = Value._at(f.type, v._address + f.bitpos // 8) \
+                if v._address is not None else \
+                Value._from_bytes(f.type, v._bytes[f.bitpos // 8:])
+            if f.is_base_class:
+                bits.append('<%s> = %s' % (f.name, _format(fv, depth + 1)))
+            else:
+                bits.append('%s = %s' % (f.name, _format(fv, depth + 1)))
+        return '{' + ', '.join(bits) + '}'
+    if t.code == TYPE_CODE_ARRAY:
+        elt = t._target._strip()
+        if elt.code == TYPE_CODE_INT and elt.sizeof == 1:
+            return '"%s"' % v.string()
+        return '{' + ', '.join(_format(v[i], depth + 1)
+                               for i in range(min(t._length, 200))) + '}'
+    return _format_scalar(v, t)
+
+
+### Symbols, blocks, frames
+
+class Symtab(object):
+    def __init__(self, filename, objfile=None):
+        self.filename = filename
+        self.objfile = objfile
+
+    def fullname(self):
+        return self.filename
+
+    def is_valid(self):
+        return True
+
+class Symtab_and_line(object):
+    def __init__(self, symtab, line, pc=0):
+        self.symtab = symtab
+        self.line = line
+        self.pc = pc
+        self.last = None
+
+    def is_valid(self):
+        return True
+
+class Symbol(object):
+    def __init__(self, name, type, is_argument=False, addr_class=None,
+                 linkage_name=None, symtab=None, line=0, value=None):
+        self.name = name
+        self.print_name = name
+        self.linkage_name = name if linkage_name is None else linkage_name
+        self.type = type
+        self.is_argument = is_argument
+        self.is_variable = not is_argument
+        self.is_function = False
+        self.is_constant = False
+        self.addr_class = (addr_class if addr_class is not None else
+                           is_argument and SYMBOL_LOC_ARG or SYMBOL_LOC_LOCAL)
+        self.symtab = symtab
+        self.line = line
+        # (the Value for this symbol; frames look their values up by symbol)
+        self._value = value
+
+    def is_valid(self):
+        return True
+
+    @_counted
+    def value(self, frame=None):
+        return self._value
+
+class Block(object):
+    def __init__(self, symbols, function=None, superblock=None, start=0,
+                 end=0):
+        self._symbols = symbols
+        self.function = function
+        self.superblock = superblock
+        self.start = start
+        self.end = end
+        self.global_block = None
+        self.static_block = None
+
+    def __iter__(self):
+        calls['Block.__iter__'] += 1
+        return iter(self._symbols)
+
+    def is_valid(self):
+        return True
+
+class Frame(object):
+    def __init__(self, name, pc, sal, block=None, type=NORMAL_FRAME):
+        self._name = name
+        self._pc = pc
+        self._sal = sal
+        self._block = block
+        self._type = type
+        self._older = None
+        self._newer = None
+
+    @_counted
+    def name(self):
+        return self._name
+
+    @_counted
+    def pc(self):
+        return self._pc
+
+    @_counted
+    def find_sal(self):
+        return self._sal
+
+    @_counted
+    def block(self):
+        if self._block is None:
+            raise RuntimeError('Cannot locate block for frame.')
+        return self._block
+
+    @_counted
+    def function(self):
+        return self._block and self._block.function
+
+    @_counted
+    def type(self):
+        return self._type
+
+    @_counted
+    def older(self):
+        return self._older
+
+    @_counted
+    def newer(self):
+        return self._newer
+
+    @_counted
+    def read_var(self, variable, block=None):
+        if isinstance(variable, str):
+            b = self._block
+            while b is not None:
+                for sym in b._symbols:
+                    if sym.name == variable:
+                        return sym._value
+                b = b.superblock
+            raise ValueError("Variable '%s' not found." % variable)
+        return variable._value
+
+    @_counted
+    def select(self):
+        _inferior._selected_thread._selected_frame = self
+
+    def is_valid(self):
+        return True
+
+    def unwind_stop_reason(self):
+        return 0
+
+    def __eq__(self, other):
+        return self is other
+
+    __hash__ = object.__hash__
+
+
+### Threads and inferiors
+
+class InferiorThread(object):
+    def __init__(self, num, lwp, name=None, newest=None):
+        self.num = num
+        self.global_num = num
+        self.ptid = (_inferior.pid, lwp, 0)
+        self.name = name
+        self.inferior = _inferior
+        self._newest = newest
+        self._selected_frame = None
+
+    @_counted
+    def switch(self):
+        _inferior._selected_thread = self
+
+    def is_valid(self):
+        return True
+
+    def is_stopped(self):
+        return True
+
+class Inferior(object):
+    '''
+    The fake process: a sparse memory (one bytearray per allocation), threads,
+    globals and the RTTI table that dynamic_type consults.
+    '''
+    def __init__(self, pid=4242):
+        self.num = 1
+        self.pid = pid
+        self._regions = []
+        self._next_addr = 0x10000
+        self._threads = []
+        self._selected_thread = None
+        self._dynamic_types = {}
+        self._statics = {}
+
+    @_counted
+    def threads(self):
+        return tuple(self._threads)
+
+    @_counted
+    def read_memory(self, address, length):
+        calls['Inferior.read_memory:bytes'] += int(length)
+        return memoryview(self._read(int(address), int(length)))
+
+    @_counted
+    def write_memory(self, address, buffer, length=None):
+        data = bytes(buffer)
+        if length is not None:
+            data = data[:length]
+        self._write(int(address), data)
+
+    def is_valid(self):
+        return True
+
+    ## memory helpers (not gdb API)
+    def _alloc(self, size, align=8):
+        addr = (self._next_addr + align - 1) & ~(align - 1)
+        size = max(size, 1)
+        self._regions.append((addr, addr + size, bytearray(size)))
+        self._next_addr = addr + size + 16
+        return addr
+
+    def _region(self, address):
+        # allocations are made in increasing address order, so bisect.
+        lo, hi = 0, len(self._regions)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._regions[mid][0] <= address:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo:
+            region = self._regions[lo - 1]
+            if region[0] <= address < region[1]:
+                return region
+        raise MemoryError('Cannot access memory at address 0x%x' % address)
+
+    def _read(self, address, length):
+        if not length:
+            return b''
+        start, end, data = self._region(address)
+        if address + length > end:
+            raise MemoryError('Cannot access memory at address 0x%x' % end)
+        return bytes(data[address - start:address - start + length])
+
+    def _write(self, address, data):
+        start, end, buf = self._region(address)
+        if address + len(data) > end:
+            raise MemoryError('Cannot access memory at address 0x%x' % end)
+        buf[address - start:address - start + len(data)] = data
+
+    def _read_cstring(self, address, length=-1):
+        start, end, data = self._region(address)
+        offset = address - start
+        stop = data.find(b'\0', offset)
+        if stop < 0:
+            stop = end - start
+        if length >= 0:
+            stop = min(stop, offset + length)
+        return bytes(data[offset:stop])
+
+class Objfile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.pretty_printers = []
+
+    def is_valid(self):
+        return True
+
+
+### Commands and breakpoints
+
+_commands = {}
+_execute_handlers = {}
+
+class Command(object):
+    def __init__(self, name, command_class, completer_class=COMPLETE_NONE,
+                 prefix=False):
+        _commands[name] = self
+
+    def dont_repeat(self):
+        pass
+
+class Parameter(object):
+    def __init__(self, name, command_class, parameter_class, *args):
+        self.value = None
+
+breakpoints_list = []
+
+class Breakpoint(object):
+    def __init__(self, spec, type=None, wp_class=None, internal=False,
+                 temporary=False):
+        self.location = spec
+        self.enabled = True
+        self.hit_count = 0
+        self.number = len(breakpoints_list) + 1
+        breakpoints_list.append(self)
+
+    def delete(self):
+        if self in breakpoints_list:
+            breakpoints_list.remove(self)
+
+    def is_valid(self):
+        return self in breakpoints_list
+
+@_counted
+def breakpoints():
+    return tuple(breakpoints_list)
+
+
+### Module-level API
+
+pretty_printers = []
+frame_filters = {}
+_types = {}
+_globals = {}
+_solibs = []
+_objfiles = []
+
+@_counted
+def newest_frame():
+    return _inferior._selected_thread._newest
+
+@_counted
+def selected_frame():
+    thread = _inferior._selected_thread
+    return thread._selected_frame or thread._newest
+
+@_counted
+def selected_thread():
+    return _inferior._selected_thread
+
+@_counted
+def selected_inferior():
+    return _inferior
+
+@_counted
+def inferiors():
+    return (_inferior,)
+
+@_counted
+def objfiles():
+    return list(_objfiles)
+
+@_counted
+def lookup_type(name, block=None):
+    t = _types.get(name)
+    if t is None:
+        raise error('No type named %s.' % name)
+    return t
+
+@_counted
+def lookup_symbol(name, block=None, domain=None):
+    b = block
+    while b is not None:
+        for sym in b._symbols:
+            if sym.linkage_name == name or sym.name == name:
+                return sym, False
+        b = b.superblock
+    val = _globals.get(name)
+    if val is not None:
+        return Symbol(name, val._type, addr_class=SYMBOL_LOC_STATIC,
+                      value=val), False
+    return None, False
+
+@_counted
+def lookup_global_symbol(name, domain=None):
+    return lookup_symbol(name)[0]
+
+@_counted
+def solib_name(addr):
+    addr = int(addr)
+    for lo, hi, name in _solibs:
+        if lo <= addr < hi:
+            return name
+    return None
+
+@_counted
+def block_for_pc(pc):
+    return None
+
+@_counted
+def default_visualizer(value):
+    for objfile in _objfiles:
+        for printer in objfile.pretty_printers:
+            found = _try_printer(printer, value)
+            if found is not None:
+                return found
+    for printer in pretty_printers:
+        found = _try_printer(printer, value)
+        if found is not None:
+            return found
+    return None
+
+def _try_printer(printer, value):
+    if hasattr(printer, 'enabled') and not printer.enabled:
+        return None
+    return printer(value)
+
+@_counted
+def string_to_argv(arg):
+    return shlex.split(arg)
+
+@_counted
+def execute(command, from_tty=False, to_string=False):
+    word, _, rest = command.strip().partition(' ')
+    # longest registered prefix wins, so "info thread" beats "info".
+    handler = None
+    for key in sorted(_execute_handlers, key=len, reverse=True):
+        if command.strip() == key or command.strip().startswith(key + ' '):
+            handler = _execute_handlers[key]
+            rest = command.strip()[len(key):].strip()
+            break
+    if handler is not None:
+        out = handler(rest)
+    elif word in _commands:
+        out = _commands[word].invoke(rest, from_tty)
+    else:
+        raise error('Undefined command: "%s".' % word)
+    if to_string:
+        return out or ''
+    if out:
+        print(out, end='')
+
+@_counted
+def parse_and_eval(expression):
+    '''
+    Only a tiny C-ish subset: a global or local name, followed by any number of
+    ".field" / "->field" steps.  Good enough for singletons and captures.
+    '''
+    expr = expression.strip()
+    if expr.lstrip('-').isdigit():
+        return Value._of(int(expr), _builtin('long'))
+    steps = expr.replace('->', '.').split('.')
+    root = steps[0]
+    val = _globals.get(root)
+    if val is None:
+        frame = selected_frame()
+        if frame is not None:
+            try:
+                val = frame.read_var(root)
+            except ValueError:
+                pass
+    if val is None:
+        raise error('No symbol "%s" in current context.' % root)
+    for step in steps[1:]:
+        val = val[step]
+    return val
+
+@_counted
+def post_event(fn):
+    fn()
+
+def write(s, stream=None):
+    print(s, end='')
+
+def flush(stream=None):
+    pass
+
+
+### Workload-building helpers (not gdb API)
+
+_BUILTINS = {}
+
+def _builtin(name):
+    return _BUILTINS[name]
+
+def _make_builtins():
+    def add(name, code, size, signed=False):
+        t = Type(code, name, size, signed=signed)
+        _BUILTINS[name] = t
+        return t
+    add('void', TYPE_CODE_VOID, 1)
+    add('bool', TYPE_CODE_BOOL, 1)
+    add('char', TYPE_CODE_INT, 1, True)
+    add('signed char', TYPE_CODE_INT, 1, True)
+    add('unsigned char', TYPE_CODE_INT, 1)
+    add('char16_t', TYPE_CODE_CHAR, 2)
+    add('short', TYPE_CODE_INT, 2, True)
+    add('unsigned short', TYPE_CODE_INT, 2)
+    add('int', TYPE_CODE_INT, 4, True)
+    add('unsigned int', TYPE_CODE_INT, 4)
+    add('long', TYPE_CODE_INT, 8, True)
+    add('unsigned long', TYPE_CODE_INT, 8)
+    add('long long', TYPE_CODE_INT, 8, True)
+    add('unsigned long long', TYPE_CODE_INT, 8)
+    add('float', TYPE_CODE_FLT, 4)
+    add('double', TYPE_CODE_FLT, 8)
+    for bits, base in ((8, 'char'), (16, 'short'), (32, 'int'), (64, 'long')):
+        signed = 'signed char' if base == 'char' else base
+        _BUILTINS['int%d_t' % bits] = Type(
+            TYPE_CODE_TYPEDEF, 'int%d_t' % bits, target=_BUILTINS[signed])
+        _BUILTINS['uint%d_t' % bits] = Type(
+            TYPE_CODE_TYPEDEF, 'uint%d_t' % bits,
+            target=_BUILTINS['unsigned ' + base])
+    for t in list(_BUILTINS.values()):
+        if t.code == TYPE_CODE_TYPEDEF:
+            t.sizeof = t._target.sizeof
+
+_make_builtins()
+
+def _align_of(t):
+    t = t._strip()
+    if t.code in (TYPE_CODE_STRUCT, TYPE_CODE_UNION):
+        return max([_align_of(f.type) for f in t._fields
+                    if hasattr(f, 'bitpos')] or [1])
+    if t.code == TYPE_CODE_ARRAY:
+        return _align_of(t._target)
+    return max(1, min(t.sizeof, 8))
+
+def make_struct(name, fields, bases=(), template_args=None, statics=()):
+    '''
+    Lay out a struct.  `fields` is a list of (name, Type) pairs, `bases` a list
+    of struct Types that become base-class fields up front, and `statics` a
+    list of (name, Type) pairs that get no storage (see `set_static`).
+    '''
+    t = Type(TYPE_CODE_STRUCT, name, template_args=template_args)
+    offset = 0
+    out = []
+    for base in bases:
+        align = _align_of(base)
+        offset = (offset + align - 1) & ~(align - 1)
+        out.append(Field(base.name, base, offset * 8, is_base_class=True,
+                         parent_type=t))
+        offset += base.sizeof
+    for fname, ftype in fields:
+        align = _align_of(ftype)
+        offset = (offset + align - 1) & ~(align - 1)
+        out.append(Field(fname, ftype, offset * 8, parent_type=t))
+        offset += ftype._strip().sizeof
+    for fname, ftype in statics:
+        out.append(Field(fname, ftype, parent_type=t))
+    align = max([_align_of(f.type) for f in out if hasattr(f, 'bitpos')] or
+                [1])
+    t.sizeof = max((offset + align - 1) & ~(align - 1), 1)
+    t._fields = out
+    return t
+
+def make_enum(name, values, size=4):
+    fields = [Field(n, None, enumval=v) for n, v in values]
+    t = Type(TYPE_CODE_ENUM, name, size, fields=fields, signed=True)
+    for f in fields:
+        f.type = t
+    return t
+
+def make_typedef(name, target):
+    t = Type(TYPE_CODE_TYPEDEF, name, target=target)
+    t.sizeof = target._strip().sizeof
+    return t
+
+def register_type(t, name=None):
+    _types[name or t.name] = t
+    return t
+
+def alloc(type, count=1):
+    '''Allocate zeroed storage for `count` `type`s, returning the address.'''
+    t = type._strip()
+    return _inferior._alloc(t.sizeof * count, _align_of(t))
+
+def new(type, **fields):
+    '''Allocate a `type` and return a Value for it, setting fields by name.'''
+    addr = alloc(type)
+    val = Value._at(type, addr)
+    for name, pyval in fields.items():
+        store(val[name], pyval)
+    return val
+
+def store(lvalue, pyval):
+    '''Write a python int/float/bool/address or Value into an lvalue.'''
+    if isinstance(pyval, Value):
+        if pyval._type._strip().code in (TYPE_CODE_STRUCT,
+                                                 TYPE_CODE_UNION):
+            data = pyval._data()
+        else:
+            data = _encode(lvalue._type, pyval._as_int())
+    else:
+        data = _encode(lvalue._type, pyval)
+    _inferior._write(lvalue._address, data)
+
+def cstring(s, encoding='utf-8', width=1):
+    '''Put a NUL-terminated string in memory and return its address.'''
+    data = s.encode(encoding) + b'\0' * width
+    addr = _inferior._alloc(len(data), width)
+    _inferior._write(addr, data)
+    return addr
+
+def set_dynamic_type(address, type):
+    '''Make dynamic_type (RTTI) report `type` for the object at `address`.'''
+    _inferior._dynamic_types[int(address)] = type
+
+def set_global(name, val):
+    _globals[name] = val
+
+def set_static(type, name, val):
+    _inferior._statics[(type.name, name)] = val
+
+def add_thread(name=None, newest=None):
+    thread = InferiorThread(len(_inferior._threads) + 1,
+                            _inferior.pid + len(_inferior._threads), name,
+                            newest)
+    _inferior._threads.append(thread)
+    if _inferior._selected_thread is None:
+        _inferior._selected_thread = thread
+    return thread
+
+def add_solib(lo, hi, name):
+    _solibs.append((lo, hi, name))
+
+def link_frames(frames):
+    '''Chain a newest-first list of Frames together.'''
+    for newer, older in zip(frames, frames[1:]):
+        newer._older = older
+        older._newer = newer
+    return frames and frames[0] or None
+
+def reset(pid=4242):
+    '''Forget everything: memory, types, globals, threads, counters.'''
+    global _inferior
+    _inferior = Inferior(pid)
+    _types.clear()
+    _types.update(_BUILTINS)
+    _globals.clear()
+    _solibs[:] = []
+    _objfiles[:] = []
+    _execute_handlers.clear()
+    del pretty_printers[:]
+    del breakpoints_list[:]
+    # (event listeners are kept; gdbaudy connects them at import time.  Use
+    # new_objfile() to make them drop their caches.)
+    calls.clear()
+
+def new_objfile(filename):
+    objfile = Objfile(filename)
+    _objfiles.append(objfile)
+    events.new_objfile._fire(NewObjFileEvent(objfile))
+    return objfile
+
+_inferior = Inferior()
+reset()
@@ -0,0 +1,19 @@
+# Stand-in for gdb/frames.py.
+#
+# Real gdb returns None from execute_frame_filters when no frame filters are
+# registered, but the gecko gdb scripts register one, so that's the world we
+# pretend to live in: every frame comes back wrapped in a FrameDecorator.
+
+import itertools
+
+import gdb
+from gdb.FrameDecorator import FrameDecorator
+from gdb.FrameIterator import FrameIterator
+
+def execute_frame_filters(frame, frame_low, frame_high):
+    gdb.calls['frames.execute_frame_filters'] += 1
+    frame_iterator = map(FrameDecorator, FrameIterator(frame))
+    if frame_low > 0 or frame_high != -1:
+        stop = frame_high + 1 if frame_high != -1 else None
+        frame_iterator = itertools.islice(frame_iterator, frame_low, stop)
+    return frame_iterator
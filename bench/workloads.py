@@ -0,0 +1,614 @@
+# Synthetic workloads for the fake gdb in bench/gdb.  Each `build_*` function
+# resets the fake inferior and populates it with types, objects, threads and
+# frames shaped like what we see in a gecko process, scaled by its arguments.
+
+import gdb
+
+CHAR = gdb.lookup_type('char')
+CHAR16 = gdb.lookup_type('char16_t')
+BOOL = gdb.lookup_type('bool')
+INT = gdb.lookup_type('int')
+INT16 = gdb.lookup_type('int16_t')
+UINT16 = gdb.lookup_type('uint16_t')
+UINT32 = gdb.lookup_type('uint32_t')
+UINT64 = gdb.lookup_type('uint64_t')
+VOID = gdb.lookup_type('void')
+
+LIBXUL = (0x7f0000000000, 0x7f0010000000, '/home/user/gecko/obj/dist/bin/libxul.so')
+
+class GeckoTypes(object):
+    '''
+    The handful of gecko types the pp-mozilla.yaml rules care about, built
+    against the fake gdb.  Template instantiations are made on demand and
+    memoized so everything shares the same Type objects, like in gdb.
+    '''
+    def __init__(self):
+        self._refptrs = {}
+        self._arrays = {}
+        self._lists = {}
+
+        self.nsCString = self._register(gdb.make_struct('nsCString', [
+            ('mData', CHAR.pointer()),
+            ('mLength', UINT32),
+            ('mDataFlags', UINT16),
+            ('mClassFlags', UINT16)]))
+        self.nsString = self._register(gdb.make_struct('nsString', [
+            ('mData', CHAR16.pointer()),
+            ('mLength', UINT32),
+            ('mDataFlags', UINT16),
+            ('mClassFlags', UINT16)]))
+
+        # nsresult has hundreds of enumerators, most with the high bit set.
+        values = [('NS_OK', 0)]
+        for module in range(1, 40):
+            for code in range(10):
+                values.append(('NS_ERROR_MODULE%d_%d' % (module, code),
+                               _signed32(0x80000000 | ((module + 0x45) << 16) |
+                                         code)))
+        values.append(('NS_ERROR_FAILURE', _signed32(0x80004005)))
+        self.nsresult = self._register(gdb.make_enum('nsresult', values))
+
+        self.nsHeaderHdr = self._register(gdb.make_struct('nsTArrayHeader', [
+            ('mLength', UINT32),
+            ('mCapacity', UINT32)]))
+
+        self.nsISupports = self._register(gdb.make_struct('nsISupports', [
+            ('_vptr.nsISupports', VOID.pointer())]))
+
+        self.nsStandardURL = self._register(gdb.make_struct(
+            'mozilla::net::nsStandardURL', [
+                ('mSpec', self.nsCString),
+                ('mScheme', self.nsCString),
+                ('mPort', INT)],
+            bases=[self.nsISupports]))
+
+        self.OriginAttributes = self._register(gdb.make_struct(
+            'mozilla::OriginAttributes', [
+                ('mPrivateBrowsingId', UINT32),
+                ('mUserContextId', UINT32),
+                ('mFirstPartyDomain', self.nsString)]))
+
+        self.ContentPrincipal = self._register(gdb.make_struct(
+            'ContentPrincipal', [
+                ('mCodebase', self.refptr(self.nsStandardURL)),
+                ('mOriginAttributes', self.OriginAttributes)],
+            bases=[self.nsISupports]))
+
+        self.LoadInfo = self._register(gdb.make_struct(
+            'mozilla::net::LoadInfo', [
+                ('mLoadingPrincipal', self.refptr(self.ContentPrincipal)),
+                ('mOriginAttributes', self.OriginAttributes),
+                ('mController', UINT64)],
+            bases=[self.nsISupports]))
+
+        self.nsLoadGroup = self._register(gdb.make_struct(
+            'mozilla::net::nsLoadGroup', [
+                ('mLoadFlags', UINT32),
+                ('mForegroundCount', UINT32)],
+            bases=[self.nsISupports]))
+
+        self.nsHttpRequestHead = self._register(gdb.make_struct(
+            'mozilla::net::nsHttpRequestHead', [
+                ('mMethod', self.nsCString),
+                ('mVersion', UINT32)]))
+
+        self.nsEntry = self._register(gdb.make_struct(
+            'mozilla::net::nsHttpHeaderArray::nsEntry', [
+                ('header', CHAR.pointer()),
+                ('value', self.nsCString)]))
+        self.nsHttpHeaderArray = self._register(gdb.make_struct(
+            'mozilla::net::nsHttpHeaderArray', [
+                ('mHeaders', self.nsTArray(self.nsEntry))]))
+        self.nsHttpResponseHead = self._register(gdb.make_struct(
+            'mozilla::net::nsHttpResponseHead', [
+                ('mHeaders', self.nsHttpHeaderArray),
+                ('mContentType', self.nsCString),
+                ('mContentCharset', self.nsCString)]))
+
+        self.HttpBaseChannel = self._register(gdb.make_struct(
+            'mozilla::net::HttpBaseChannel', [
+                ('mURI', self.refptr(self.nsStandardURL)),
+                ('mOriginalURI', self.refptr(self.nsStandardURL)),
+                ('mDocumentURI', self.refptr(self.nsStandardURL)),
+                ('mRequestHead', self.nsHttpRequestHead),
+                ('mResponseHead', self.nsHttpResponseHead.pointer()),
+                ('mStatus', self.nsresult),
+                ('mUploadStream', self.refptr(self.nsISupports)),
+                ('mLoadFlags', UINT32),
+                ('mLoadGroup', self.refptr(self.nsLoadGroup)),
+                ('mLoadInfo', self.refptr(self.LoadInfo)),
+                ('mCanceled', BOOL)],
+            bases=[self.nsISupports]))
+        self.nsHttpChannel = self._register(gdb.make_struct(
+            'mozilla::net::nsHttpChannel', [
+                ('mCacheEntry', VOID.pointer())],
+            bases=[self.HttpBaseChannel]))
+
+        self.ServiceWorkerInfo = self._register(gdb.make_struct(
+            'mozilla::dom::workers::ServiceWorkerInfo', [
+                ('mScope', self.nsCString),
+                ('mScriptSpec', self.nsCString),
+                ('mState', UINT32),
+                ('mSkipWaitingFlag', BOOL),
+                ('mHandlesFetch', BOOL)],
+            bases=[self.nsISupports]))
+
+    def _register(self, t):
+        return gdb.register_type(t)
+
+    def refptr(self, target):
+        if target.name not in self._refptrs:
+            self._refptrs[target.name] = self._register(gdb.make_struct(
+                'RefPtr<%s>' % target.name, [('mRawPtr', target.pointer())],
+                template_args=[target]))
+        return self._refptrs[target.name]
+
+    def nsTArray(self, elem):
+        name = str(elem)
+        if name not in self._arrays:
+            self._arrays[name] = self._register(gdb.make_struct(
+                'nsTArray<%s>' % name,
+                [('mHdr', self.nsHeaderHdr.pointer())],
+                template_args=[elem]))
+        return self._arrays[name]
+
+    def linked_list(self, elem):
+        if elem.name not in self._lists:
+            # (self-referential, so make the type first and lay it out after)
+            lle = gdb.make_struct('mozilla::LinkedListElement<%s>' % elem.name,
+                                  [], template_args=[elem])
+            laid_out = gdb.make_struct(lle.name, [
+                ('mNext', lle.pointer()),
+                ('mPrev', lle.pointer()),
+                ('mIsSentinel', BOOL)])
+            lle._fields = laid_out._fields
+            lle.sizeof = laid_out.sizeof
+            self._register(lle)
+            ll = self._register(gdb.make_struct(
+                'mozilla::LinkedList<%s>' % elem.name, [('sentinel', lle)],
+                template_args=[elem]))
+            self._lists[elem.name] = (ll, lle)
+        return self._lists[elem.name]
+
+    ## object builders
+
+    def cstring(self, s):
+        val = gdb.new(self.nsCString)
+        data = s.encode('utf-8')
+        gdb.store(val['mData'], gdb.cstring(s))
+        gdb.store(val['mLength'], len(data))
+        gdb.store(val['mDataFlags'], 1 | 4)  # TERMINATED | REFCOUNTED
+        return val
+
+    def fill_cstring(self, lvalue, s):
+        gdb.store(lvalue['mData'], gdb.cstring(s))
+        gdb.store(lvalue['mLength'], len(s.encode('utf-8')))
+        gdb.store(lvalue['mDataFlags'], 1 | 4)  # TERMINATED | REFCOUNTED
+
+    def fill_string(self, lvalue, s):
+        gdb.store(lvalue['mData'], gdb.cstring(s, 'utf-16-le', 2))
+        gdb.store(lvalue['mLength'], len(s))
+        gdb.store(lvalue['mDataFlags'], 1 | 4)  # TERMINATED | REFCOUNTED
+
+    def fill_array(self, lvalue, elem, values):
+        '''
+        Fill the nsTArray `lvalue` whose element type is `elem`.  `values` are
+        python ints/addresses or callables that take the element lvalue.
+        '''
+        esize = elem.strip_typedefs().sizeof
+        hdr = gdb.alloc(VOID, self.nsHeaderHdr.sizeof + esize * len(values))
+        gdb.store(gdb.Value._at(self.nsHeaderHdr, hdr)['mLength'], len(values))
+        gdb.store(gdb.Value._at(self.nsHeaderHdr, hdr)['mCapacity'],
+                  len(values))
+        base = hdr + self.nsHeaderHdr.sizeof
+        for i, v in enumerate(values):
+            elt = gdb.Value._at(elem, base + i * esize)
+            if callable(v):
+                v(elt)
+            else:
+                gdb.store(elt, v)
+        gdb.store(lvalue['mHdr'], hdr)
+
+    def url(self, spec):
+        url = gdb.new(self.nsStandardURL)
+        self.fill_cstring(url['mSpec'], spec)
+        self.fill_cstring(url['mScheme'], spec.split(':')[0])
+        gdb.store(url['mPort'], -1)
+        return url
+
+    def channel(self, i, headers=4):
+        chan = gdb.new(self.nsHttpChannel)
+        spec = 'https://example.com/resource/%d?q=%s' % (i, 'x' * (i % 7))
+        gdb.store(chan['mURI']['mRawPtr'], self.url(spec).address)
+        gdb.store(chan['mOriginalURI']['mRawPtr'], self.url(spec).address)
+        gdb.store(chan['mDocumentURI']['mRawPtr'],
+                  self.url('https://example.com/').address)
+        self.fill_cstring(chan['mRequestHead']['mMethod'], 'GET')
+        resp = gdb.new(self.nsHttpResponseHead)
+        self.fill_cstring(resp['mContentType'], 'text/html')
+        self.fill_cstring(resp['mContentCharset'], 'utf-8')
+        def header(n):
+            def fill(elt):
+                gdb.store(elt['header'], gdb.cstring('X-Header-%d' % n))
+                self.fill_cstring(elt['value'], 'value %d' % n)
+            return fill
+        self.fill_array(resp['mHeaders']['mHeaders'], self.nsEntry,
+                        [header(n) for n in range(headers)])
+        gdb.store(chan['mResponseHead'], resp.address)
+        gdb.store(chan['mStatus'], i % 3 and 0x80004005 or 0)
+        gdb.store(chan['mLoadFlags'], (1 << 16) | (1 << 9) | (1 << 25) | i)
+        group = gdb.new(self.nsLoadGroup, mLoadFlags=1 << 14)
+        gdb.store(chan['mLoadGroup']['mRawPtr'], group.address)
+        principal = gdb.new(self.ContentPrincipal)
+        gdb.store(principal['mCodebase']['mRawPtr'],
+                  self.url('https://example.com/').address)
+        gdb.store(principal['mOriginAttributes']['mUserContextId'], i % 4)
+        info = gdb.new(self.LoadInfo, mController=0)
+        gdb.store(info['mLoadingPrincipal']['mRawPtr'], principal.address)
+        gdb.store(chan['mLoadInfo']['mRawPtr'], info.address)
+        gdb.set_dynamic_type(chan.address, self.nsHttpChannel)
+        return chan
+
+
+class nsTArrayPrinter(object):
+    '''
+    A cut down version of the gecko nsTArray pretty-printer, which is what the
+    default_visualizer path in pp hands arrays to.
+    '''
+    def __init__(self, value):
+        self.value = value
+        self.elem = value.type.strip_typedefs().template_argument(0)
+
+    def to_string(self):
+        return str(self.value.type)
+
+    def display_hint(self):
+        return 'array'
+
+    def children(self):
+        hdr = self.value['mHdr'].dereference()
+        length = int(hdr['mLength'])
+        # elements start right after the header.
+        start = (hdr.address + 1).cast(self.elem.pointer())
+        for i in range(length):
+            yield ('[%d]' % i, start[i])
+
+def _lookup_nsTArray(value):
+    name = value.type.strip_typedefs().name
+    if name and name.startswith('nsTArray<'):
+        return nsTArrayPrinter(value)
+    return None
+
+def _signed32(v):
+    return v - (1 << 32) if v & 0x80000000 else v
+
+def _install_threads_and_rr():
+    '''rr's gdbserver commands and "info thread", as tricelog uses them.'''
+    handlers = gdb._execute_handlers
+    state = {'event': 41000}
+    def when(rest):
+        state['event'] += 1
+        return 'Current event: %d\n' % state['event']
+    handlers['when'] = when
+    handlers['when-ticks'] = lambda rest: 'Current tick: 123456789\n'
+    handlers['when-tid'] = lambda rest: 'Current tid: %d\n' % \
+        gdb.selected_thread().ptid[1]
+    handlers['elapsed-time'] = lambda rest: 'Elapsed Time (s): 12.345\n'
+    def info_thread(rest):
+        thread = [t for t in gdb.selected_inferior().threads()
+                  if str(t.num) == rest.strip()][0]
+        return ('  Id   Target Id                              Frame \n'
+                '* %d    Thread %d.%d (%s) 0x00007f0000001234 in foo ()\n' %
+                (thread.num, thread.ptid[0], thread.ptid[1], thread.name))
+    handlers['info thread'] = info_thread
+
+def make_frame(i, name, symbols, path, line, pc=None):
+    '''
+    A frame for function `name` with a args-block holding `symbols` (a list
+    of (name, Value, is_argument)) and a nested locals block.
+    '''
+    symtab = gdb.Symtab(path)
+    args = [gdb.Symbol(n, v._type, is_argument=True, value=v, symtab=symtab)
+            for n, v, is_arg in symbols if is_arg]
+    local_syms = [gdb.Symbol(n, v._type, value=v, symtab=symtab)
+                  for n, v, is_arg in symbols if not is_arg]
+    func = gdb.Symbol(name, VOID, symtab=symtab)
+    func.is_function = True
+    arg_block = gdb.Block(args, function=func)
+    block = gdb.Block(local_syms, superblock=arg_block)
+    if pc is None:
+        pc = LIBXUL[0] + 0x1000 + i * 0x40
+    return gdb.Frame(name, pc, gdb.Symtab_and_line(symtab, line, pc), block)
+
+
+FUNC_NAMES = ['mozilla::dom::ServiceWorkerManager::Register',
+              'mozilla::dom::workers::ScriptLoaderRunnable::Run',
+              'mozilla::net::nsHttpChannel::OnStartRequest',
+              'mozilla::ipc::MessageChannel::DispatchMessage',
+              'nsThread::ProcessNextEvent',
+              'js::RunScript',
+              'mozilla::dom::Promise::MaybeResolve',
+              'nsContentUtils::DispatchTrustedEvent']
+SRC_DIRS = ['dom/serviceworkers', 'dom/workers', 'netwerk/protocol/http',
+            'ipc/glue', 'xpcom/threads', 'js/src/vm', 'dom/promise',
+            'dom/base']
+
+def build_stack(depth, symbols_per_frame, threads=1):
+    '''
+    A deep stack where every frame has `symbols_per_frame` args+locals: ints,
+    pointers to channels and nsCStrings (which gdb stringifies deeply).
+    '''
+    gdb.reset()
+    gdb.add_solib(*LIBXUL)
+    types = GeckoTypes()
+    shared = [types.channel(i, headers=2) for i in range(4)]
+    for t in range(threads):
+        frames = []
+        for i in range(depth):
+            k = i % len(FUNC_NAMES)
+            symbols = []
+            for s in range(symbols_per_frame):
+                kind = s % 3
+                if kind == 0:
+                    v = gdb.new(INT)
+                    gdb.store(v, i * 7 + s)
+                    symbols.append(('aIndex%d' % s, v, True))
+                elif kind == 1:
+                    v = gdb.new(types.HttpBaseChannel.pointer())
+                    gdb.store(v, shared[(i + s) % len(shared)].address)
+                    symbols.append(('aChannel%d' % s, v, True))
+                else:
+                    v = types.cstring('local string %d/%d' % (i, s))
+                    symbols.append(('str%d' % s, v, False))
+            path = '/home/user/gecko/%s/File%d.cpp' % (SRC_DIRS[k], k)
+            frames.append(make_frame(i, FUNC_NAMES[k], symbols, path,
+                                     100 + i))
+        gdb.add_thread('Thread %d' % t, gdb.link_frames(frames))
+    return types
+
+def build_recursion(depth, cycle=3, symbols_per_frame=3):
+    '''A stack overflow: a short cycle of frames repeated `depth` frames deep.'''
+    gdb.reset()
+    gdb.add_solib(*LIBXUL)
+    frames = []
+    for i in range(depth):
+        k = i % cycle
+        symbols = []
+        for s in range(symbols_per_frame):
+            v = gdb.new(INT)
+            gdb.store(v, i + s)
+            symbols.append(('arg%d' % s, v, True))
+        frames.append(make_frame(k, 'js::frontend::Recurse%d' % k, symbols,
+                                 '/home/user/gecko/js/src/frontend/P.cpp',
+                                 10 + k, pc=LIBXUL[0] + 0x5000 + k * 0x10))
+    # and a normal bottom of the stack
+    for i in range(20):
+        frames.append(make_frame(i, FUNC_NAMES[i % len(FUNC_NAMES)], [],
+                                 '/home/user/gecko/xpcom/threads/T.cpp', i))
+    gdb.add_thread('Main', gdb.link_frames(frames))
+
+def build_channels(count, headers=4):
+    '''`count` channels in an nsTArray<RefPtr<HttpBaseChannel>> global.'''
+    gdb.reset()
+    types = GeckoTypes()
+    gdb.pretty_printers.append(_lookup_nsTArray)
+    chans = [types.channel(i, headers) for i in range(count)]
+    arr_type = types.nsTArray(types.refptr(types.HttpBaseChannel))
+    arr = gdb.new(arr_type)
+    def refptr_to(chan):
+        return lambda elt: gdb.store(elt['mRawPtr'], chan.address)
+    types.fill_array(arr, types.refptr(types.HttpBaseChannel),
+                     [refptr_to(c) for c in chans])
+    gdb.set_global('gChannels', arr)
+    if chans:
+        ptr = gdb.new(types.HttpBaseChannel.pointer())
+        gdb.store(ptr, chans[0].address)
+        gdb.set_global('gChannel', ptr)
+    gdb.add_thread('Main', make_frame(0, 'main', [], '/src/main.cpp', 1))
+    return types
+
+def build_int_array(count):
+    '''An nsTArray<uint32_t> with `count` elements in the gInts global.'''
+    gdb.reset()
+    types = GeckoTypes()
+    gdb.pretty_printers.append(_lookup_nsTArray)
+    arr = gdb.new(types.nsTArray(UINT32))
+    types.fill_array(arr, UINT32, list(range(count)))
+    gdb.set_global('gInts', arr)
+    gdb.add_thread('Main', make_frame(0, 'main', [], '/src/main.cpp', 1))
+    return types
+
+def build_linked_list(count):
+    '''A mozilla::LinkedList<ServiceWorkerInfo> with `count` elements.'''
+    gdb.reset()
+    types = GeckoTypes()
+    elem_base = types.ServiceWorkerInfo
+    ll, lle = types.linked_list(elem_base)
+    # the element type inherits from LinkedListElement<T> up front.
+    elem = gdb.register_type(gdb.make_struct(
+        elem_base.name, [(f.name, f.type) for f in elem_base._fields
+                         if not f.is_base_class],
+        bases=[lle]))
+    ll._template_args = [elem]
+    lst = gdb.new(ll)
+    sentinel = lst['sentinel']
+    prev = sentinel
+    for i in range(count):
+        e = gdb.new(elem)
+        types.fill_cstring(e['mScope'], 'https://example.com/scope/%d/' % i)
+        types.fill_cstring(e['mScriptSpec'], 'https://example.com/sw%d.js' % i)
+        gdb.store(e['mState'], i % 5)
+        gdb.store(prev['mNext'], e.address)
+        gdb.store(e['mPrev'], prev.address)
+        prev = e.cast(lle)
+    gdb.store(prev['mNext'], sentinel.address)
+    gdb.store(sentinel['mPrev'], prev.address)
+    gdb.store(sentinel['mIsSentinel'], 1)
+    gdb.set_global('gList', lst)
+    gdb.add_thread('Main', make_frame(0, 'main', [], '/src/main.cpp', 1))
+    return types
+
+def _hashtable_types(types, key_class, data, table_name):
+    '''
+    nsTHashtable<nsBaseHashtableET<key_class, data>> and a `table_name`
+    subclass of it.
+    '''
+    et = gdb.register_type(gdb.make_struct(
+        'nsBaseHashtableET<%s, %s>' % (key_class.name, data),
+        [('mData', data)], bases=[key_class]))
+    tht = gdb.register_type(gdb.make_struct(
+        'nsTHashtable<%s>' % et.name, [('mTable', types.PLDHashTable)],
+        template_args=[et]))
+    return et, gdb.register_type(gdb.make_struct(table_name, [], bases=[tht]))
+
+def _fill_hashtable(table_type, et, items, hash_key, fill_entry,
+                    hashes_ahead=False, capacity=8):
+    '''
+    Allocate a table_type and add `items` the way PLDHashTable::Add does, with
+    hash_key giving the hashKey op's result for a key.  The key hashes go in
+    each entry's mKeyHash (the pre-2019 layout), or with hashes_ahead, in an
+    array of them ahead of the entries.
+    '''
+    from gdbaudy import mozhash
+    table = gdb.new(table_type)
+    pld = table['mTable']
+    while len(items) > capacity * 3 // 4:
+        capacity *= 2
+    size_log2 = capacity.bit_length() - 1
+    shift = 32 - size_log2
+    if hashes_ahead:
+        store = gdb.alloc(UINT64, capacity * (4 + et.sizeof) // 8)
+        def hash_at(i):
+            return gdb.Value._at(UINT32, store + i * 4)
+        def entry_at(i):
+            return gdb.Value._at(et, store + capacity * 4 + i * et.sizeof)
+    else:
+        store = gdb.alloc(et, capacity)
+        def hash_at(i):
+            return entry_at(i)['mKeyHash']
+        def entry_at(i):
+            return gdb.Value._at(et, store + i * et.sizeof)
+    for key, data in items:
+        keyHash = mozhash.key_hash(hash_key(key))
+        # (PLDHashTable::Hash1 and Hash2)
+        hash1 = keyHash >> shift
+        hash2 = (keyHash & (capacity - 1)) | 1
+        while True:
+            slot = hash_at(hash1)
+            stored = int(slot)
+            if not stored:
+                break
+            gdb.store(slot, stored | mozhash.COLLISION_FLAG)
+            hash1 = (hash1 - hash2) & (capacity - 1)
+        gdb.store(slot, keyHash)
+        fill_entry(entry_at(hash1), key, data)
+    gdb.store(pld['mEntryStore']['mEntryStore'], store)
+    gdb.store(pld['mHashShift'], shift)
+    gdb.store(pld['mEntrySize'], et.sizeof)
+    gdb.store(pld['mEntryCount'], len(items))
+    return table
+
+def colliding_keys(count, capacity=8):
+    '''
+    `count` nsUint32HashKey keys that all start probing at the same slot of a
+    `capacity` slot table, but step through it differently.
+    '''
+    from gdbaudy import mozhash
+    shift = 32 - (capacity.bit_length() - 1)
+    keys = []
+    steps = set()
+    k = 0
+    while len(keys) < count:
+        keyHash = mozhash.key_hash(k)
+        step = (keyHash & (capacity - 1)) | 1
+        if keyHash >> shift == 0 and step not in steps:
+            keys.append(k)
+            steps.add(step)
+        k += 1
+    return keys
+
+def build_hashtables(count, hashes_ahead=False):
+    '''
+    `count` ServiceWorkerInfos in gRegistrations, an
+    nsRefPtrHashtable<nsCStringHashKey, ServiceWorkerInfo> keyed by scope,
+    gIds, an nsDataHashtable<nsUint32HashKey, uint32_t> mapping i*7 to i, and
+    gCollisions, one of those with 4 keys from colliding_keys() in 8 slots,
+    mapping each to its position.  hashes_ahead picks the newer PLDHashTable
+    layout, with the key hashes in an array ahead of the entries.
+    '''
+    from gdbaudy import mozhash
+    gdb.reset()
+    types = GeckoTypes()
+    hdr = gdb.register_type(gdb.make_struct('PLDHashEntryHdr', [] if
+        hashes_ahead else [('mKeyHash', UINT32)]))
+    store = gdb.register_type(gdb.make_struct('PLDHashTable::EntryStore', [
+        ('mEntryStore', CHAR.pointer()),
+        ('mGeneration', UINT32)]))
+    types.PLDHashTable = gdb.register_type(gdb.make_struct('PLDHashTable', [
+        ('mOps', VOID.pointer()),
+        ('mEntryStore', store),
+        ('mHashShift', INT16),
+        ('mEntrySize', UINT32),
+        ('mEntryCount', UINT32),
+        ('mRemovedCount', UINT32)]))
+    cstring_key = gdb.register_type(gdb.make_struct('nsCStringHashKey', [
+        ('mStr', types.nsCString)], bases=[hdr]))
+    uint32_key = gdb.register_type(gdb.make_struct('nsUint32HashKey', [
+        ('mValue', UINT32)], bases=[hdr]))
+
+    swi = types.refptr(types.ServiceWorkerInfo)
+    et, table_type = _hashtable_types(
+        types, cstring_key, swi,
+        'nsRefPtrHashtable<nsCStringHashKey, %s>' % types.ServiceWorkerInfo)
+    def fill_registration(entry, scope, info):
+        types.fill_cstring(entry['mStr'], scope)
+        gdb.store(entry['mData']['mRawPtr'], info.address)
+    items = []
+    for i in range(count):
+        info = gdb.new(types.ServiceWorkerInfo, mState=i % 5)
+        scope = 'https://example.com/scope/%d/' % i
+        types.fill_cstring(info['mScope'], scope)
+        types.fill_cstring(info['mScriptSpec'],
+                           'https://example.com/sw%d.js' % i)
+        items.append((scope, info))
+    gdb.set_global('gRegistrations', _fill_hashtable(
+        table_type, et, items, mozhash.hash_cstring, fill_registration,
+        hashes_ahead))
+
+    et, table_type = _hashtable_types(
+        types, uint32_key, UINT32,
+        'nsDataHashtable<nsUint32HashKey, unsigned int>')
+    def fill_id(entry, key, data):
+        gdb.store(entry['mValue'], key)
+        gdb.store(entry['mData'], data)
+    gdb.set_global('gIds', _fill_hashtable(
+        table_type, et, [(i * 7, i) for i in range(count)], lambda k: k,
+        fill_id, hashes_ahead))
+    gdb.set_global('gCollisions', _fill_hashtable(
+        table_type, et, [(k, i) for i, k in enumerate(colliding_keys(4))],
+        lambda k: k, fill_id, hashes_ahead))
+    gdb.add_thread('Main', make_frame(0, 'main', [], '/src/main.cpp', 1))
+    return types
+
+def build_capture_frame(channels):
+    '''A frame whose aChannel arg points at an nsHttpChannel, plus rr.'''
+    gdb.reset()
+    gdb.add_solib(*LIBXUL)
+    types = GeckoTypes()
+    chan = types.channel(0)
+    ptr = gdb.new(types.HttpBaseChannel.pointer())
+    gdb.store(ptr, chan.address)
+    status = gdb.new(types.nsresult)
+    gdb.store(status, 0x80004005)
+    frames = [make_frame(0, 'mozilla::net::nsHttpChannel::OnStartRequest',
+                         [('aChannel', ptr, True), ('aStatus', status, True)],
+                         '/home/user/gecko/netwerk/protocol/http/C.cpp', 42)]
+    for i in range(1, 40):
+        k = i % len(FUNC_NAMES)
+        frames.append(make_frame(i, FUNC_NAMES[k], [],
+                                 '/home/user/gecko/%s/F.cpp' % SRC_DIRS[k], i))
+    gdb.add_thread('Socket Thread', gdb.link_frames(frames))
+    _install_threads_and_rr()
+    # (a new program as far as gdbaudy's caches go, and this one's under rr)
+    gdb.new_objfile('/home/user/gecko/obj/dist/bin/libxul.so')
+    return types
@@ -1 +1,23 @@
 # gaudy!
+
+import gdb
+
+# What's been hooked up to gdb.events, by whoever hooked it up, so that
+# re-importing a module (see "How Do I Develop Them?" in the README) can unhook
+# the last import's handlers rather than piling up more.
+_connected = {}
+
+def connect_events(owner, handlers):
+    '''
+    Connect handlers, a list of (gdb.events name, fn), on behalf of owner,
+    first disconnecting whatever owner connected last time.  Events this gdb
+    doesn't have are skipped.
+    '''
+    for registry, fn in _connected.pop(owner, ()):
+        registry.disconnect(fn)
+    connected = _connected[owner] = []
+    for name, fn in handlers:
+        registry = getattr(gdb.events, name, None)
+        if registry is not None:
+            registry.connect(fn)
+            connected.append((registry, fn))
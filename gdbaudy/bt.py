@@ -23,9 +23,16 @@ import gdb.frames
 from gdb.FrameIterator import FrameIterator
 
 from pyflam import *
+from gdbaudy import mozstrings
 import sys
 import os.path
 import itertools
+import functools
+import fnmatch
+import json
+import re
+import threading
+import time
 
 class ContextHelper(object):
     def __init__(self, frameHelpers=[], fancyDetails=False):
@@ -55,6 +62,12 @@ class ContextHelper(object):
                 curNode[part] = (1, subNode)
             curNode = subNode
 
+    def considerFramePath(self, frame):
+        # (just the sal, so this is cheap enough for frames we won't show)
+        sal = frame.find_sal()
+        if sal.symtab and sal.symtab.filename:
+            self.considerPath(sal.symtab.filename)
+
     def chewPath(self, path):
         parts = path.split(os.path.sep)
         if len(parts) == 1:
@@ -111,6 +124,42 @@ class ContextHelper(object):
         return syn_frames, show
 
 
+def munge_symbol (frame, sym, block):
+    '''
+    Given a symbol in the context of a block, return a tuple of the printable
+    name for the symbol and its value in this frame.
+
+    @param frame The frame to read the value from.
+    @param sym A symbol, probably either an argument or a local.
+    @param block The frame block in which we are operating.
+    '''
+    # uh, pierce linkage names unless they are register values?
+    #  maybe this is a trick to get the fully qualified type?
+    if len (sym.linkage_name):
+        nsym, is_field_of_this = gdb.lookup_symbol (sym.linkage_name, block)
+        if not nsym:
+            return sym.linkage_name, '<danger=ignored>'
+        if nsym and nsym.addr_class != gdb.SYMBOL_LOC_REGISTER:
+            sym = nsym
+
+    # load the value!
+    try:
+        val = frame.read_var (sym)
+        if val != None:
+            # (gdb is slow at strings and doesn't know when to stop)
+            if mozstrings.is_string(val):
+                val = mozstrings.format_string(val)
+            else:
+                val = str (val)
+    # FIXME: would be nice to have a more precise exception here.
+    except RuntimeError as text:
+        val = text
+    except Exception as e:
+        val = "problemo"
+    if val == None:
+        val = "???"
+    return sym.print_name, val
+
 # This comes from gdb.command.backtrace, hence the copyright up top
 class ColorFrameWrapper(object):
     '''
@@ -122,10 +171,7 @@ class ColorFrameWrapper(object):
         self.frame_num = frame_num
 
         # -- Tell the context about the file path
-        # symtab and line
-        sal = self.frame.find_sal()
-        if sal.symtab and sal.symtab.filename:
-            self.context.considerPath(sal.symtab.filename)
+        self.context.considerFramePath(self.frame)
 
         # -- Tell the function about all the values it sees (args and locals)
         block = self.block = None
@@ -145,35 +191,7 @@ class ColorFrameWrapper(object):
         self.syn_frames, self.show_me = self.context.runHelpers(self.frame)
 
     def munge_symbol (self, sym, block):
-        '''
-        Given a symbol in the context of a block, return a tuple of the printable
-        name for the symbol and its value in this frame.
-
-        @param sym A symbol, probably either an argument or a local.
-        @param block The frame block in which we are operating.
-        '''
-        # uh, pierce linkage names unless they are register values?
-        #  maybe this is a trick to get the fully qualified type?
-        if len (sym.linkage_name):
-            nsym, is_field_of_this = gdb.lookup_symbol (sym.linkage_name, block)
-            if not nsym:
-                return sym.linkage_name, '<danger=ignored>'
-            if nsym and nsym.addr_class != gdb.SYMBOL_LOC_REGISTER:
-                sym = nsym
-
-        # load the value!
-        try:
-            val = self.frame.read_var (sym)
-            if val != None:
-                val = str (val)
-        # FIXME: would be nice to have a more precise exception here.
-        except RuntimeError as text:
-            val = text
-        except Exception as e:
-            val = "problemo"
-        if val == None:
-            val = "???"
-        return sym.print_name, val
+        return munge_symbol(self.frame, sym, block)
 
     def print_frame_locals (self, block):
         if not block:
@@ -257,6 +275,9 @@ class ColorFrameWrapper(object):
                 name = "??"
             if name.startswith('mozilla::'):
                 name = name[9:]
+            # chewPath returns None if the path never diverged from the others.
+            filename = sal.symtab and sal.symtab.filename
+            path = filename and (self.context.chewPath(filename) or filename)
 
             if not name or (not sal.symtab or not sal.symtab.filename):
                 lib = gdb.solib_name (pc)
@@ -270,12 +291,12 @@ class ColorFrameWrapper(object):
             elif mode == MODE_PASTE:
                 pout('{s}%3.3d {fn}%s{-fg}\n    {cn}%s{s}:{ln}%d{-fg}',
                      frame_num, name,
-                     sal.symtab and sal.symtab.filename and self.context.chewPath(sal.symtab.filename) or '???',
+                     path or '???',
                      sal.line)
             else:
                 pout('{s}%3.3d {fn}%s {.48}{s}at {cn}%s{s}:{ln}%d {s}%010x{-fg}',
                      frame_num, name,
-                     sal.symtab and sal.symtab.filename and self.context.chewPath(sal.symtab.filename) or '???',
+                     path or '???',
                      sal.line, pc)
                 pout.i(6)
                 if args:
@@ -295,6 +316,359 @@ MODE_TERSE = 1
 MODE_PASTE = 2
 MODE_FULL = 3
 
+# How many iterations of a recursion cycle to show at each end of a collapsed
+# run.  Overridable with "cbt keep=N".
+RECURSION_KEEP = 2
+# The longest cycle (in frames) we look for.  Stack overflows tend to be short
+# mutual recursions, so this is plenty, and it bounds the detection cost.
+RECURSION_MAX_PERIOD = 32
+
+def find_recursion_runs(sigs, keep=RECURSION_KEEP,
+                        max_period=RECURSION_MAX_PERIOD):
+    '''
+    Given a list of per-frame signatures (we use the pc), find runs of repeating
+    cycles worth collapsing, returning a list of non-overlapping
+    (start, period, iterations) tuples ordered by start.
+
+    For each candidate period we make a single pass looking for stretches where
+    sigs[j] == sigs[j + period]; such a stretch of length m means the frames
+    [j, j + m + period) are periodic.  That's O(n * max_period), so linear in
+    the depth of the stack, which matters when the stack is 50k frames deep.
+
+    A run is only worth collapsing if it has at least two more iterations than
+    the "keep" iterations we show at either end.
+    '''
+    n = len(sigs)
+    min_iterations = keep * 2 + 2
+    candidates = []
+    for period in range(1, min(max_period, n // min_iterations) + 1):
+        runStart = None
+        # (we go one past the end so that a run reaching the end gets flushed)
+        for j in range(n - period + 1):
+            if j < n - period and sigs[j] == sigs[j + period]:
+                if runStart is None:
+                    runStart = j
+            elif runStart is not None:
+                iterations = (j - runStart + period) // period
+                if iterations >= min_iterations:
+                    candidates.append((runStart, period, iterations))
+                runStart = None
+
+    # Prefer the earliest run, and for a given start, the shortest cycle; a
+    # cycle of 6 is just a cycle of 3 seen twice.
+    candidates.sort()
+    runs = []
+    lastEnd = 0
+    for start, period, iterations in candidates:
+        if start >= lastEnd:
+            runs.append((start, period, iterations))
+            lastEnd = start + period * iterations
+    return runs
+
+class CollapsedRun(object):
+    '''
+    Stands in for the frames of a recursion run that we elided.  None of the
+    elided frames get wrapped, so we never read their args or locals.
+    '''
+    def __init__(self, first_num, last_num, period, iterations, elided):
+        self.frame_num = first_num
+        self.last_num = last_num
+        self.period = period
+        self.iterations = iterations
+        self.elided = elided
+
+    def describe(self, frame_num, mode, args=True):
+        pout('{s}    ... {w}%d iterations{s} of a %d-frame cycle, '
+             '%d hidden (frames %d-%d){-fg}',
+             self.iterations, self.period, self.elided,
+             self.frame_num, self.last_num)
+
+    def describe_json(self):
+        return {'num': self.frame_num,
+                'repeated': {'last': self.last_num,
+                             'period': self.period,
+                             'iterations': self.iterations,
+                             'elided': self.elided}}
+
+class NDJSONFrameWriter(object):
+    '''
+    Streams frames out as newline-delimited JSON, one object per frame, written
+    as soon as the frame has been looked at so that nothing accumulates.  This
+    goes straight to the file; there's no pyflam formatting to undo.
+
+    The "name", "file" and "line" keys are the same as the "stack" entries that
+    tricelog writes, so the same consumers can deal with both.  We add "num",
+    "pc" and "lib", plus "args" and "locals" (lists of [name, value] pairs) when
+    asked for.  Collapsed recursion runs show up as {"num": N, "repeated": {..}}.
+    '''
+    def __init__(self, fout, context, args=False, locals=False):
+        self.fout = fout
+        self.context = context
+        self.args = args
+        self.locals = locals
+
+    def _symbols(self, frame, block, want_args):
+        result = []
+        for sym in block:
+            if sym.is_argument != want_args:
+                continue
+            name, val = munge_symbol(frame, sym, block)
+            result.append([name, str(val)])
+        return result
+
+    def write_frame(self, frame_num, frame):
+        pc = frame.pc()
+        obj = {'num': frame_num, 'pc': pc, 'name': frame.name()}
+
+        ftype = frame.type()
+        if ftype == gdb.DUMMY_FRAME:
+            obj['kind'] = 'dummy'
+        elif ftype == gdb.SIGTRAMP_FRAME:
+            obj['kind'] = 'sigtramp'
+
+        sal = frame.find_sal()
+        filename = sal.symtab and sal.symtab.filename
+        # chewPath returns None if the path never diverged from the others.
+        obj['file'] = filename and (self.context.chewPath(filename) or filename)
+        obj['line'] = sal.line
+        obj['lib'] = gdb.solib_name(pc)
+
+        if self.args or self.locals:
+            block = None
+            try:
+                block = frame.block()
+            except:
+                pass
+            if block:
+                if self.locals:
+                    obj['locals'] = self._symbols(frame, block, False)
+                if self.args:
+                    if block.function is None:
+                        block = block.superblock
+                    obj['args'] = self._symbols(frame, block, True)
+
+        self.write(obj)
+
+    def write(self, obj):
+        json.dump(obj, self.fout)
+        self.fout.write('\n')
+
+class FramePredicate(object):
+    '''
+    Decides whether a frame is interesting based only on the cheap things we can
+    ask of it: its function name, its source file and its shared library.  This
+    runs before we wrap the frame, so frames that don't match never pay for the
+    block()/read_var()/str() work.
+
+    Every criterion that was provided must match.
+    '''
+    def __init__(self):
+        self.funcRe = None
+        self.fileGlob = None
+        self.libName = None
+
+    def parse_word(self, word):
+        '''
+        Consume a "fn=REGEX", "file=GLOB" or "lib=NAME" word, returning False if
+        the word isn't one of ours.
+        '''
+        if word.startswith('fn='):
+            self.funcRe = re.compile(word[3:])
+        elif word.startswith('file='):
+            self.fileGlob = word[5:]
+        elif word.startswith('lib='):
+            self.libName = word[4:]
+        else:
+            return False
+        return True
+
+    def is_active(self):
+        return (self.funcRe is not None or self.fileGlob is not None or
+                self.libName is not None)
+
+    def matches(self, frame):
+        if self.funcRe is not None:
+            name = frame.name()
+            if not name or not self.funcRe.search(name):
+                return False
+        if self.fileGlob is not None:
+            sal = frame.find_sal()
+            if not sal.symtab or not sal.symtab.filename:
+                return False
+            if not fnmatch.fnmatch(sal.symtab.filename, self.fileGlob):
+                return False
+        if self.libName is not None:
+            # (the main executable has no solib name)
+            lib = gdb.solib_name(frame.pc())
+            if not lib or self.libName not in lib:
+                return False
+        return True
+
+class StackSampler(object):
+    '''
+    Poor man's sampling profiler.  We let the inferior run for an interval,
+    interrupt it (with gdb's "interrupt", posted from a timer thread, so it's
+    the same as hitting Ctrl-C whatever the target is), unwind every thread
+    with just the frame names (no blocks, no values), and go again.  A stop
+    for any other reason (a breakpoint, say) ends the sampling there.
+
+    Samples are merged as we go into a dict of counts keyed by the root-first
+    tuple of function names, so memory is proportional to the number of unique
+    stacks rather than samples * threads.  Names are interned so the keys share
+    their strings.
+    '''
+    def __init__(self, threadNames=False):
+        self.counts = {}
+        self.samples = 0
+        self.threadNames = threadNames
+        self._names = {}
+        # whether we're in the middle of a continue, whether we interrupted
+        # it, and the stop event that ended it
+        self._running = False
+        self._sent = False
+        self._stop = None
+        # (so an interrupt posted for an earlier continue can tell)
+        self._runs = 0
+
+    def _intern(self, name):
+        return self._names.setdefault(name, name)
+
+    def _unwind(self):
+        stack = []
+        try:
+            for frame in FrameIterator(gdb.newest_frame()):
+                stack.append(self._intern(frame.name() or '??'))
+        except gdb.error:
+            # a busted frame; we still want whatever we got up to it.
+            pass
+        return stack
+
+    def sample_all_threads(self):
+        selected = gdb.selected_thread()
+        try:
+            for thread in gdb.selected_inferior().threads():
+                thread.switch()
+                stack = self._unwind()
+                if self.threadNames:
+                    stack.append(self._intern(thread.name or
+                                              'thread %d' % thread.num))
+                stack.reverse()
+                key = tuple(stack)
+                self.counts[key] = self.counts.get(key, 0) + 1
+        finally:
+            if selected and selected.is_valid():
+                selected.switch()
+        self.samples += 1
+
+    def _interrupt(self, run):
+        # (run by gdb's event loop, by way of post_event, so the continue
+        # can't finish underneath us; but it, or a later one, may have
+        # finished already)
+        if not self._running or run != self._runs:
+            return
+        try:
+            gdb.execute('interrupt', to_string=True)
+        except (gdb.error, OSError):
+            return
+        self._sent = True
+
+    def _stopped(self, event):
+        self._stop = event
+
+    def _ours(self):
+        '''Was the last stop the one our interrupt asked for?'''
+        event = self._stop
+        if not self._sent or isinstance(event, gdb.BreakpointEvent):
+            return False
+        # (all-stop reports SIGINT; non-stop, a plain stop)
+        return (not isinstance(event, gdb.SignalEvent) or
+                event.stop_signal == 'SIGINT')
+
+    def _run_once(self, interval):
+        '''
+        Let the inferior run until we interrupt it, returning False instead if
+        it stopped for some other reason first.
+        '''
+        self._sent = False
+        self._stop = None
+        self._running = True
+        self._runs += 1
+        timer = threading.Timer(interval, gdb.post_event,
+                                (functools.partial(self._interrupt,
+                                                   self._runs),))
+        timer.start()
+        try:
+            gdb.execute('continue', to_string=True)
+        finally:
+            self._running = False
+            timer.cancel()
+        return self._ours()
+
+    def _report_stop(self):
+        try:
+            frame = gdb.selected_frame()
+        except gdb.error:
+            return
+        sal = frame.find_sal()
+        where = ''
+        if sal.symtab and sal.symtab.filename:
+            where = ' at %s:%d' % (sal.symtab.filename, sal.line)
+        pout('{s}stopped in {fn}%s{s}%s, so that\'s where sampling ends{-fg}',
+             frame.name() or '??', where)
+
+    def run(self, count, duration, interval):
+        inferior = gdb.selected_inferior()
+        deadline = duration and time.time() + duration
+        gdb.events.stop.connect(self._stopped)
+        try:
+            while True:
+                if count and self.samples >= count:
+                    break
+                if deadline and time.time() >= deadline:
+                    break
+                ours = self._run_once(interval)
+                # the process may have gone away on us.
+                if not inferior.pid:
+                    break
+                # (anything we didn't cause, the user wants to look at)
+                if not ours:
+                    self._report_stop()
+                    break
+                self.sample_all_threads()
+        finally:
+            gdb.events.stop.disconnect(self._stopped)
+
+    def write_folded(self, path):
+        '''
+        Write the counts out in Brendan Gregg's folded format, ready for
+        flamegraph.pl and friends.
+        '''
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write('%s %d\n' % (';'.join(stack), count))
+
+    def print_summary(self, top):
+        selfCounts = {}
+        inclusiveCounts = {}
+        total = 0
+        for stack, count in self.counts.items():
+            total += count
+            if stack:
+                leaf = stack[-1]
+                selfCounts[leaf] = selfCounts.get(leaf, 0) + count
+            for name in set(stack):
+                inclusiveCounts[name] = inclusiveCounts.get(name, 0) + count
+
+        pout('{n}%d samples, %d thread stacks, %d unique stacks',
+             self.samples, total, len(self.counts))
+        for label, counts in (('self', selfCounts),
+                              ('inclusive', inclusiveCounts)):
+            pout('{h}top %d by %s:', top, label)
+            ranked = sorted(counts.items(), key=lambda pair: -pair[1])
+            for name, count in ranked[:top]:
+                pout('{v}%7d {s}%6s {fn}%s', count,
+                     '%.1f%%' % (100.0 * count / total), name)
+
 class ColorFilteringBacktrace (gdb.Command):
     """Print backtrace of all stack frames, or innermost COUNT frames.
 With a negative argument, print outermost -COUNT frames.
@@ -302,6 +676,27 @@ Use of the 'full' qualifier also prints the values of the local variables.
 Use of the 'raw' qualifier avoids any filtering by loadable modules.
 Use of the 'terse' qualifier tells us to only show class name.
 Use of the 'paste' qualifier generates output suitable for pasting in bugzilla.
+
+Runs of repeating frames (recursion, most notably stack overflows) are
+collapsed so that only the first and last 2 iterations are shown.  Use
+'keep=N' to show N iterations at each end instead, or 'nocollapse' to show
+everything.
+
+Frames can be filtered with 'fn=REGEX' (searched in the function name),
+'file=GLOB' (matched against the full source path, so use something like
+'file=*dom/workers/*') and 'lib=NAME' (a substring of the shared library name).
+Only matching frames are shown (and have their args read), but they keep the
+numbers they'd have in an unfiltered backtrace.
+
+Use of the 'json [FILE]' qualifier streams one JSON object per line to FILE (or
+stdout) instead of printing.  Add 'args' to include arguments, or 'full' to
+include arguments and locals.
+
+Use 'sample' as the first word to sample all threads' stacks instead, writing a
+folded (flame graph) file and printing a summary.  It takes 'count=N' (default
+100), 'for=SECONDS' (a duration, instead of or in addition to the count),
+'every=MS' (default 100), 'out=FILE' (default /tmp/cbt-PID.folded), 'top=N'
+(default 20) and 'threadnames' (to root each stack at its thread's name).
 """
 
     def __init__ (self):
@@ -320,14 +715,72 @@ Use of the 'paste' qualifier generates output suitable for pasting in bugzilla.
             result.append (item)
         return result[x:]
 
+    def sample (self, words):
+        count = 100
+        duration = None
+        interval = 0.1
+        path = None
+        top = 20
+        threadNames = False
+        for word in words:
+            if word == '':
+                continue
+            elif word.startswith('count='):
+                count = int(word[6:])
+            elif word.startswith('for='):
+                duration = float(word[4:])
+                # an explicit duration without an explicit count is unbounded
+                if not any(w.startswith('count=') for w in words):
+                    count = 0
+            elif word.startswith('every='):
+                interval = float(word[6:]) / 1000.0
+            elif word.startswith('out='):
+                path = word[4:]
+            elif word.startswith('top='):
+                top = int(word[4:])
+            elif word == 'threadnames':
+                threadNames = True
+            else:
+                raise gdb.GdbError('Unknown sample argument: ' + word)
+
+        if path is None:
+            path = '/tmp/cbt-%d.folded' % gdb.selected_inferior().pid
+
+        sampler = StackSampler(threadNames)
+        try:
+            sampler.run(count, duration, interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # (whatever we got before the process died or gdb gave up on it is
+            # still worth having)
+            sampler.write_folded(path)
+            pout.i(-100)
+            pout('{s}wrote {cn}%s', path)
+            sampler.print_summary(top)
+
     def invoke (self, arg, from_tty):
+        words = arg.split (" ")
+        if words[0] == 'sample':
+            self.sample (words[1:])
+            return
+
         i = 0
         count = 0
         filter = True
         mode = MODE_NORMAL
         fancyDetails = True
-
-        for word in arg.split (" "):
+        collapse = True
+        keep = RECURSION_KEEP
+        predicate = FramePredicate()
+        jsonMode = False
+        jsonPath = None
+        jsonArgs = False
+        # (anything that's not a number or a known word, which had better be
+        # the one json FILE)
+        others = []
+
+        for word in words:
             if word == '':
                 continue
             elif word == 'raw':
@@ -340,38 +793,134 @@ Use of the 'paste' qualifier generates output suitable for pasting in bugzilla.
             elif word == 'paste':
                 mode = MODE_PASTE
                 fancyDetails = False
-            else:
+            elif word == 'nocollapse':
+                collapse = False
+            elif word.startswith('keep='):
+                if not word[5:].isdigit():
+                    raise gdb.GdbError('keep= takes a number of iterations: '
+                                       + word)
+                keep = int(word[5:])
+            elif word == 'json':
+                jsonMode = True
+                fancyDetails = False
+            elif word == 'args':
+                jsonArgs = True
+            elif predicate.parse_word(word):
+                pass
+            elif word.lstrip('-').isdigit():
                 count = int (word)
+            else:
+                others.append(word)
+
+        if jsonArgs and not jsonMode:
+            raise gdb.GdbError("'args' only goes with 'json'")
+        if others:
+            if not jsonMode or len(others) > 1:
+                raise gdb.GdbError('Unknown cbt argument: ' + others[-1])
+            jsonPath = others[0]
 
         # FIXME: provide option to start at selected frame
         # However, should still number as if starting from newest
         context = ContextHelper(fancyDetails=fancyDetails)
 
-        frames = []
         iterFrames = None
         if filter:
             iterFrames = gdb.frames.execute_frame_filters(gdb.newest_frame(), 0, -1)
         if not iterFrames:
             iterFrames = FrameIterator(gdb.newest_frame())
 
-        # Now wrap in an iterator that numbers the frames.
+        # Now wrap in an iterator that numbers the frames.  We only grab the
+        # bare gdb frames here; wrapping is what reads the args and such, so we
+        # hold off on that until we know which frames we're going to show.
         iterFrames = zip(itertools.count (0), iterFrames)
-
-        for iFrame, gdbFrameDecorator in iterFrames:
-            gdbFrame = gdbFrameDecorator.inferior_frame()
-            frames.append(ColorFrameWrapper(gdbFrame, context, iFrame))
-        context.process()
+        numbered = [(iFrame, gdbFrameDecorator.inferior_frame())
+                    for iFrame, gdbFrameDecorator in iterFrames]
 
         # Extract sub-range user wants.
-        iterFrames = zip(itertools.count (0), iter(frames))
         if count < 0:
-            iterFrames = self.final_n (iterFrames, count)
+            numbered = self.final_n (numbered, count)
         elif count > 0:
-            iterFrames = itertools.islice (iterFrames, 0, count)
+            numbered = numbered[:count]
+
+        # (runs are found before filtering, so they're always of consecutive
+        # frames; filtering could make unrelated frames look like a cycle)
+        runs = []
+        if collapse:
+            runs = find_recursion_runs([gdbFrame.pc()
+                                        for iFrame, gdbFrame in numbered],
+                                       keep)
+
+        def matching(entries):
+            if not predicate.is_active():
+                return entries
+            shown = []
+            for iFrame, gdbFrame in entries:
+                if predicate.matches(gdbFrame):
+                    shown.append((iFrame, gdbFrame))
+                else:
+                    # (the paths of frames we filter out still count, so the
+                    # ones we show get chewed just like they would unfiltered)
+                    context.considerFramePath(gdbFrame)
+            return shown
+
+        # Figure out what we're going to show: (frame number, gdb frame) pairs
+        # and CollapsedRun placeholders.
+        plan = []
+        iNext = 0
+        for start, period, iterations in runs:
+            elideStart = start + keep * period
+            elideEnd = start + (iterations - keep) * period
+            plan.extend(matching(numbered[iNext:elideStart]))
+            # Every iteration has the same pcs, and so the same frames match;
+            # if none in one do, the run's nothing the user asked to see.
+            if (not predicate.is_active() or
+                    any(predicate.matches(gdbFrame) for iFrame, gdbFrame
+                        in numbered[elideStart:elideStart + period])):
+                plan.append(CollapsedRun(numbered[elideStart][0],
+                                         numbered[elideEnd - 1][0],
+                                         period, iterations,
+                                         iterations - keep * 2))
+            iNext = elideEnd
+        plan.extend(matching(numbered[iNext:]))
+
+        if jsonMode:
+            self.write_json(plan, context, jsonPath,
+                            jsonArgs or mode == MODE_FULL, mode == MODE_FULL)
+            return
+
+        frames = []
+        for entry in plan:
+            if isinstance(entry, CollapsedRun):
+                frames.append(entry)
+            else:
+                iFrame, gdbFrame = entry
+                frames.append(ColorFrameWrapper(gdbFrame, context, iFrame))
+        context.process()
 
         # zero it...
         pout.i(-100)
-        for pair in iterFrames:
-            pair[1].describe (pair[0], mode)
+        for frame in frames:
+            frame.describe (frame.frame_num, mode)
+
+    def write_json(self, plan, context, path, args, locals):
+        # The path chewing needs to have seen all the paths up front, but that
+        # only needs the sal, so we can still stream the expensive part.
+        for entry in plan:
+            if not isinstance(entry, CollapsedRun):
+                context.considerFramePath(entry[1])
+
+        fout = path and open(path, 'w') or sys.stdout
+        try:
+            writer = NDJSONFrameWriter(fout, context, args, locals)
+            for entry in plan:
+                if isinstance(entry, CollapsedRun):
+                    writer.write(entry.describe_json())
+                else:
+                    writer.write_frame(*entry)
+        finally:
+            if path:
+                fout.close()
+            else:
+                fout.flush()
 
 ColorFilteringBacktrace()
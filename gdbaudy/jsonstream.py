@@ -0,0 +1,106 @@
+# A minimal streaming JSON writer.  Values are written to the file as they're
+# produced and all we keep around is the stack of open containers, so dumping a
+# huge object graph costs memory proportional to its depth, not its size.
+
+import json
+import math
+
+def _finite(v):
+    # JSON has no NaN or Infinity, so garbage floats from inferior memory get
+    # written the way javascript would spell them, as strings.
+    if isinstance(v, float) and not math.isfinite(v):
+        return 'NaN' if v != v else ('Infinity' if v > 0 else '-Infinity')
+    if isinstance(v, dict):
+        return dict((k, _finite(x)) for k, x in v.items())
+    if isinstance(v, (list, tuple)):
+        return [_finite(x) for x in v]
+    return v
+
+class JSONStreamWriter(object):
+    def __init__(self, fout):
+        self.fout = fout
+        # one [is_object, items written] per open container
+        self._stack = []
+        # we've written a key and owe its value
+        self._pending_key = False
+
+    @property
+    def depth(self):
+        return len(self._stack)
+
+    @property
+    def pending_key(self):
+        return self._pending_key
+
+    def count(self):
+        '''How many items (or keys) the innermost container has so far.'''
+        return self._stack[-1][1] if self._stack else 0
+
+    def in_object(self):
+        return bool(self._stack) and self._stack[-1][0]
+
+    def _separate(self):
+        if self._pending_key:
+            self._pending_key = False
+            return
+        if self._stack:
+            top = self._stack[-1]
+            if top[1]:
+                self.fout.write(',')
+            top[1] += 1
+
+    def begin_object(self):
+        self._separate()
+        self.fout.write('{')
+        self._stack.append([True, 0])
+
+    def begin_array(self):
+        self._separate()
+        self.fout.write('[')
+        self._stack.append([False, 0])
+
+    def end(self):
+        if self._pending_key:
+            # (someone blew up before producing the value)
+            self.value(None)
+        is_object, count = self._stack.pop()
+        self.fout.write('}' if is_object else ']')
+
+    def key(self, k):
+        self._separate()
+        json.dump(str(k), self.fout)
+        self.fout.write(':')
+        self._pending_key = True
+
+    def value(self, v):
+        self._separate()
+        # (dumps rather than dump, so that nothing's been written by the time
+        # it objects)
+        try:
+            text = json.dumps(v, ensure_ascii=False, allow_nan=False)
+        except ValueError:
+            text = json.dumps(_finite(v), ensure_ascii=False)
+        self.fout.write(text)
+
+    def note(self, k, v):
+        '''
+        Write {k: v} as appropriate for wherever we are: a key in an object or
+        a little object in an array.
+        '''
+        if self._pending_key:
+            self.value({k: v})
+        elif self.in_object():
+            self.key(k)
+            self.value(v)
+        else:
+            self.value({k: v})
+
+    def unwind(self, depth, fill=None):
+        '''
+        Close containers until we're back at depth, and if that leaves a key
+        without a value, give it fill.
+        '''
+        while len(self._stack) > depth:
+            self.end()
+        if self._pending_key:
+            self.value(fill)
@@ -0,0 +1,279 @@
+# Key lookups in gecko's PLDHashTable (and so nsTHashtable, nsDataHashtable,
+# nsClassHashtable, nsRefPtrHashtable, nsInterfaceHashtable, nsTHashMap...)
+# straight out of inferior memory.
+#
+# Finding one entry by dumping the whole table is hopeless once it has tens of
+# thousands of them.  Instead we compute the key's hash in python the same way
+# mfbt/HashFunctions.h and nsHashKeys.h do, then follow PLDHashTable's double
+# hashing probe sequence, reading just the hash of each slot we land on and
+# only looking at an entry's key when the hash matches.
+
+import gdb
+
+from gdbaudy import mozstrings
+
+MASK32 = 0xffffffff
+# mozilla::kGoldenRatioU32
+GOLDEN_RATIO = 0x9E3779B9
+# The low bit of a stored key hash marks a collision; 0 is a free slot and 1 a
+# removed one.
+COLLISION_FLAG = 1
+FREE_KEY_HASH = 0
+REMOVED_KEY_HASH = 1
+
+### mfbt/HashFunctions.h
+
+def _rotl5(h):
+    return ((h << 5) | (h >> 27)) & MASK32
+
+def add_u32_to_hash(h, v):
+    return (GOLDEN_RATIO * (_rotl5(h) ^ (v & MASK32))) & MASK32
+
+def add_u64_to_hash(h, v):
+    # (how AddToHash does pointers and 64-bit integers on 64-bit platforms)
+    return add_u32_to_hash(add_u32_to_hash(h, v & MASK32), (v >> 32) & MASK32)
+
+def hash_units(units):
+    '''HashString over a sequence of (unsigned) code units.'''
+    h = 0
+    for u in units:
+        h = add_u32_to_hash(h, u)
+    return h
+
+def hash_cstring(text):
+    # HashString(const char*) hashes the bytes as unsigned chars.
+    return hash_units(bytearray(text.encode('utf-8')))
+
+def hash_string(text):
+    data = text.encode('utf-16-le')
+    return hash_units(int.from_bytes(data[i:i + 2], 'little')
+                      for i in range(0, len(data), 2))
+
+def scramble(h):
+    return (h * GOLDEN_RATIO) & MASK32
+
+def key_hash(h):
+    '''PLDHashTable::ComputeKeyHash, given the hash ops' hashKey result.'''
+    h = scramble(h)
+    # (0 and 1 mean free and removed)
+    if h < 2:
+        h = (h - 2) & MASK32
+    return h & ~COLLISION_FLAG & MASK32
+
+### nsHashKeys.h
+# The key classes we know how to hash, by name without template arguments:
+# (kind, field holding the key).  An entry type either is one of these or
+# inherits from one (nsBaseHashtableET<KeyClass, DataType> does).
+KEY_CLASSES = {
+    'nsCStringHashKey': ('cstring', 'mStr'),
+    'nsStringHashKey': ('string', 'mStr'),
+    'nsUint32HashKey': ('int', 'mValue'),
+    'nsUint64HashKey': ('int', 'mValue'),
+    'IntegralHashKey': ('int', 'mValue'),
+    'nsPtrHashKey': ('ptr', 'mKey'),
+    'nsVoidPtrHashKey': ('ptr', 'mKey'),
+    'nsClearingPtrHashKey': ('ptr', 'mKey'),
+    'nsRefPtrHashKey': ('ptr', 'mKey'),
+    'nsISupportsHashKey': ('ptr', 'mSupports'),
+}
+
+def candidate_hashes(kind, key):
+    '''
+    The hashKey results key might have had.  Which one gecko uses for integers
+    and pointers has changed over the years (NS_PTR_TO_UINT32(p) >> 2 became
+    HashGeneric(p), and so on), so we try each in turn; a wrong guess just
+    costs a probe or two.
+    '''
+    if kind == 'cstring':
+        return [hash_cstring(key)]
+    if kind == 'string':
+        return [hash_string(key)]
+    if kind == 'int':
+        hashes = [key & MASK32, add_u32_to_hash(0, key),
+                  add_u64_to_hash(0, key)]
+    else:
+        hashes = [(key & MASK32) >> 2, add_u64_to_hash(0, key)]
+    # (dedupe, keeping the order)
+    return list(dict.fromkeys(hashes))
+
+### Finding the table
+
+class HashTableInfo(object):
+    '''What we've worked out about an nsTHashtable<EntryType> instantiation.'''
+    def __init__(self, path, entry_type, kind, key_field):
+        # field names from the value we were given to its PLDHashTable
+        self.path = path
+        self.entry_type = entry_type
+        self.kind = kind
+        self.key_field = key_field
+
+# type name -> HashTableInfo or None
+_tables = {}
+
+def _template_base(name):
+    return name.split('<', 1)[0]
+
+def _find_nsTHashtable(stype, path):
+    # Walk up the base classes looking for nsTHashtable<EntryType>.
+    if _template_base(stype.name or '') == 'nsTHashtable':
+        return stype, path
+    for field in stype.fields():
+        if field.is_base_class:
+            found = _find_nsTHashtable(field.type.strip_typedefs(), path)
+            if found:
+                return found
+    return None
+
+def _key_class(entry_type):
+    stype = entry_type.strip_typedefs()
+    known = KEY_CLASSES.get(_template_base(stype.name or ''))
+    if known:
+        return known
+    for field in stype.fields():
+        if field.is_base_class:
+            known = _key_class(field.type)
+            if known:
+                return known
+    return None
+
+def _compute_table_info(vtype):
+    found = _find_nsTHashtable(vtype.strip_typedefs(), ())
+    if not found:
+        return None
+    stype, path = found
+    entry_type = stype.template_argument(0)
+    known = _key_class(entry_type)
+    if known is None:
+        return HashTableInfo(path + ('mTable',), entry_type, None, None)
+    return HashTableInfo(path + ('mTable',), entry_type, *known)
+
+def table_info(vtype):
+    '''
+    Return the cached HashTableInfo if vtype is (or inherits from) an
+    nsTHashtable, None otherwise.
+    '''
+    name = vtype.strip_typedefs().name
+    if name is None:
+        return None
+    if name not in _tables:
+        try:
+            _tables[name] = _compute_table_info(vtype)
+        except (gdb.error, RuntimeError):
+            _tables[name] = None
+    return _tables[name]
+
+### Keys
+
+def entry_key(entry, info):
+    '''Pull the key out of an entry as a python str or int.'''
+    key = entry[info.key_field]
+    if info.kind in ('cstring', 'string'):
+        text, length, truncated = mozstrings.read_string(key, limit=1 << 20)
+        return text
+    if key.type.strip_typedefs().code == gdb.TYPE_CODE_STRUCT:
+        # nsCOMPtr / RefPtr
+        key = key['mRawPtr']
+    return int(key)
+
+def coerce_key(key, info):
+    '''
+    Turn the user's key (a python str or int, or a gdb.Value) into what
+    entry_key would give us for a matching entry.
+    '''
+    if isinstance(key, gdb.Value):
+        if mozstrings.is_string(key):
+            key = mozstrings.read_string(key, limit=1 << 20)[0]
+        else:
+            ktype = key.type.strip_typedefs()
+            if ktype.code == gdb.TYPE_CODE_STRUCT and info.kind == 'ptr':
+                key = key['mRawPtr']
+                ktype = key.type.strip_typedefs()
+            if (info.kind in ('cstring', 'string') and
+                    ktype.code in (gdb.TYPE_CODE_PTR, gdb.TYPE_CODE_ARRAY)):
+                key = key.string()
+            else:
+                key = int(key)
+    if info.kind in ('cstring', 'string'):
+        if not isinstance(key, str):
+            raise gdb.GdbError("%s wants a string key" % info.entry_type)
+    elif not isinstance(key, int):
+        raise gdb.GdbError("%s wants an integer or pointer key" %
+                           info.entry_type)
+    else:
+        key &= 0xffffffffffffffff
+    return key
+
+### Probing
+
+def _inline_key_hash():
+    # PLDHashEntryHdr used to start every entry with mKeyHash; newer gecko
+    # keeps all the hashes in an array ahead of the entries instead.
+    try:
+        hdr = gdb.lookup_type('PLDHashEntryHdr').strip_typedefs()
+    except gdb.error:
+        return True
+    return any(f.name == 'mKeyHash' for f in hdr.fields())
+
+def lookup(val, key):
+    '''
+    Find the entry for key in the hash table val, returning (entry Value,
+    slots probed), or (None, slots probed) if it's not there.  Raises GdbError
+    if val isn't a hash table we understand.
+    '''
+    info = table_info(val.type)
+    if info is None:
+        raise gdb.GdbError("%s isn't an nsTHashtable" % val.type)
+    if info.kind is None:
+        raise gdb.GdbError("Don't know how to hash keys of %s" %
+                           info.entry_type)
+    key = coerce_key(key, info)
+
+    table = val
+    for step in info.path:
+        table = table[step]
+    store = table['mEntryStore']
+    if store.type.strip_typedefs().code == gdb.TYPE_CODE_STRUCT:
+        store = store['mEntryStore']
+    store = int(store)
+    if not store:
+        # (nothing's ever been added)
+        return None, 0
+    shift = int(table['mHashShift'])
+    entry_size = int(table['mEntrySize'])
+    size_log2 = 32 - shift
+    capacity = 1 << size_log2
+    size_mask = capacity - 1
+
+    if _inline_key_hash():
+        def hash_at(i):
+            return store + i * entry_size
+        def entry_at(i):
+            return store + i * entry_size
+    else:
+        entries = store + capacity * 4
+        def hash_at(i):
+            return store + i * 4
+        def entry_at(i):
+            return entries + i * entry_size
+
+    inferior = gdb.selected_inferior()
+    entry_ptr_type = info.entry_type.pointer()
+    probed = 0
+    for h in candidate_hashes(info.kind, key):
+        keyHash = key_hash(h)
+        # PLDHashTable::SearchTable (Hash1 is the high bits, Hash2 the low)
+        hash1 = keyHash >> shift
+        hash2 = (keyHash & size_mask) | 1
+        for _ in range(capacity):
+            probed += 1
+            stored = int.from_bytes(
+                inferior.read_memory(hash_at(hash1), 4).tobytes(), 'little')
+            if stored == FREE_KEY_HASH:
+                break
+            if stored & ~COLLISION_FLAG == keyHash:
+                entry = gdb.Value(entry_at(hash1)).cast(
+                    entry_ptr_type).dereference()
+                if entry_key(entry, info) == key:
+                    return entry, probed
+            hash1 = (hash1 - hash2) & size_mask
+    return None, probed
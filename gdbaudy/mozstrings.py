@@ -0,0 +1,169 @@
+# Native decoding of gecko's nsTSubstring family (nsCString, nsString,
+# nsAutoCString, nsACString&, ...) straight out of inferior memory.
+#
+# Letting gdb stringify these means it walks and escapes the characters one at
+# a time, which is painful for the multi-MB JSON blobs and data: URIs we keep
+# running into.  Instead we read the string header once, pull the characters
+# with a single (capped) read_memory, and decode them in python.  pp, cbt and
+# tricelog's captures all go through here.
+
+import gdb
+import json
+
+# Don't bother decoding more than this many characters of any one string.
+# Change it with `python gdbaudy.mozstrings.max_chars = N`.
+max_chars = 4096
+
+# The class names (template arguments stripped) that have the nsTSubstring
+# mData/mLength/mDataFlags layout.
+STRING_CLASSES = frozenset([
+    'nsTSubstring', 'nsTString', 'nsTAutoStringN', 'nsTAutoString',
+    'nsTDependentString', 'nsTDependentSubstring', 'nsTLiteralString',
+    'nsTPromiseFlatString', 'mozilla::detail::nsTStringRepr',
+    'nsCString', 'nsString', 'nsACString', 'nsAString', 'nsSubstring',
+    'nsCSubstring', 'nsAutoCString', 'nsAutoString', 'nsCAutoString',
+    'nsDependentCString', 'nsDependentString', 'nsLiteralCString',
+    'nsLiteralString', 'nsDependentCSubstring', 'nsDependentSubstring',
+])
+
+# nsTSubstring's DataFlags.
+VOIDED = 1 << 1
+
+# type name -> None if it's not a string, else (mData offset, pointer size,
+# mLength offset, mDataFlags offset or None, char width, header size).
+_layouts = {}
+
+def field_offsets(stype, base=0, out=None):
+    '''
+    Walk the fields of stype, including those of base classes, returning a
+    dict from field name to (byte offset, field type).  Bitfields and statics
+    are left out.  (pp uses this too.)
+    '''
+    if out is None:
+        out = {}
+    bases = []
+    for field in stype.fields():
+        if not hasattr(field, 'bitpos') or field.bitpos is None:
+            continue
+        if getattr(field, 'bitsize', 0):
+            continue
+        offset = base + field.bitpos // 8
+        if field.is_base_class:
+            bases.append((field, offset))
+        elif field.name not in out:
+            out[field.name] = (offset, field.type)
+    # (like gdb, a derived class's field hides a base class's of the same name)
+    for field, offset in bases:
+        field_offsets(field.type.strip_typedefs(), offset, out)
+    return out
+
+def _compute_layout(vtype):
+    stype = vtype.strip_typedefs()
+    name = stype.name or ''
+    if name.split('<', 1)[0] not in STRING_CLASSES:
+        return None
+    fields = field_offsets(stype)
+    if 'mData' not in fields or 'mLength' not in fields:
+        return None
+    dataOffset, dataType = fields['mData']
+    lenOffset, lenType = fields['mLength']
+    flagsOffset = fields.get('mDataFlags', (None,))[0]
+    width = dataType.strip_typedefs().target().sizeof
+    if width not in (1, 2) or lenType.sizeof != 4:
+        return None
+    header = max(dataOffset + dataType.sizeof, lenOffset + 4,
+                 (flagsOffset or 0) + 2)
+    return (dataOffset, dataType.sizeof, lenOffset, flagsOffset, width,
+            header)
+
+def string_layout(vtype):
+    '''
+    Return the cached layout tuple if vtype is one of the nsTSubstring family,
+    None otherwise.  References to strings count too, since that's how they're
+    usually passed around.
+    '''
+    if vtype.code == gdb.TYPE_CODE_REF:
+        vtype = vtype.target()
+    name = vtype.name
+    if name is None:
+        return None
+    if name not in _layouts:
+        try:
+            _layouts[name] = _compute_layout(vtype)
+        except gdb.error:
+            _layouts[name] = None
+    return _layouts[name]
+
+def is_string(val):
+    return string_layout(val.type) is not None
+
+def _decode(raw, width, truncated):
+    if width == 2:
+        # (a cut can split a surrogate pair, hence the replace)
+        return raw.decode('utf-16-le', 'replace')
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # If we chopped a multi-byte sequence in half, just lose the stub.
+        if truncated and e.start >= len(raw) - 3:
+            try:
+                return raw[:e.start].decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        # Plenty of our "C" strings are really Latin-1.
+        return raw.decode('latin-1')
+
+def read_string(val, limit=None):
+    '''
+    Decode the string val (which must be a string per is_string) and return
+    (text, length, truncated) where length is the string's mLength (in code
+    units) and truncated says whether we stopped at the limit (default
+    max_chars).  text is None for a voided string.
+    '''
+    layout = string_layout(val.type)
+    dataOffset, ptrSize, lenOffset, flagsOffset, width, header = layout
+    if limit is None:
+        limit = max_chars
+    if val.type.code == gdb.TYPE_CODE_REF:
+        val = val.referenced_value()
+
+    inferior = gdb.selected_inferior()
+    addr = val.address
+    # (we only ever do this on little-endian x86 under rr)
+    if addr is not None:
+        hdr = inferior.read_memory(int(addr), header).tobytes()
+        data = int.from_bytes(hdr[dataOffset:dataOffset + ptrSize], 'little')
+        length = int.from_bytes(hdr[lenOffset:lenOffset + 4], 'little')
+        flags = 0
+        if flagsOffset is not None:
+            flags = int.from_bytes(hdr[flagsOffset:flagsOffset + 2], 'little')
+    else:
+        # (a value that lives in registers)
+        data = int(val['mData'])
+        length = int(val['mLength'])
+        flags = flagsOffset is not None and int(val['mDataFlags']) or 0
+
+    if flags & VOIDED:
+        return None, 0, False
+    count = min(length, limit)
+    if not count or not data:
+        return '', length, False
+    raw = inferior.read_memory(data, count * width).tobytes()
+    truncated = count < length
+    return _decode(raw, width, truncated), length, truncated
+
+def format_string(val, limit=None):
+    '''
+    Return a printable, quoted, escaped rendering of the string val, noting
+    how much was cut off if it was too long.
+    '''
+    return quote(*read_string(val, limit))
+
+def quote(text, length, truncated):
+    '''format_string for read_string's result.'''
+    if text is None:
+        return '(void)'
+    quoted = json.dumps(text, ensure_ascii=False)
+    if truncated:
+        return '%s... (length %d)' % (quoted, length)
+    return quoted
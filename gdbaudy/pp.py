@@ -1,11 +1,79 @@
+import ast
+import collections
+import contextlib
 import gdb
+import hashlib
+import itertools
 import os.path
 import re
+import struct
+import time
 
-from strictyaml import load
 from pyflam import *
+from gdbaudy import (connect_events, jsonstream, mozhash, mozstrings,
+                     pprules, rrmemo)
+import termhelp
+
+# The rules: pp-mozilla.yaml, then any extra files, later ones winning.  Edits
+# to any of them are picked up the next time pp runs.  Add your own with
+# `python gdbaudy.pp.extra_rule_files.append("~/my-rules.yaml")`.
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "pp-mozilla.yaml")
+extra_rule_files = []
+# ppi's points of interest.
+PPI_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "ppi-mozilla.yaml")
 
 RE_TEMPLATE_NAME = re.compile("^([^<]+)<.*>$")
+# "#17" or "#17.mFoo.mBar", naming a node from earlier pp output.
+RE_HANDLE = re.compile(r"^#(\d+)((?:\.[A-Za-z_]\w*)*)$")
+# "EXPR[start:stop]", python style, either end optional or negative.
+RE_SLICE = re.compile(r"^(.+)\[\s*(-?\d*)\s*:\s*(-?\d*)\s*\]$")
+# "TABLE[KEY]", a hash table lookup (if TABLE turns out to be a hash table).
+RE_INDEX = re.compile(r"^(.+)\[(.+)\]$")
+# A ppi singleton: a symbol, then maybe "->mFoo.mBar" to follow from it.
+RE_POI = re.compile(r"^(.+?)((?:(?:->|\.)[A-Za-z_]\w*)*)$")
+RE_POI_STEP = re.compile(r"(?:->|\.)([A-Za-z_]\w*)")
+# Fields that are just there to take up space.
+RE_PADDING = re.compile(r"^_*pad(ding)?_?\d*$", re.IGNORECASE)
+
+### Contiguous container layouts
+# Containers whose elements we know live in one contiguous buffer, so that
+# arrays of scalars can be read in bulk rather than having gdb hand us a Value
+# per element.  Each takes the container value and its element type and
+# returns (address of the first element, element count).
+def _nsTArray_span(val, etype):
+    hdr = val['mHdr']
+    length = int(hdr['mLength'])
+    # the elements start right after the header.
+    return int(hdr) + hdr.type.target().sizeof, length
+
+def _std_vector_span(val, etype):
+    impl = val['_M_impl']
+    start = int(impl['_M_start'])
+    return start, (int(impl['_M_finish']) - start) // etype.sizeof
+
+CONTIGUOUS_LAYOUTS = {
+    'nsTArray': _nsTArray_span,
+    'AutoTArray': _nsTArray_span,
+    'FallibleTArray': _nsTArray_span,
+    'CopyableTArray': _nsTArray_span,
+    'nsTArray_Impl': _nsTArray_span,
+    'std::vector': _std_vector_span,
+}
+
+# memoryview.cast() formats for the scalar sizes we can decode ourselves.
+_SIGNED_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+_UNSIGNED_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+_FLOAT_FORMATS = {4: 'f', 8: 'd'}
+
+def _is_signed(stype):
+    # gdb 12 grew Type.is_signed; before that, go by the name.
+    is_signed = getattr(stype, 'is_signed', None)
+    if is_signed is not None:
+        return is_signed
+    name = stype.name or ''
+    return not (name.startswith('u') or 'unsigned' in name or
+                name.startswith('size_t') or name.startswith('char16_t') or
+                name.startswith('char32_t'))
 
 def maybe_deref(val, vtype=None):
     """Given a value that may be of a pointer to a struct-ish type, dereference
@@ -35,6 +103,55 @@ dealing with things like char* and de-referencing breaks string printing."""
             pass
     return val
 
+class Truncated(Exception):
+    '''
+    Raised out of _inspect once an invocation has used up its node budget so
+    that we unwind all the way out instead of printing an error per field.
+    '''
+    pass
+
+class Overflowed(Exception):
+    '''
+    Raised by a LineRecorder with a limit once what it's recorded won't fit,
+    so that "pp /fit" stops reading a stub it's only going to throw away.
+    '''
+    pass
+
+def rule_field_count(rule):
+    '''How many fields a rule would show, if we can tell without looking.'''
+    if not rule:
+        return None
+    if "simple" in rule:
+        return len(rule["simple"])
+    if "groups" in rule:
+        return sum(len(fieldDefs) for groupName, fieldDefs in rule["groups"])
+    return None
+
+def rule_fields(rule):
+    '''All the (fieldName, displayMode) a terse/simple/groups rule shows.'''
+    for kind in ("terse", "simple"):
+        if kind in rule:
+            return rule[kind]
+    if "groups" in rule:
+        return tuple(fieldDef for groupName, fieldDefs in rule["groups"]
+                     for fieldDef in fieldDefs)
+    return ()
+
+def rule_line_estimate(rule):
+    '''
+    About how many lines an object takes when its fields are all one-liners:
+    a header, plus a label line and a value line per field and a line per
+    group.  None if the rule doesn't say (containers, say).
+    '''
+    if not rule:
+        return None
+    if "simple" in rule:
+        return 1 + 2 * len(rule["simple"])
+    if "groups" in rule:
+        return 1 + sum(1 + 2 * len(fieldDefs)
+                       for groupName, fieldDefs in rule["groups"])
+    return None
+
 def is_simple_type(vtype):
     """Return true if the type is a simple native type or a typedef to one.  This
 is mainly used to figure out whether a type merits naming it or not, and perhaps
@@ -47,6 +164,723 @@ whether it can/should be displayed inline.
             code == gdb.TYPE_CODE_FLT or
             code == gdb.TYPE_CODE_BOOL)
 
+class _Line(object):
+    __slots__ = ('indent', 'fmt', 'args')
+
+    def __init__(self, indent, fmt, args):
+        self.indent = indent
+        self.fmt = fmt
+        self.args = args
+
+class LineRecorder(object):
+    '''
+    Stands in for pout (as PrettyPrintCommand._out) and remembers what would
+    have been printed, a line at a time, so "pp /fit" can decide what to show
+    before showing it.  With a limit, going over it raises Overflowed.
+    '''
+    def __init__(self):
+        self.lines = []
+        self._indentLevel = 0
+        self.limit = None
+        self._count = 0
+
+    def reset(self, indent, limit=None):
+        self.lines = []
+        self._indentLevel = indent
+        self.limit = limit
+        self._count = 0
+
+    def __call__(self, fmt, *args):
+        self.lines.append(_Line(self._indentLevel, fmt, args))
+        self._count += 1 + fmt.count('\n')
+        if self.limit is not None and self._count > self.limit:
+            raise Overflowed()
+
+    def v(self, fmt, *args):
+        if pout._verbose:
+            self(fmt, *args)
+
+    def i(self, indentAdjust):
+        self._indentLevel = max(0, self._indentLevel + indentAdjust)
+
+    def _get_terminal_columns(self):
+        return pout._get_terminal_columns()
+
+    def replay(self, lines, out=None):
+        '''Print lines to out (pout, or another LineRecorder).'''
+        if out is None:
+            out = pout
+        for line in lines:
+            out.i(line.indent - out._indentLevel)
+            out(line.fmt, *line.args)
+        out.i(-1000)
+
+def _plain(arg):
+    # Format arguments as something marshal (and so rrmemo) can keep.
+    if isinstance(arg, gdb.Value):
+        if arg.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            return int(arg)
+        return str(arg)
+    if arg is None or isinstance(arg, (int, float, str)):
+        return arg
+    return str(arg)
+
+def count_lines(lines):
+    return sum(1 + line.fmt.count('\n') for line in lines)
+
+def terminal_lines():
+    try:
+        return termhelp.getTerminalSize()[0]
+    except Exception:
+        return 25
+
+
+class PPJSONHooks(object):
+    '''
+    The JSON versions of PrettyPrintCommand's _log_* presentation hooks, for
+    "pp /json FILE EXPR".  The command's _hooks is one of these for the
+    duration of the invocation, writing to the JSONStreamWriter w.  Objects
+    come out as {"type", "address", "id", ...} with their contents under
+    "fields", "items" or "entries", and leaves are just their (string) values.
+    '''
+    def __init__(self, cmd, w):
+        self.cmd = cmd
+        self.w = w
+        # (how far truncation unwinds; see _log_enter_poi)
+        self.top = 1
+
+    def _json_node(self, val, tname):
+        w = self.w
+        w.begin_object()
+        w.key("type")
+        w.value(tname)
+        addr = val.address
+        if addr is not None:
+            w.key("address")
+            w.value("0x%x" % int(addr))
+        node = self.cmd._entering
+        self.cmd._entering = None
+        if node is not None:
+            w.key("id")
+            w.value(node)
+
+    def _json_guarded(self, fn, *args):
+        # Run fn, and if it throws, close whatever it left open and note the
+        # error in its place instead of corrupting the output.
+        w = self.w
+        depth = w.depth
+        count = w.count()
+        try:
+            fn(*args)
+        except Truncated:
+            raise
+        except Exception as e:
+            w.unwind(depth, {"error": str(e)})
+            if w.count() == count:
+                w.value({"error": str(e)})
+
+    def _log_traverse(self, val, rule, tname, steps):
+        pass
+
+    def _log_value(self, text):
+        self.w.value(text)
+
+    def _log_unnamed(self, val, uncast):
+        self.w.value(str(val))
+
+    def _log_string(self, text, length, truncated):
+        # (text is None for a voided string)
+        if truncated:
+            self.w.value({"text": text, "length": length})
+        else:
+            self.w.value(text)
+
+    def _log_enum(self, name, num_val):
+        self.w.value(name if name is not None else num_val)
+
+    def _log_error(self, msg):
+        self.w.note("error", msg)
+
+    def _log_field_error(self, fieldName, e):
+        self.w.key(fieldName)
+        self.w.value({"error": str(e)})
+
+    def _log_no_mapping(self, tname, plain):
+        pass
+
+    def _log_backref(self, val, tname, node):
+        self.w.value({"ref": node, "type": tname,
+                          "address": "0x%x" % int(val.address)})
+
+    def _log_stub(self, val, tname, node, hidden=None):
+        stub = {"stub": node, "type": tname,
+                "address": "0x%x" % int(val.address)}
+        if hidden:
+            stub["fields"] = hidden
+        self.w.value(stub)
+
+    def _log_truncated(self, budget):
+        # (we're back at the top level having unwound out of everything)
+        self.w.unwind(self.top)
+        self.w.key("truncated")
+        self.w.value(budget)
+
+    def _log_enter_poi(self, key, name, expr):
+        w = self.w
+        w.key(key)
+        w.begin_object()
+        w.key("name")
+        w.value(name)
+        w.key("expression")
+        w.value(expr)
+        # (so that truncation only unwinds out of this one)
+        self.top = w.depth
+        w.key("value")
+
+    def _log_exit_poi(self, key):
+        self.w.unwind(self.top - 1)
+        self.top = 1
+
+    def _log_bitflag_bits(self, raw_val, bit_pieces, tname, leftover=0):
+        flags = {"type": tname, "value": raw_val, "flags": bit_pieces}
+        if leftover:
+            flags["unknown"] = leftover
+        self.w.value(flags)
+
+    def _log_enter_array(self, val, tname):
+        self._json_node(val, tname)
+        self.w.key("items")
+        self.w.begin_array()
+
+    def _log_item_in_array(self, i, val):
+        self._json_guarded(self.cmd._inspect, val)
+
+    def _log_pod_items_in_array(self, first, values, fmt):
+        w = self.w
+        if fmt is str or fmt is repr:
+            # plain numbers
+            for v in values:
+                w.value(v)
+        else:
+            for v in values:
+                w.value(fmt(v))
+
+    def _log_elided_in_array(self, count):
+        self.w.value({"elided": count})
+
+    def _log_exit_array(self, val, tname):
+        self.w.end()
+        self.w.end()
+
+    def _log_enter_map(self, val, tname):
+        self._json_node(val, tname)
+        self.w.key("entries")
+        self.w.begin_object()
+
+    def _log_item_in_map(self, key, val):
+        self.w.key(key)
+        self._json_guarded(self.cmd._inspect, val)
+
+    def _log_exit_map(self, val, tname):
+        self.w.end()
+        self.w.end()
+
+    def _log_terse_object(self, val, rule, tname, fieldDefs):
+        w = self.w
+        self._json_node(val, tname)
+        w.key("fields")
+        w.begin_object()
+        for fieldName, displayMode in fieldDefs:
+            w.key(fieldName)
+            try:
+                w.value(self.cmd._terse_field_text(val, fieldName))
+            except Exception as e:
+                w.value({"error": str(e)})
+        w.end()
+        w.end()
+
+    def _log_enter_detailed_object(self, val, rule, tname):
+        self._json_node(val, tname)
+        self.w.key("fields")
+        self.w.begin_object()
+
+    def _log_enter_object_group(self, groupName, rule):
+        self.w.key(groupName)
+        self.w.begin_object()
+
+    def _log_field_in_detailed_object(self, key, val, displayMode):
+        explicit_type = None
+        if displayMode is not True:
+            explicit_type = displayMode
+        self.w.key(key)
+        self._json_guarded(self.cmd._inspect, val, explicit_type)
+
+    def _log_scalar_field_in_detailed_object(self, key, emit, value):
+        self.w.key(key)
+        emit(value)
+
+    def _log_exit_object_group(self, groupName, rule):
+        self.w.end()
+
+    def _log_exit_detailed_object(self, val, rule, tname):
+        self.w.end()
+        self.w.end()
+
+
+### Snapshots
+# "pp /snap NAME EXPR" keeps the tree pp would have shown for EXPR, and "pp
+# /diff NAME" shows what's changed in it since.  Objects remember a digest of
+# their raw bytes (one read_memory each) plus the digests of what those bytes
+# lead to, so a diff can tell which subtrees are untouched from raw reads
+# alone and doesn't decode (or print) them at all.
+
+# Field types whose value is entirely in the field's own bytes.
+SNAP_SCALAR_CODES = (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_ENUM, gdb.TYPE_CODE_BOOL,
+                     gdb.TYPE_CODE_FLT, gdb.TYPE_CODE_CHAR)
+# (x86-64, like everything else we do under rr)
+SNAP_POINTER_SIZE = 8
+# How far before its elements a contiguous container's header can be.
+SNAP_ARRAY_HEADER = 64
+# Arrays bigger than this are always decoded again.
+SNAP_ARRAY_BYTES = 1 << 24
+
+def _digest(raw):
+    return hashlib.blake2b(raw, digest_size=16)
+
+def _read_digest(span):
+    addr, length = span
+    if not length:
+        return _digest(b'')
+    return _digest(gdb.selected_inferior().read_memory(addr,
+                                                       length).tobytes())
+
+class SnapNode(object):
+    '''
+    One thing in a snapshot: a leaf (children is None) and its text, or an
+    object, array or map with a header and a list of (name, SnapNode).
+
+    Nodes whose contents can be vouched for from raw memory have a span
+    (address, length) and a digest of those bytes plus those of their deps,
+    the nodes their bytes lead to: objects they embed or point at, and the
+    characters of their strings.  digest is None for anything else.
+    '''
+    __slots__ = ('text', 'children', 'key', 'span', 'digest', 'deps', 'ref',
+                 'cost')
+
+    def __init__(self, text, children=None):
+        self.text = text
+        self.children = children
+        # (address, tname) for objects pp tracks
+        self.key = None
+        self.span = None
+        self.digest = None
+        self.deps = []
+        # the address a back-reference or stub is for
+        self.ref = None
+        # how much of the node budget what's inside took
+        self.cost = 0
+
+def _snap_walk(node):
+    yield node
+    for name, child in node.children or ():
+        for sub in _snap_walk(child):
+            yield sub
+
+def _snap_path(path, name):
+    if name.startswith('['):
+        return path + name
+    return '%s.%s' % (path, name)
+
+def _snap_summary(node):
+    if node.children is None:
+        return node.text
+    return '%s {...}' % (node.text or '')
+
+class _SnapOpen(object):
+    '''An object or array PPSnapHooks is in the middle of.'''
+    __slots__ = ('node', 'base', 'raw', 'inline', 'first', 'esize', 'ecode',
+                 'estring', 'nodes_left')
+
+    def __init__(self, node, nodes_left):
+        self.node = node
+        self.nodes_left = nodes_left
+        # the raw bytes node.span covers, and where they start
+        self.base = None
+        self.raw = b''
+        # everything so far can be vouched for from raw and node.deps
+        self.inline = False
+        # (arrays) the first element's address, the element size and type
+        # code, and whether the elements are strings
+        self.first = None
+        self.esize = None
+        self.ecode = None
+        self.estring = False
+
+class PPSnapHooks(object):
+    '''
+    The snapshot versions of PrettyPrintCommand's _log_* hooks.  Like
+    PPJSONHooks they're the command's _hooks for the duration, but rather
+    than printing they build a tree of SnapNodes under root.  self.stack is
+    the open containers, and self.objs the open objects and arrays, as
+    _SnapOpens.
+    '''
+    def __init__(self, cmd, root):
+        self.cmd = cmd
+        self.stack = [root]
+        self.objs = []
+        # (the budget we ran out of, if we did)
+        self.truncated = None
+        # how many objects "pp /diff" carried over without decoding
+        self.reused = 0
+
+    def _snap_add(self, node, name=''):
+        self.stack[-1].children.append((name, node))
+        return node
+
+    def _snap_child(self, name, fn, *args):
+        # Run fn, and file whatever it logs under name.
+        slot = SnapNode(None, [])
+        depth = len(self.objs)
+        self.stack.append(slot)
+        try:
+            fn(*args)
+        except Truncated:
+            raise
+        except Exception as e:
+            slot.children.append(('error', SnapNode(str(e))))
+        finally:
+            # (whatever was left open by an exception stays that way)
+            while self.stack.pop() is not slot:
+                pass
+            del self.objs[depth:]
+        child = slot
+        if len(slot.children) == 1:
+            child = slot.children[0][1]
+        return self._snap_add(child, name)
+
+    def _snap_container(self, val, tname):
+        addr = val.address
+        if addr is None:
+            node = SnapNode(tname, [])
+        else:
+            node = SnapNode('%s 0x%x' % (tname, int(addr)), [])
+        self.cmd._entering = None
+        self._snap_add(node)
+        self.stack.append(node)
+        return node
+
+    def _snap_open(self, node, span):
+        # Start an object or array whose own bytes are span.
+        opened = _SnapOpen(node, self.cmd._nodes_left)
+        self.objs.append(opened)
+        if span is not None:
+            try:
+                opened.raw = gdb.selected_inferior().read_memory(
+                    *span).tobytes()
+                opened.base = span[0]
+                opened.inline = True
+                node.span = span
+            except gdb.MemoryError:
+                pass
+        return opened
+
+    def _snap_close(self):
+        opened = self.objs.pop()
+        self.stack.pop()
+        node = opened.node
+        node.cost = opened.nodes_left - self.cmd._nodes_left
+        # (an empty budget means we're unwinding from Truncated and didn't
+        # get to all of it)
+        if (opened.inline and self.cmd._nodes_left > 0 and
+                all(dep.digest is not None for dep in node.deps)):
+            h = _digest(opened.raw)
+            for dep in node.deps:
+                h.update(dep.digest)
+            node.digest = h.digest()
+
+    def _snap_member(self, name, val, explicit_type, faddr, code, string):
+        '''
+        Snapshot val, a field or element of the innermost open object or
+        array, which lives at faddr and has a type with the given code (and is
+        one of mozstrings' strings if string).
+        '''
+        opened = self.objs[-1]
+        if string and opened.inline and faddr is not None:
+            string = self._snap_string_chars(opened, faddr, val)
+        else:
+            string = None
+        child = self._snap_child(name, self.cmd._inspect, val, explicit_type)
+        if opened.inline:
+            opened.inline = self._snap_inline(opened, faddr, code, string,
+                                              child)
+
+    def _snap_string_chars(self, opened, faddr, val):
+        # A string's header is in its parent's bytes, but its characters
+        # (usually) aren't, so they get a node of their own.
+        layout = mozstrings.string_layout(val.type)
+        dataOffset, ptrSize, lenOffset, flagsOffset, width, header = layout
+        raw = opened.raw
+        off = faddr - opened.base
+        if off < 0 or off + header > len(raw):
+            return None
+        data = int.from_bytes(raw[off + dataOffset:off + dataOffset + ptrSize],
+                              'little')
+        length = int.from_bytes(raw[off + lenOffset:off + lenOffset + 4],
+                                'little')
+        chars = SnapNode(None)
+        chars.span = (data, min(length, mozstrings.max_chars) * width)
+        try:
+            chars.digest = _read_digest(chars.span).digest()
+        except gdb.MemoryError:
+            return None
+        return chars
+
+    def _snap_inline(self, opened, faddr, code, string, child):
+        '''Can child, at faddr, be vouched for from opened's bytes?'''
+        raw = opened.raw
+        if faddr is None or not 0 <= faddr - opened.base < len(raw):
+            return False
+        if code in SNAP_SCALAR_CODES:
+            return child.children is None
+        if string is not None:
+            if child.children is not None:
+                return False
+            opened.node.deps.append(string)
+            return True
+        off = faddr - opened.base
+        word = int.from_bytes(raw[off:off + SNAP_POINTER_SIZE], 'little')
+        if code == gdb.TYPE_CODE_PTR and word == 0:
+            # (a null pointer)
+            return child.children is None
+        if child.key is not None:
+            target = child.key[0]
+        elif child.span is not None:
+            target = child.span[0]
+        else:
+            # (back-references and stubs)
+            target = child.ref
+        if target is None or (target != faddr and word != target):
+            return False
+        if child.key is not None or child.span is not None:
+            opened.node.deps.append(child)
+        return True
+
+    def _log_traverse(self, val, rule, tname, steps):
+        pass
+
+    def _log_value(self, text):
+        self._snap_add(SnapNode(text))
+
+    def _log_string(self, text, length, truncated):
+        self._snap_add(SnapNode(mozstrings.quote(text, length, truncated)))
+
+    def _log_unnamed(self, val, uncast):
+        leaf = self._snap_add(SnapNode(str(val)))
+        stype = val.type.strip_typedefs()
+        if stype.code != gdb.TYPE_CODE_PTR:
+            return
+        try:
+            ptr = int(val)
+            if ptr and stype.target().strip_typedefs().sizeof == 1:
+                # A char* is whatever's there up to the NUL.  (latin-1 so it's
+                # one character per byte; the NUL's included so that the
+                # string getting longer counts as a change)
+                leaf.span = (ptr, len(val.string('latin-1')) + 1)
+            elif uncast.address is not None:
+                # Anything else is just the pointer.
+                leaf.span = (int(uncast.address), stype.sizeof)
+            else:
+                return
+            leaf.digest = _read_digest(leaf.span).digest()
+        except (gdb.error, gdb.MemoryError):
+            leaf.span = None
+
+    def _log_enum(self, name, num_val):
+        if name is None:
+            name = 'unknown enum value %x' % num_val
+        self._snap_add(SnapNode(name))
+
+    def _log_error(self, msg):
+        self._snap_add(SnapNode(msg), 'error')
+
+    def _log_field_error(self, fieldName, e):
+        self._snap_add(SnapNode('error: %s' % e), fieldName)
+        self.objs[-1].inline = False
+
+    def _log_no_mapping(self, tname, plain):
+        pass
+
+    def _log_backref(self, val, tname, node):
+        addr = int(val.address)
+        leaf = self._snap_add(SnapNode('↺ %s 0x%x' % (tname, addr)))
+        leaf.ref = addr
+
+    def _log_stub(self, val, tname, node, hidden=None):
+        addr = int(val.address)
+        leaf = self._snap_add(SnapNode('%s 0x%x ...' % (tname, addr)))
+        leaf.ref = addr
+
+    def _log_truncated(self, budget):
+        self.truncated = budget
+
+    def _log_unchanged(self, val, tname, key):
+        # (pp /diff: this one's bytes and everything they lead to are as they
+        # were, so it's what we had, and counts as visited and expanded just
+        # like it did then)
+        node = self._snap_add(self.cmd._unchanged[key])
+        self.cmd._nodes_left -= node.cost
+        for sub in _snap_walk(node):
+            if sub.key is not None:
+                self.cmd._visited.add(sub.key)
+                if sub.children is not None:
+                    self.cmd._expands_left -= 1
+                    self.reused += 1
+
+    def _log_bitflag_bits(self, raw_val, bit_pieces, tname, leftover=0):
+        text = ' '.join(bit_pieces)
+        if leftover:
+            text += ' +%x' % leftover
+        self._snap_add(SnapNode('%s 0x%x' % (text, raw_val)))
+
+    def _log_enter_array(self, val, tname):
+        node = self._snap_container(val, tname)
+        addr = val.address
+        contiguous = addr is not None and self.cmd._contiguous_span(val)
+        if not contiguous:
+            self._snap_open(node, None)
+            return
+        etype, first, count = contiguous
+        esize = etype.sizeof
+        stype = etype.strip_typedefs()
+        # nsTArray points at a header (with the length) just before the
+        # elements; that's part of what the array's bytes are.
+        start = int.from_bytes(gdb.selected_inferior().read_memory(
+            int(addr), SNAP_POINTER_SIZE).tobytes(), 'little')
+        if not first - SNAP_ARRAY_HEADER <= start <= first:
+            start = first
+        length = first - start + count * esize
+        if length > SNAP_ARRAY_BYTES:
+            self._snap_open(node, None)
+            return
+        opened = self._snap_open(node, (start, length))
+        opened.first = first
+        opened.esize = esize
+        opened.ecode = stype.code
+        opened.estring = mozstrings.string_layout(etype) is not None
+
+    def _log_item_in_array(self, i, val):
+        opened = self.objs[-1]
+        name = str(i)
+        if not name.startswith('['):
+            name = '[%s]' % name
+        if opened.first is None:
+            self._snap_child(name, self.cmd._inspect, val)
+            return
+        try:
+            index = int(name.strip('[]'))
+        except ValueError:
+            opened.inline = False
+            self._snap_child(name, self.cmd._inspect, val)
+            return
+        self._snap_member(name, val, None,
+                          opened.first + index * opened.esize,
+                          opened.ecode, opened.estring)
+
+    def _log_pod_items_in_array(self, first, values, fmt):
+        # (straight out of the array's own bytes)
+        for i, v in enumerate(values):
+            self._snap_add(SnapNode(fmt(v)), '[%d]' % (first + i))
+
+    def _log_elided_in_array(self, count):
+        self._snap_add(SnapNode('%d more' % count), '...')
+
+    def _log_exit_array(self, val, tname):
+        self._snap_close()
+
+    def _log_enter_map(self, val, tname):
+        self._snap_container(val, tname)
+
+    def _log_item_in_map(self, key, val):
+        self._snap_child('[%s]' % key, self.cmd._inspect, val)
+
+    def _log_exit_map(self, val, tname):
+        self.stack.pop()
+
+    def _log_terse_object(self, val, rule, tname, fieldDefs):
+        node = self._snap_container(val, tname)
+        try:
+            scalar = True
+            for fieldName, displayMode in fieldDefs:
+                try:
+                    fieldVal = val[fieldName]
+                    code = fieldVal.type.strip_typedefs().code
+                    scalar = scalar and code in SNAP_SCALAR_CODES
+                    text = self.cmd._terse_field_text(val, fieldName)
+                except Exception as e:
+                    scalar = False
+                    text = 'error: %s' % e
+                self._snap_add(SnapNode(text), fieldName)
+            # All in its own bytes?  Then those are all it takes.
+            addr = val.address
+            if scalar and addr is not None:
+                node.span = (int(addr), val.type.sizeof)
+                try:
+                    node.digest = _read_digest(node.span).digest()
+                except gdb.MemoryError:
+                    pass
+        finally:
+            self.stack.pop()
+
+    def _log_enter_detailed_object(self, val, rule, tname):
+        # (_inspect already knows where and what it is)
+        at = self.cmd._entering_at
+        node = self._snap_container(val, tname)
+        span = None
+        if at is not None and at[1] is not None:
+            node.key = (at[0], tname)
+            span = (at[0], at[1].sizeof)
+        self._snap_open(node, span)
+
+    def _log_enter_object_group(self, groupName, rule):
+        # (groups are just presentation; their fields are the object's)
+        pass
+
+    def _log_field_in_detailed_object(self, key, val, displayMode):
+        explicit_type = None
+        if displayMode is not True:
+            explicit_type = displayMode
+        opened = self.objs[-1]
+        faddr = code = string = None
+        if opened.inline:
+            # Where a field is in an object, and what it is, only depends on
+            # the object's type.
+            fkey = (opened.node.key[1], key)
+            layout = self.cmd._snap_fields.get(fkey)
+            if layout is None:
+                addr = val.address
+                offset = None
+                if addr is not None:
+                    offset = int(addr) - opened.base
+                vtype = val.type
+                layout = self.cmd._snap_fields[fkey] = (
+                    offset, vtype.strip_typedefs().code,
+                    mozstrings.string_layout(vtype) is not None)
+            offset, code, string = layout
+            if offset is not None:
+                faddr = opened.base + offset
+        self._snap_member(key, val, explicit_type, faddr, code, string)
+
+    def _log_scalar_field_in_detailed_object(self, key, emit, value):
+        # (straight out of the object's own bytes)
+        self._snap_child(key, emit, value)
+
+    def _log_exit_object_group(self, groupName, rule):
+        pass
+
+    def _log_exit_detailed_object(self, val, rule, tname):
+        self._snap_close()
+
+
 class PrettyPrintCommand(gdb.Command):
     """A prettier version of the gdb "print" command that supports its own
 YAML-defined pretty printer definitions in addition to Python-implemented pretty
@@ -80,26 +914,146 @@ Our driving goals, aware of the above are then:
   to care about all of it at once.  Additionally, these groups can be inferred
   based on tags placed on the types of the members.
 """
+    # How many values a single invocation will look at before giving up.  Live
+    # heaps can have corrupt pointers and arbitrarily large graphs, and we'd
+    # rather say we stopped than have the user reach for Ctrl-C.
+    node_budget = 5000
+    # Objects nested deeper than stub_depth, or beyond the first expand_budget
+    # objects of an invocation, aren't read; they're printed as stubs with a
+    # handle number that "pp #N" (or "pp #N.mField") expands later.
+    stub_depth = 6
+    expand_budget = 1000
+    # Handles are forgotten whenever the program runs, or at the start of a pp
+    # once there are this many of them.
+    max_handles = 100000
+    # Under rr, the output of this many recent text pp's is remembered by
+    # where they were run (see rrmemo), so going back to the same spot and
+    # asking again is free.
+    memo_entries = 64
+    # Arrays of scalars are read in bulk, POD_CHUNK elements (and one unit of
+    # node budget) at a time, but never more than pod_array_limit of them.
+    POD_CHUNK = 65536
+    pod_array_limit = 1 << 20
+    # Classes with no rule or pretty-printer show this many of their scalar
+    # and pointer fields.
+    fallback_fields = 32
+
     def __init__(self):
         gdb.Command.__init__(self, "pp", gdb.COMMAND_NONE)
 
-        config_path = os.path.join(os.path.dirname(__file__), "pp-mozilla.yaml")
-        with open(config_path, "r") as f:
-            # This recursively flattens the YAML instances to dicts and lists
-            # and scalars.
-            self.mapping = load(f.read()).data
+        # Aliases are already resolved and field lists are flattened to tuples
+        # of (fieldName, displayMode); see pprules.
+        self._rule_files = pprules.RuleFiles()
+        self._rule_files.refresh(self._rule_paths())
+        self.mapping = self._rule_files.rules
+
+        # (in order of precedence, should a rule have more than one)
+        self._rule_handlers = (
+            ("string", self._print_string),
+            ("traverse", self._traverse),
+            ("iterate", self._iterate),
+            ("bitflags", self._bitflags),
+            ("terse", self._print_terse),
+            ("simple", self._print_simple),
+            ("groups", self._print_groups),
+        )
+        # Where the _log_* hooks send their output; see LineRecorder.
+        self._out = pout
+        # What the _log_* calls go to: ourselves for text, or PPJSONHooks or
+        # PPSnapHooks while one of those is writing something else instead.
+        self._hooks = self
+        # (only a list when "pp /fit" is collecting stubs)
+        self._new_stubs = None
+        self._memo = rrmemo.EventMemo('pp', self.memo_entries)
+        # (only a set when we're recording output for the memo)
+        self._touched = None
+        # name -> (expression, SnapNode, truncated budget or None)
+        self._snapshots = {}
+        # (only a dict, of the snapshot's nodes by key, during "pp /diff")
+        self._unchanged = None
+
+        self._clear_dispatch_cache()
+        self._forget_handles()
+        self._reset_visited(self.node_budget, self.stub_depth)
+        # (replacing the last pp's, if we're being re-imported)
+        connect_events('pp', [
+            ('new_objfile', self._clear_dispatch_cache),
+            ('cont', self._forget_handles),
+            ('memory_changed', self._forget_handles),
+            ('clear_objfiles', self._clear_dispatch_cache),
+        ])
 
     ### Log functions
     # These are for both debugging and to let us separate out the actual
     # presentation details.  This is all stream-parsing inspired.  Specific
     # calls are made when entering and exiting a nested representation.
+    def _log_node_header(self, val, tname):
+        # the node number is what back-references point at.
+        node = self._entering
+        self._entering = None
+        if node is None:
+            self._out("{n}%s {s}%x", tname, val.address)
+        else:
+            self._out("{n}%s {s}%x #%d", tname, val.address, node)
+
     def _log_traverse(self, val, rule, tname, steps):
-        pout.v("{s}Traversing %s %s using steps %s",
-               rule["kind"], tname, repr(steps))
+        self._out.v("{s}Traversing %s %s using steps %s",
+                    rule["kind"], tname, repr(steps))
+
+
+    def _log_value(self, text):
+        # a leaf value we've already turned into a string.
+        self._out("{n}%s", text)
+
+    def _log_string(self, text, length, truncated):
+        self._out("{n}%s", mozstrings.quote(text, length, truncated))
 
+    def _log_enum(self, name, num_val):
+        if name is not None:
+            # XXX use a logger that maybe prints the namespace as {s}
+            self._out('{n}%s', name)
+        else:
+            self._out('{s}unknown enum value {n}%x', num_val)
+
+    def _log_error(self, msg):
+        self._out("{e}%s", msg)
 
-    def _log_bitflag_bits(self, raw_val, bit_pieces, tname):
-        pout("{n}%s {s}%x", ' '.join(bit_pieces), raw_val)
+    def _log_field_error(self, fieldName, e):
+        self._out("{e}Exception inspecting field %s: %s", fieldName, e)
+
+    def _log_no_mapping(self, tname, plain):
+        if plain:
+            self._out("{s}No mapping or pretty-printer for {n}%s{s}, switching to its plain fields.", tname)
+        else:
+            self._out("{s}No mapping or pretty-printer for {n}%s{s}, switching to gdb print.", tname)
+
+    def _log_backref(self, val, tname, node):
+        self._out("{s}\u21ba see #%d {n}%s {s}%x", node, tname, val.address)
+
+    def _log_stub(self, val, tname, node, hidden=None):
+        if hidden:
+            self._out("{n}%s {s}%x #%d ... %d fields {s}(pp #%d)",
+                      tname, val.address, node, hidden, node)
+        else:
+            self._out("{n}%s {s}%x #%d ... {s}(pp #%d)",
+                      tname, val.address, node, node)
+
+    def _log_truncated(self, budget):
+        self._out("{e}... truncated after %d values {s}(pp /budget=N to see more)",
+                  budget)
+
+    def _log_enter_poi(self, key, name, expr):
+        self._out("{k}%s{n}: {fn}%s {s}%s", key, name, expr)
+        self._out.i(2)
+
+    def _log_exit_poi(self, key):
+        self._out.i(-2)
+
+    def _log_bitflag_bits(self, raw_val, bit_pieces, tname, leftover=0):
+        if leftover:
+            self._out("{n}%s {e}+%x {s}%x", ' '.join(bit_pieces), leftover, raw_val)
+        else:
+            self._out("{n}%s {s}%x", ' '.join(bit_pieces), raw_val)
 
     def _log_enter_array(self, val, tname):
         # XXX We're in a weird place here for the identifying type when it comes
@@ -109,77 +1063,104 @@ Our driving goals, aware of the above are then:
         # val.type is the super complicated thing.  We can definitely add
         # heuristics, if only to build on top of the stdc++ lib's pretty
         # printers)
-        pout("{n}%s {s}%x", tname, val.address)
-        pout.i(2)
+        self._log_node_header(val, tname)
+        self._out.i(2)
 
     def _log_item_in_array(self, i, val):
         self._inspect(val)
 
+    def _log_pod_items_in_array(self, first, values, fmt):
+        '''
+        values are a run of decoded scalars starting at index `first`.  They
+        get printed in right-aligned rows that fit the terminal, each labeled
+        with the index of its first item.
+        '''
+        strs = [fmt(v) for v in values]
+        if not strs:
+            return
+        width = max(len(x) for x in strs)
+        label_width = len('[%d]' % (first + len(strs) - 1))
+        avail = (self._out._get_terminal_columns() - self._out._indentLevel -
+                 label_width - 1)
+        per_row = max(1, avail // (width + 1))
+        row_fmt = "{s}%%%ds {n}%%s" % label_width
+        for i in range(0, len(strs), per_row):
+            self._out(row_fmt, '[%d]' % (first + i),
+                      ' '.join(x.rjust(width) for x in strs[i:i + per_row]))
+
+    def _log_elided_in_array(self, count):
+        self._out("{e}... %d more", count)
+
     def _log_exit_array(self, val, tname):
-        pout.i(-2)
+        self._out.i(-2)
 
     def _log_enter_map(self, val, tname):
-        pout("{n}%s {s}%x", tname, val.address)
-        pout.i(2)
+        self._log_node_header(val, tname)
+        self._out.i(2)
 
     def _log_item_in_map(self, key, val):
-        pout("{k}%s{n}:", key)
-        pout.i(2)
+        self._out("{k}%s{n}:", key)
+        self._out.i(2)
         try:
             self._inspect(val)
         finally:
-            pout.i(-2)
+            self._out.i(-2)
 
     def _log_exit_map(self, val, tname):
-        pout.i(-2)
+        self._out.i(-2)
 
     def _log_terse_object(self, val, rule, tname, fieldDefs):
         fmtbits = []
         fmtvals = []
-        # fieldDefs is a list of singleton dictionaries.
-        for fieldDef in fieldDefs:
-            for fieldName, displayMode in fieldDef.items():
-                fmtvals.append(fieldName)
-                try:
-                    # XXX for now, just coerce to a string, assuming it's
-                    # something simple.  Still need to make some higher level
-                    # decisions.
-                    fmtvals.append(str(val[fieldName]))
-                    fmtbits.append('{k}%s: {v}%s')
-                except Exception as e:
-                    pout('{e}Error displaying field {n}%s {e}stack:\n{s}%s',
-                         fieldName, e);
-                    fmtvals.append('{k}%s: {e}Error')
-        pout(' '.join(fmtbits), *fmtvals)
+        # fieldDefs is a tuple of (fieldName, displayMode) pairs.
+        for fieldName, displayMode in fieldDefs:
+            fmtvals.append(fieldName)
+            try:
+                fmtvals.append(self._terse_field_text(val, fieldName))
+                fmtbits.append('{k}%s: {v}%s')
+            except Exception as e:
+                self._out('{e}Error displaying field {n}%s {e}stack:\n{s}%s',
+                          fieldName, e);
+                fmtvals.append('{k}%s: {e}Error')
+        self._out(' '.join(fmtbits), *fmtvals)
 
     def _log_enter_detailed_object(self, val, rule, tname):
-        pout("{n}%s {s}%x", tname, val.address)
-        pout.i(2)
+        self._log_node_header(val, tname)
+        self._out.i(2)
 
     def _log_enter_object_group(self, groupName, rule):
-        pout("{fn}%s:", groupName)
-        pout.i(2)
+        self._out("{fn}%s:", groupName)
+        self._out.i(2)
 
     def _log_field_in_detailed_object(self, key, val, displayMode):
-        pout("{k}%s{n}:", key)
-        pout.i(2)
+        self._out("{k}%s{n}:", key)
+        self._out.i(2)
         try:
             explicit_type = None
-            if displayMode != 'true' and displayMode is not True:
+            if displayMode is not True:
                 explicit_type = displayMode
             self._inspect(val, explicit_type)
         finally:
-            pout.i(-2)
+            self._out.i(-2)
+
+    def _log_scalar_field_in_detailed_object(self, key, emit, value):
+        # a field that _read_scalars already decoded; emit logs it.
+        self._out("{k}%s{n}:", key)
+        self._out.i(2)
+        try:
+            emit(value)
+        finally:
+            self._out.i(-2)
 
     def _log_exit_object_group(self, groupName, rule):
-        pout.i(-2)
+        self._out.i(-2)
 
     def _log_exit_detailed_object(self, val, rule, tname):
-        pout.i(-2)
+        self._out.i(-2)
 
     def _traverse(self, val, rule, tname):
         steps = rule["traverse"]
-        self._log_traverse(val, rule, tname, steps)
+        self._hooks._log_traverse(val, rule, tname, steps)
 
         cur = val
         for step in steps:
@@ -199,50 +1180,85 @@ Our driving goals, aware of the above are then:
 
         self._inspect(cur)
 
+    def _print_string(self, val, rule, tname):
+        # Strings get decoded natively (see mozstrings) rather than going
+        # through gdb, unless the layout isn't one we know, in which case the
+        # rule had better have a traverse to fall back on.
+        if mozstrings.is_string(val):
+            self._hooks._log_string(*mozstrings.read_string(val))
+        elif "traverse" in rule:
+            self._traverse(val, rule, tname)
+        else:
+            self._hooks._log_value(str(val))
+
     def _iterate(self, val, rule, tname):
         irule = rule["iterate"]
         if "sentinel" in irule:
             # Linked List using a sentinel!
 
-            # extract the field names and type info
-            sentinel_name = irule["sentinel"]
-            advance_name = irule["advance"]
-            t_ptr_type = val.type.template_argument(0).pointer()
+            self._hooks._log_enter_array(val, tname)
+            try:
+                for i, elem in enumerate(self._walk_list(val, irule,
+                                                         irule["advance"])):
+                    self._hooks._log_item_in_array(i, elem)
+            finally:
+                self._hooks._log_exit_array(val, tname)
 
-            # save off the sentinel's address so we know when we've looped back
-            # around to it.
-            sentinel = val[sentinel_name]
-            pSentinel = sentinel.address
+    def _walk_list(self, val, irule, link_name, report=None):
+        '''
+        Generate the elements of the sentinel list val, following link_name
+        (the rule's "advance", or its "retreat" to go backwards) from the
+        sentinel until we get back to it.  Broken lists are complained about
+        to report (default _log_error).
+        '''
+        if report is None:
+            report = self._hooks._log_error
+        t_ptr_type = val.type.template_argument(0).pointer()
 
-            self._log_enter_array(val, tname)
+        # save off the sentinel's address so we know when we've looped back
+        # around to it.
+        sentinel = val[irule["sentinel"]]
+        pSentinel = sentinel.address
 
-            try:
-                # now walk until we loop
-                pNext = sentinel[advance_name]
-                i = 0
-                while pSentinel != pNext:
-                    list_elem = pNext.dereference()
-                    list_value = pNext.cast(t_ptr_type)
-                    self._log_item_in_array(i, list_value.dereference())
-                    pNext = list_elem[advance_name]
-                    i += 1
-            finally:
-                self._log_exit_array(val, tname)
+        # now walk until we loop.  A corrupt list may loop back to somewhere
+        # other than the sentinel (or nowhere), so keep track of where we've
+        # been.
+        pNext = sentinel[link_name]
+        seen_links = set()
+        i = 0
+        while pSentinel != pNext:
+            if not pNext:
+                report("list ends in a null link after %d items" % i)
+                return
+            link = int(pNext)
+            if link in seen_links:
+                report("\u21ba list loops back on itself after %d items" % i)
+                return
+            seen_links.add(link)
+            list_elem = pNext.dereference()
+            yield pNext.cast(t_ptr_type).dereference()
+            pNext = list_elem[link_name]
+            i += 1
 
     def _bitflags(self, val, rule, tname):
-        brule = rule["bitflags"]
-        zeroName = brule["zero"]
         # get the underlying value and throw if the type is wrong.
-        val_bits = val | 0
-        # this could probably be optimized...
-        bit_pieces = []
-        for bitDef in brule["bits"]:
-            for bitName, bitPos in bitDef.items():
-                # we have to parse the bit every time, we didn't provide a
-                # specific mapping.
-                if (val_bits & (1 << int(bitPos))):
-                    bit_pieces.append(bitName)
-        self._log_bitflag_bits(val_bits, bit_pieces, tname)
+        val_bits = int(val | 0)
+        # the rule was compiled into mask tables when loaded; see pprules.
+        bit_pieces, leftover = pprules.decode_bitflags(rule["bitflags"],
+                                                       val_bits)
+        self._hooks._log_bitflag_bits(val_bits, bit_pieces, tname, leftover)
+
+    def _enum_table(self, vtype):
+        # Returns (mask, {masked value: name}) for the enum type.
+        table = self._enum_tables.get(vtype.name)
+        if table is None:
+            mask = (1 << (8 * vtype.sizeof)) - 1
+            table = {}
+            for field in vtype.fields():
+                # (the first name for a value wins, like the linear scan did)
+                table.setdefault(field.enumval & mask, field.name)
+            table = self._enum_tables[vtype.name] = (mask, table)
+        return table
 
     def _print_enum(self, val, vtype, tname):
         '''HACK Given an explicitly enumerated type, try and match the current value
@@ -255,29 +1271,26 @@ int32_t but the constant is uint32_t.
 Even if the necessity of this check is addressed, it might make sense to keep a
 first-class understanding of enums so we can pretty print the namespaces.
 '''
-        # TODO: nsresult really demands caching...
         # Because of enum rules about the representation type perhaps not
         # being reflected into gdb or whatever, we end up seeing nsresult as a
-        # signed int32_t, so let's just cast over to unsigned before extracting
-        # out instead of doing bit twiddling.
-        try:
-            tsize = vtype.sizeof
-            if tsize <= 4:
-                val = val.cast(gdb.lookup_type('uint32_t'))
-            else:
-                val = val.cast(gdb.lookup_type('uint64_t'))
-            num_val = val + 0
-        except:
-            # maybe we don't have those typedefs?  bollocks.  whatever.
-            pass
+        # signed int32_t while the enumerators may be unsigned (or vice versa).
+        # So both sides get masked down to the type's width, which is the bit
+        # twiddling equivalent of casting over to uint32_t/uint64_t.
+        #
+        # nsresult has hundreds of enumerators and shows up everywhere, so the
+        # value -> name table is built once per enum type.
+        mask, names = self._enum_table(vtype)
 
-        for field in vtype.fields():
-            #pout('{s}checking %s %x', field.name, field.enumval)
-            if field.enumval == num_val:
-                # XXX use a logger that maybe prints the namespace as {s}
-                pout('{n}%s', field.name)
-                return
-        pout('{s}unknown enum value {n}%x', num_val)
+        num_val = int(val) & mask
+        self._hooks._log_enum(names.get(num_val), num_val)
+
+    def _terse_field_text(self, val, fieldName):
+        # XXX for now, just coerce to a string, assuming it's something simple.
+        # Still need to make some higher level decisions.
+        fieldVal = val[fieldName]
+        if mozstrings.is_string(fieldVal):
+            return mozstrings.format_string(fieldVal)
+        return str(fieldVal)
 
     def _print_terse(self, val, rule, tname):
         # XXX need to figure out the UX of this a bit more.  It seems like
@@ -291,66 +1304,722 @@ first-class understanding of enums so we can pretty print the namespaces.
         # display is, etc.  Arguably that specific call wants to be done by the
         # log stream, since JSON cases possibly want all the detail even if it's
         # excessive.
-        self._log_terse_object(val, rule, tname, rule["terse"])
+        self._hooks._log_terse_object(val, rule, tname, rule["terse"])
 
     def _print_simple(self, val, rule, tname):
         # multi-line object display without groups.
-        self._log_enter_detailed_object(val, rule, tname)
+        self._hooks._log_enter_detailed_object(val, rule, tname)
         try:
-            for fieldDef in rule["simple"]:
-                for fieldName, displayMode in fieldDef.items():
-                    try:
-                        self._log_field_in_detailed_object(fieldName, val[fieldName],
-                                                           displayMode)
-                    except Exception as e:
-                        pout("{e}Exception inspecting field %s: %s", fieldName, e)
+            scalars = self._read_scalars(val, rule)
+            for fieldName, displayMode in rule["simple"]:
+                try:
+                    self._print_field(val, fieldName, displayMode, scalars)
+                except Truncated:
+                    raise
+                except Exception as e:
+                    self._hooks._log_field_error(fieldName, e)
         finally:
-            self._log_exit_detailed_object(val, rule, tname)
+            self._hooks._log_exit_detailed_object(val, rule, tname)
 
     def _print_groups(self, val, rule, tname):
         # multi-line object display without groups.
-        self._log_enter_detailed_object(val, rule, tname)
+        self._hooks._log_enter_detailed_object(val, rule, tname)
+
+        try:
+            scalars = self._read_scalars(val, rule)
+            for groupName, fieldDefs in rule["groups"]:
+                self._hooks._log_enter_object_group(groupName, rule)
+
+                try:
+                    for fieldName, displayMode in fieldDefs:
+                        try:
+                            self._print_field(val, fieldName, displayMode,
+                                              scalars)
+                        except Truncated:
+                            raise
+                        except Exception as e:
+                            self._hooks._log_field_error(fieldName, e)
+                finally:
+                    self._hooks._log_exit_object_group(groupName, rule)
+        finally:
+            self._hooks._log_exit_detailed_object(val, rule, tname)
+
+    def _print_field(self, val, fieldName, displayMode, scalars):
+        scalar = scalars.get(fieldName)
+        if scalar is None:
+            self._hooks._log_field_in_detailed_object(fieldName, val[fieldName],
+                                               displayMode)
+            return
+        # (costs a node, just like the _inspect it saves us)
+        if self._nodes_left <= 0:
+            raise Truncated()
+        self._nodes_left -= 1
+        self._hooks._log_scalar_field_in_detailed_object(fieldName, *scalar)
+
+    ### Field plans
+    # Going through val[fieldName] and _inspect for every field a rule shows
+    # means gdb looking the field up by name, and a Value, a dynamic_type and
+    # a str() for each one.  Instead, per concrete type, we work out where the
+    # rule's scalar fields live and how _inspect would have shown them, then
+    # pull them all out of one read_memory.  Fields that need a rule, RTTI or
+    # a pretty-printer still get a gdb.Value.
+    def _scalar_emitter(self, ftype):
+        '''
+        If _inspect would just print a value of ftype as a number (or bool, or
+        enumerator, or address), return (struct format, emit) where emit logs
+        a decoded value the same way.  Otherwise None.
+        '''
+        stype = ftype.strip_typedefs()
+        code = stype.code
+        size = stype.sizeof
+        if size not in _UNSIGNED_FORMATS:
+            return None
+        if code == gdb.TYPE_CODE_PTR:
+            # (_inspect descends into these, or gdb shows them as strings or
+            # symbols)
+            tcode = stype.target().strip_typedefs().code
+            if ftype.name is not None or tcode in (
+                    gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION,
+                    gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR, gdb.TYPE_CODE_FUNC):
+                return None
+            return (_UNSIGNED_FORMATS[size],
+                    lambda v: self._hooks._log_value('0x%x' % v))
+        if ftype.name is None:
+            return None
+        handler, rule, tname, tracked = self._dispatch_for(ftype)
+        if rule is not None:
+            return None
+        if code == gdb.TYPE_CODE_ENUM:
+            mask, names = self._enum_table(ftype)
+            return (_UNSIGNED_FORMATS[size],
+                    lambda v: self._hooks._log_enum(names.get(v & mask), v & mask))
+        if handler != self._print_simple_type:
+            return None
+        if code == gdb.TYPE_CODE_BOOL and size == 1:
+            return 'B', lambda v: self._hooks._log_value('true' if v else 'false')
+        # (gdb shows 1 byte ints as characters, and floats its own way)
+        if code == gdb.TYPE_CODE_INT and size > 1:
+            formats = _SIGNED_FORMATS if _is_signed(stype) else _UNSIGNED_FORMATS
+            return formats[size], lambda v: self._hooks._log_value(str(v))
+        return None
+
+    def _field_plan(self, vtype, rule):
+        '''
+        Return (start, length, {fieldName: (format, offset, emit)}) for the
+        scalar fields of vtype that rule shows, offsets being relative to
+        start, or None if there aren't any.  Cached per type name.
+        '''
+        name = str(vtype)
+        cached = self._field_plans.get(name)
+        if cached is not None and cached[0] is rule:
+            return cached[1]
+        try:
+            offsets = mozstrings.field_offsets(vtype.strip_typedefs())
+        except gdb.error:
+            offsets = {}
+        found = []
+        for fieldName, displayMode in rule_fields(rule):
+            if displayMode is not True or fieldName not in offsets:
+                continue
+            offset, ftype = offsets[fieldName]
+            emitter = self._scalar_emitter(ftype)
+            if emitter is not None:
+                found.append((fieldName, offset, ftype.strip_typedefs().sizeof,
+                              emitter))
+        plan = None
+        if found:
+            start = min(offset for fieldName, offset, size, emitter in found)
+            end = max(offset + size for fieldName, offset, size, emitter in found)
+            plan = (start, end - start, dict(
+                (fieldName, ('<' + emitter[0], offset - start, emitter[1]))
+                for fieldName, offset, size, emitter in found))
+        self._field_plans[name] = (rule, plan)
+        return plan
+
+    def _read_scalars(self, val, rule):
+        '''
+        Decode the scalar fields of val that rule shows with a single read,
+        returning {fieldName: (emit, value)}.
+        '''
+        entering, self._entering_at = self._entering_at, None
+        if entering is not None and entering[1] is not None:
+            addr, vtype = entering
+        else:
+            addr = val.address
+            if addr is None:
+                return {}
+            addr, vtype = int(addr), val.type
+        plan = self._field_plan(vtype, rule)
+        if plan is None:
+            return {}
+        start, length, fields = plan
+        try:
+            raw = gdb.selected_inferior().read_memory(addr + start,
+                                                      length).tobytes()
+        except gdb.MemoryError:
+            # (let the fields report their own errors the slow way)
+            return {}
+        scalars = {}
+        for fieldName, (fmt, offset, emit) in fields.items():
+            scalars[fieldName] = (emit, struct.unpack_from(fmt, raw, offset)[0])
+        return scalars
+
+    def _pod_decoder(self, etype):
+        '''
+        Return (memoryview format, formatter) if values of etype are scalars
+        that we can decode and print ourselves, or None if they need the full
+        _inspect treatment.  Cached per type name.
+        '''
+        name = str(etype)
+        if name in self._pod_decoders:
+            return self._pod_decoders[name]
+        decoder = None
+        stype = etype.strip_typedefs()
+        code = stype.code
+        size = stype.sizeof
+        # (a rule for the type itself wins over our idea of what it is)
+        if self.mapping.get(etype.name or name) or self.mapping.get(stype.name):
+            pass
+        elif code == gdb.TYPE_CODE_ENUM and size in _UNSIGNED_FORMATS:
+            mask, names = self._enum_table(stype)
+            def fmt_enum(v, mask=mask, names=names):
+                name = names.get(v & mask)
+                return name if name is not None else '0x%x' % v
+            decoder = (_UNSIGNED_FORMATS[size], fmt_enum)
+        elif code == gdb.TYPE_CODE_BOOL and size == 1:
+            decoder = ('B', lambda v: 'true' if v else 'false')
+        elif code == gdb.TYPE_CODE_FLT and size in _FLOAT_FORMATS:
+            decoder = (_FLOAT_FORMATS[size], repr)
+        elif (code == gdb.TYPE_CODE_INT or
+              code == gdb.TYPE_CODE_CHAR) and size in _SIGNED_FORMATS:
+            formats = _SIGNED_FORMATS if _is_signed(stype) else _UNSIGNED_FORMATS
+            decoder = (formats[size], str)
+        elif code == gdb.TYPE_CODE_PTR and size in _UNSIGNED_FORMATS:
+            # Pointers to things we'd descend into (or strings) still need
+            # _inspect, but anything else is just an address.
+            tcode = stype.target().strip_typedefs().code
+            if tcode not in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION,
+                             gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR):
+                decoder = (_UNSIGNED_FORMATS[size], lambda v: '0x%x' % v)
+        self._pod_decoders[name] = decoder
+        return decoder
+
+    def _contiguous_span(self, val):
+        '''
+        If val is a container with a known contiguous layout, return (element
+        type, address of the first element, element count), else None.
+        '''
+        stype = val.type.strip_typedefs()
+        tmatch = RE_TEMPLATE_NAME.match(stype.name or '')
+        layout = tmatch and CONTIGUOUS_LAYOUTS.get(tmatch.group(1))
+        if layout is None:
+            return None
+        try:
+            etype = stype.template_argument(0)
+            addr, length = layout(val, etype)
+        except gdb.error:
+            return None
+        return etype, addr, length
+
+    def _pod_array(self, val, tname, start=None, stop=None):
+        '''
+        If val is a container with a known contiguous layout whose elements are
+        scalars, read the buffer (or the [start:stop] slice of it) with
+        read_memory in chunks and print it, returning True.  Otherwise return
+        False and let the caller walk the elements some other way.
+        '''
+        span = self._contiguous_span(val)
+        if span is None:
+            return False
+        etype, addr, length = span
+        decoder = self._pod_decoder(etype)
+        if decoder is None:
+            return False
+        vfmt, fmt = decoder
+        size = etype.sizeof
+        lo, hi, step = slice(start, stop).indices(length)
+
+        self._hooks._log_enter_array(val, tname)
+        try:
+            # A garbage length shouldn't have us read gigabytes.
+            shown = min(max(0, hi - lo), self.pod_array_limit)
+            inferior = gdb.selected_inferior()
+            for first in range(lo, lo + shown, self.POD_CHUNK):
+                if self._nodes_left <= 0:
+                    raise Truncated()
+                self._nodes_left -= 1
+                count = min(self.POD_CHUNK, lo + shown - first)
+                mem = inferior.read_memory(addr + first * size, count * size)
+                self._hooks._log_pod_items_in_array(first,
+                                             memoryview(mem).cast(vfmt), fmt)
+            if hi - lo > shown:
+                self._hooks._log_elided_in_array(hi - lo - shown)
+        finally:
+            self._hooks._log_exit_array(val, tname)
+        return True
+
+    ### Slices
+    # "pp EXPR[start:stop]" shows just that window of a container, reading as
+    # little of the rest of it as we can get away with.  Items are labeled with
+    # their index, so they come out through the map hooks (except for scalars,
+    # whose rows are labeled anyway).
+    def _inspect_slice(self, val, start, stop):
+        val = maybe_deref(val)
+        val, vtype = self._resolve_dynamic(val)
+        stype = vtype.strip_typedefs()
+        tname = str(vtype)
+        label = '%s[%s:%s]' % (tname, '' if start is None else start,
+                               '' if stop is None else stop)
+
+        if stype.code == gdb.TYPE_CODE_ARRAY:
+            lo, hi = stype.range()
+            self._slice_indexed(val, label, hi - lo + 1, start, stop,
+                                lambda i: val[i])
+            return
+
+        rule = None
+        if vtype.name is not None:
+            handler, rule, tname, tracked = self._dispatch_for(vtype)
+        if rule and "sentinel" in rule.get("iterate", ()):
+            self._slice_list(val, rule["iterate"], label, start, stop)
+            return
 
+        if self._pod_array(val, label, start, stop):
+            return
+        span = self._contiguous_span(val)
+        if span is not None:
+            # Elements that need inspecting, but we can still go straight to
+            # the ones we want.
+            etype, addr, length = span
+            first = gdb.Value(addr).cast(etype.pointer())
+            self._slice_indexed(val, label, length, start, stop,
+                                lambda i: first[i])
+            return
+
+        vis = gdb.default_visualizer(val)
+        if vis and hasattr(vis, 'children'):
+            self._slice_items(val, label, vis.children(), start, stop)
+            return
+        raise gdb.GdbError("Don't know how to slice %s" % tname)
+
+    def _slice_indexed(self, val, label, length, start, stop, get):
+        lo, hi, step = slice(start, stop).indices(length)
+        self._hooks._log_enter_map(val, label)
         try:
-            for groupDef in rule["groups"]:
-                for groupName, fieldDefs in groupDef.items():
-                    self._log_enter_object_group(groupName, rule)
-
-                    try:
-                        for fieldDef in fieldDefs:
-                            for fieldName, displayMode in fieldDef.items():
-                                try:
-                                    self._log_field_in_detailed_object(fieldName, val[fieldName],
-                                                                       displayMode)
-                                except Exception as e:
-                                    pout("{e}Exception inspecting field %s: %s", fieldName, e)
-                    finally:
-                        self._log_exit_object_group(groupName, rule)
+            for i in range(lo, hi):
+                self._slice_item('[%d]' % i, get, i)
         finally:
-            self._log_exit_detailed_object(val, rule, tname)
+            self._hooks._log_exit_map(val, label)
+
+    def _slice_item(self, key, get, arg):
+        try:
+            self._hooks._log_item_in_map(key, maybe_deref(get(arg)))
+        except Truncated:
+            raise
+        except Exception as e:
+            self._hooks._log_error("Exception inspecting: %s" % e)
+
+    def _slice_items(self, val, label, items, start, stop):
+        '''
+        Slice an iterable of (key, value) we can only walk forwards.  That's
+        cheap for a non-negative window; otherwise we have to go to the end.
+        '''
+        if (start is None or start >= 0) and (stop is None or stop >= 0):
+            window = itertools.islice(items, start, stop)
+        elif start is not None and start < 0 and stop is None:
+            window = collections.deque(items, maxlen=-start)
+        else:
+            window = list(items)[start:stop]
+        self._hooks._log_enter_map(val, label)
+        try:
+            for key, subval in window:
+                self._slice_item(key, lambda v: v, subval)
+        finally:
+            self._hooks._log_exit_map(val, label)
+
+    def _slice_list(self, val, irule, label, start, stop):
+        retreat = irule.get("retreat")
+        if (retreat and start is not None and start < 0 and
+                (stop is None or stop < 0)):
+            # The window is near the end, so come at it from there.
+            back = list(itertools.islice(self._walk_list(val, irule, retreat),
+                                         -start))
+            back.reverse()
+            n = len(back)
+            items = (('[%d]' % (i - n), elem) for i, elem in enumerate(back))
+            self._slice_items(val, label, items, None,
+                              None if stop is None else n + stop)
+        else:
+            items = (('[%d]' % i, elem) for i, elem in
+                     enumerate(self._walk_list(val, irule, irule["advance"])))
+            self._slice_items(val, label, items, start, stop)
 
+    ### Hash table lookups
+    # "pp TABLE[KEY]" finds KEY in an nsTHashtable and friends by probing the
+    # table the way PLDHashTable does (see mozhash), rather than walking it.
+    def _lookup_table(self, arg):
+        '''
+        (value of arg, or None if it doesn't evaluate; the hash table it is, if
+        it's one mozhash understands, or None)
+        '''
+        try:
+            val = self._eval(arg)
+        except gdb.error:
+            return None, None
+        table = maybe_deref(val)
+        if mozhash.table_info(table.type) is None:
+            return val, None
+        return val, table
+
+    def _index(self, val, arg):
+        '''val[arg] for a plain index, without evaluating val again; or None.'''
+        try:
+            return val[int(arg, 0)]
+        except (ValueError, gdb.error):
+            return None
 
+    def _parse_key(self, arg):
+        # A quoted string or a number is taken literally, anything else is an
+        # expression (or a #N handle) whose value is the key.
+        if arg[0] in '"\'':
+            try:
+                return ast.literal_eval(arg)
+            except (ValueError, SyntaxError):
+                raise gdb.GdbError("Bad string key %s" % arg)
+        try:
+            return int(arg, 0)
+        except ValueError:
+            return self._eval(arg)
+
+    def _inspect_lookup(self, val, arg):
+        tname = str(val.type)
+        entry, probed = mozhash.lookup(val, self._parse_key(arg))
+        self._out.v("{s}Probed %d slots of %s", probed, tname)
+        if entry is None:
+            self._hooks._log_error("No %s in %s" % (arg, tname))
+            return
+        # nsBaseHashtableET keeps the value in mData; for a plain nsTHashtable
+        # the entry is all there is.
+        try:
+            found = entry['mData']
+        except gdb.error:
+            found = entry
+        label = '%s[%s]' % (tname, arg)
+        self._hooks._log_enter_map(val, label)
+        try:
+            self._slice_item('[%s]' % arg, lambda v: v, found)
+        finally:
+            self._hooks._log_exit_map(val, label)
 
     def _gdbvis_array(self, val, vis, tname):
-        self._log_enter_array(val, tname)
+        if self._pod_array(val, tname):
+            return
+        self._hooks._log_enter_array(val, tname)
         # (the index may be a formatted string, not just an integer)
         for indexy, subval in vis.children():
             try:
-                self._log_item_in_array(indexy, maybe_deref(subval))
+                self._hooks._log_item_in_array(indexy, maybe_deref(subval))
+            except Truncated:
+                raise
             except Exception as e:
-                pout("{e}Exception inspecting: %s", e)
-        self._log_exit_array(val, tname)
+                self._hooks._log_error("Exception inspecting: %s" % e)
+        self._hooks._log_exit_array(val, tname)
 
 
     def _gdbvis_map(self, val, vis, tname):
-        self._log_enter_map(val, tname)
+        self._hooks._log_enter_map(val, tname)
         # (the index may be a formatted string, not just an integer)
         for key, subval in vis.children():
             try:
-                self._log_item_in_map(key, maybe_deref(subval))
+                self._hooks._log_item_in_map(key, maybe_deref(subval))
+            except Truncated:
+                raise
             except Exception as e:
-                pout("{e}Exception inspecting: %s", e)
-        self._log_exit_map(val, tname)
+                self._hooks._log_error("Exception inspecting: %s" % e)
+        self._hooks._log_exit_map(val, tname)
+
+    def _log_unnamed(self, val, uncast):
+        # (PPSnapHooks wants to know what gdb read for this)
+        self._log_value(str(val))
+
+    def _print_simple_type(self, val, rule, tname):
+        self._hooks._log_value(str(val))
+
+    def _print_bad_rule(self, val, rule, tname):
+        self._hooks._log_error("Don't understand rule %r for type %s" % (rule, tname))
+
+    def _print_default(self, val, rule, tname):
+        self._out.v("{s}Falling back to default visualizer for type %s",
+                    tname)
+        vis = gdb.default_visualizer(val)
+        if vis and hasattr(vis, 'children'):
+            if hasattr(vis, 'display_hint'):
+                vis_type = vis.display_hint()
+            else:
+                # std::set doesn't implement display_hint
+                vis_type = "array"
+            if vis_type == "array":
+                self._gdbvis_array(val, vis, vis.to_string() or tname)
+                return
+            elif vis_type == "map":
+                self._gdbvis_map(val, vis, vis.to_string() or tname)
+                return
+        elif vis:
+            # the string case is effectively equivalent to just handing off to
+            # gdb, so leave it up to the fall-through case.
+            pass
+        else:
+            if self._print_fallback_fields(val, tname):
+                return
+            self._hooks._log_no_mapping(tname, False)
+
+        # gdb will do its standard thing here.
+        self._hooks._log_value(str(val))
+
+    ### Fallback fields
+    # A class with no rule and no pretty-printer used to go to gdb's str(val),
+    # which drags in every base class and static member, recursively, and is
+    # painfully slow for the big ones.  Instead we show its plain fields:
+    # scalars, and pointers as bare addresses, up to fallback_fields of them.
+    # Which fields those are, and where, is worked out once per type.
+    def _fallback_emitter(self, ftype):
+        '''(struct format, emit) for a field of ftype we'd show, or None.'''
+        stype = ftype.strip_typedefs()
+        code = stype.code
+        size = stype.sizeof
+        if code == gdb.TYPE_CODE_PTR and size in _UNSIGNED_FORMATS:
+            # (not following it is the whole point)
+            return (_UNSIGNED_FORMATS[size],
+                    lambda v: self._hooks._log_value('0x%x' % v))
+        emitter = self._scalar_emitter(ftype)
+        if emitter is not None:
+            return emitter
+        if ftype.name is not None and self._dispatch_for(ftype)[1] is not None:
+            # (it has a rule, so it's not as plain as it looks)
+            return None
+        if code in (gdb.TYPE_CODE_INT,
+                    gdb.TYPE_CODE_CHAR) and size in _SIGNED_FORMATS:
+            formats = _SIGNED_FORMATS if _is_signed(stype) else _UNSIGNED_FORMATS
+            return formats[size], lambda v: self._hooks._log_value(str(v))
+        if code == gdb.TYPE_CODE_FLT and size in _FLOAT_FORMATS:
+            return (_FLOAT_FORMATS[size],
+                    lambda v: self._hooks._log_value(repr(v)))
+        return None
+
+    def _fallback_walk(self, stype, base, out):
+        # (a derived class's field hides a base class's of the same name, and
+        # base classes come first in memory)
+        for field in stype.fields():
+            if getattr(field, 'bitpos', None) is None:
+                # (static)
+                continue
+            offset = base + field.bitpos // 8
+            if field.is_base_class:
+                self._fallback_walk(field.type.strip_typedefs(), offset, out)
+            elif not (not field.name or getattr(field, 'artificial', False) or
+                      field.name.startswith('_vptr') or
+                      RE_PADDING.match(field.name)):
+                out[field.name] = (offset, field)
+
+    def _fallback_plan(self, vtype):
+        '''
+        Return (start, length, [(fieldName, format, offset, emit)], hidden)
+        for the fields of vtype we'd show, offsets being relative to start and
+        hidden being how many others there are.  Cached per type name (and
+        fallback_fields).
+        '''
+        key = (str(vtype), self.fallback_fields)
+        plan = self._fallback_plans.get(key)
+        if plan is not None:
+            return plan
+        found = {}
+        try:
+            self._fallback_walk(vtype.strip_typedefs(), 0, found)
+        except gdb.error:
+            pass
+        shown = []
+        for fieldName, (offset, field) in sorted(found.items(),
+                                                 key=lambda item: item[1][0]):
+            if len(shown) >= self.fallback_fields or getattr(field, 'bitsize',
+                                                             0):
+                continue
+            emitter = self._fallback_emitter(field.type)
+            if emitter is not None:
+                shown.append((fieldName, offset,
+                              struct.calcsize('<' + emitter[0]), emitter))
+        start = end = 0
+        if shown:
+            start = min(offset for fieldName, offset, size, emitter in shown)
+            end = max(offset + size for fieldName, offset, size, emitter in shown)
+        plan = self._fallback_plans[key] = (
+            start, end - start,
+            [(fieldName, '<' + emitter[0], offset - start, emitter[1])
+             for fieldName, offset, size, emitter in shown],
+            len(found) - len(shown))
+        return plan
+
+    def _print_fallback_fields(self, val, tname):
+        '''
+        Show val's plain fields, from a single read, returning False if we
+        can't (it isn't a class, or isn't in memory).
+        '''
+        entering = self._entering_at
+        if entering is not None and entering[1] is not None:
+            addr, vtype = entering
+        else:
+            vtype = val.type
+            code = vtype.strip_typedefs().code
+            if code != gdb.TYPE_CODE_STRUCT and code != gdb.TYPE_CODE_UNION:
+                return False
+            addr = val.address
+            if addr is None:
+                return False
+            addr = int(addr)
+        start, length, fields, hidden = self._fallback_plan(vtype)
+        raw = b''
+        if length:
+            try:
+                raw = gdb.selected_inferior().read_memory(addr + start,
+                                                          length).tobytes()
+            except gdb.MemoryError:
+                return False
+        self._hooks._log_no_mapping(tname, True)
+        self._hooks._log_enter_detailed_object(val, None, tname)
+        self._entering_at = None
+        try:
+            for fieldName, fmt, offset, emit in fields:
+                # (each costs a node, just like _print_field)
+                if self._nodes_left <= 0:
+                    raise Truncated()
+                self._nodes_left -= 1
+                self._hooks._log_scalar_field_in_detailed_object(
+                    fieldName, emit, struct.unpack_from(fmt, raw, offset)[0])
+            if hidden:
+                self._hooks._log_scalar_field_in_detailed_object(
+                    '...', lambda n: self._hooks._log_value(
+                        '%d other field%s' % (n, '' if n == 1 else 's')),
+                    hidden)
+        finally:
+            self._hooks._log_exit_detailed_object(val, None, tname)
+        return True
+
+    ### Type dispatch
+    # Everything about how we print a value that only depends on its type gets
+    # figured out once per type and cached as a (handler, rule, tname, tracked)
+    # tuple, where handler is a bound method taking (val, rule, tname) and
+    # tracked says whether the handler descends into the value, in which case
+    # we number it and watch for cycles.  The cache is
+    # keyed by type name (gdb.Type isn't reliably hashable) and thrown away
+    # whenever gdb loads new objfiles since the types may have changed.
+    # (traverse just passes through to whatever it lands on, which gets tracked
+    # itself, and terse objects are a single line)
+    TRACKED_KINDS = ("iterate", "simple", "groups")
+
+    def _clear_dispatch_cache(self, event=None):
+        self._dispatch = {}
+        self._has_rtti = {}
+        self._enum_tables = {}
+        self._pod_decoders = {}
+        self._field_plans = {}
+        self._fallback_plans = {}
+        self._snap_fields = {}
+
+    def _rule_paths(self):
+        return [CONFIG_PATH] + [os.path.expanduser(path)
+                                for path in extra_rule_files]
+
+    def _reload_rules(self):
+        '''
+        If the rule files have been edited, pick up the changes, forgetting
+        only what we'd worked out about the types whose rules changed.
+        '''
+        changed = self._rule_files.refresh(self._rule_paths())
+        if not changed:
+            return
+        self.mapping = self._rule_files.rules
+        for key, entry in list(self._dispatch.items()):
+            # (entry[2] is the name the rule was looked up by)
+            if entry[2] in changed:
+                del self._dispatch[key]
+        # These depend on the rules of more types than the one they're for,
+        # but they're cheap to work out again.
+        self._pod_decoders = {}
+        self._field_plans = {}
+        self._fallback_plans = {}
+
+    def _compute_dispatch(self, vtype, explicit_type):
+        if explicit_type is not None:
+            tname = explicit_type
+        else:
+            tmatch = RE_TEMPLATE_NAME.match(vtype.name)
+            if tmatch:
+                # it was a template!
+                tname = tmatch.group(1)
+            else:
+                tname = vtype.name
+
+        # check if we have a configuration mapping for the type
+        rule = self.mapping.get(tname)
+        if rule:
+            for kind, handler in self._rule_handlers:
+                if kind in rule:
+                    return handler, rule, tname, kind in self.TRACKED_KINDS
+            return self._print_bad_rule, rule, tname, False
+
+        # check for heuristic stuff
+        if vtype is not None:
+            # handle enums
+            if vtype.code == gdb.TYPE_CODE_ENUM:
+                return (lambda val, rule, tname:
+                            self._print_enum(val, vtype, tname)), None, tname, False
+            # just print simple types without complaining about mappings.
+            if is_simple_type(vtype):
+                return self._print_simple_type, None, tname, False
+            code = vtype.strip_typedefs().code
+            tracked = (code == gdb.TYPE_CODE_STRUCT or
+                       code == gdb.TYPE_CODE_UNION)
+        else:
+            tracked = False
+
+        return self._print_default, None, tname, tracked
+
+    def _dispatch_for(self, vtype, explicit_type=None):
+        if explicit_type is not None:
+            key = (explicit_type, None)
+        else:
+            key = (None, vtype.name)
+        entry = self._dispatch.get(key)
+        if entry is None:
+            entry = self._dispatch[key] = self._compute_dispatch(vtype,
+                                                                 explicit_type)
+        return entry
+
+    def _resolve_dynamic(self, val):
+        '''
+        Use RTTI to downcast the value all the way, returning (val, vtype).
+        Only class types can have a more derived type, so we remember which
+        type names aren't and skip the dynamic_type/cast round-trips for them.
+        '''
+        vtype = val.type
+        name = vtype.name
+        if name is not None:
+            has_rtti = self._has_rtti.get(name)
+            if has_rtti is None:
+                code = vtype.strip_typedefs().code
+                has_rtti = self._has_rtti[name] = (
+                    code == gdb.TYPE_CODE_STRUCT or
+                    code == gdb.TYPE_CODE_UNION)
+            if not has_rtti:
+                return val, vtype
+
+        dtype = val.dynamic_type
+        # that may have given us a better type, let's re-cast the value too.
+        if name is None or dtype.name != name:
+            try:
+                val = val.cast(dtype)
+            except:
+                pass
+        return val, dtype
 
     def _inspect(self, val, explicit_type=None):
         '''explicit_type is currently the "displayMode" from when we normally do
@@ -362,126 +2031,763 @@ to be inline, it does make sense to just have it be a name that calls out.
 We'll see.  This all wants to be cleaner anyways.  Let's just finish exploring
 the feature space.
 '''
-        vtype = val.type
-        #pout("!!vtype: %s %s %s %s", vtype, type(vtype), vtype.tag, type(vtype.tag))
+        if self._nodes_left <= 0:
+            raise Truncated()
+        self._nodes_left -= 1
 
         # pierce pointers.  Note that our caller may themselves have invoked
         # maybe_deref, so this could get weird.
         val = maybe_deref(val)
 
-        vtype = val.type
-        #pout("!vtype: %s %s %s %s", vtype, type(vtype), vtype.tag, type(vtype.tag))
-
-        vtype = None
         if explicit_type is not None:
-            tname = explicit_type
-            rule = self.mapping.get(explicit_type)
+            vtype = None
+            handler, rule, tname, tracked = self._dispatch_for(None,
+                                                               explicit_type)
         else:
-            # figure out the type; we want to use RTTI if available to downcast all
-            # the way.
-            vtype = val.dynamic_type
-            # that may have given us a better type, let's re-cast the value too.
-            try:
-                val = val.cast(vtype)
-            except:
-                pass
+            # figure out the type; we want to use RTTI if available to downcast
+            # all the way.  (the cast can lose where val lives, hence uncast)
+            uncast = val
+            val, vtype = self._resolve_dynamic(val)
 
             # we may be a pointer type or other simple type.  In particular, we may
             # be a char*-type thing.  punt to gdb. for now.
             if vtype.name is None:
                 # XXX gdb presents strings as `0xNNNN "foo bar"` in a single string
                 # which breaks our pretty schema.
-                pout("{n}%s", str(val))
+                self._hooks._log_unnamed(val, uncast)
                 return
 
-            #pout("vtype: %s %s %s %s", vtype, type(vtype), vtype.tag, type(vtype.tag))
-            tmatch = RE_TEMPLATE_NAME.match(vtype.name)
-            if tmatch:
-                # it was a template!
-                tname = tmatch.group(1)
-            else:
-                tname = vtype.name
+            handler, rule, tname, tracked = self._dispatch_for(vtype)
 
-            # check if we have a configuration mapping for the type
-            #pout("looking up %s in...", tname)
-            #pout("%s", repr(self.mapping))
-            rule = self.mapping.get(tname)
-
-        if rule:
-            # if this was an alias, pierce itgdbvis
-            if isinstance(rule, str):
-                rule = self.mapping.get(rule)
-            #pout("Found mapping with kind %s", rule.get("kind", "default"))
-            if "traverse" in rule:
-                self._traverse(val, rule, tname)
-            elif "iterate" in rule:
-                self._iterate(val, rule, tname)
-            elif "bitflags" in rule:
-                self._bitflags(val, rule, tname)
-            elif "terse" in rule:
-                self._print_terse(val, rule, tname)
-            elif "simple" in rule:
-                self._print_simple(val, rule, tname)
-            elif "groups" in rule:
-                self._print_groups(val, rule, tname)
-            else:
-                pout("{e}Don't understand rule {n}%s {e}for type {n}%s",
-                     repr(rule), tname)
-            # Handled or errored appropriately, no need to fall through to the
-            # default visualizer.
+        self._entering = None
+        self._entering_at = None
+        if not tracked:
+            handler(val, rule, tname)
             return
 
-        # check for heuristic stuff
-        if vtype:
-            # handle enums
-            if vtype.code == gdb.TYPE_CODE_ENUM:
-                self._print_enum(val, vtype, tname)
+        # Number everything we descend into, and if we've already been here,
+        # point back at it rather than going around again.
+        addr = val.address
+        if addr is not None:
+            key = (int(addr), tname)
+            node = self._node_for(key, val)
+            if key in self._visited:
+                self._hooks._log_backref(val, tname, node)
                 return
-            # just print simple types without complaining about mappings.
-            if is_simple_type(vtype):
-                pout("{n}%s", str(val))
+            self._visited.add(key)
+            if self._unchanged is not None and key in self._unchanged:
+                self._hooks._log_unchanged(val, tname, key)
                 return
-
-        pout.v("{s}Falling back to default visualizer for type %s",
-               tname)
-        vis = gdb.default_visualizer(val)
-        if vis and hasattr(vis, 'children'):
-            if hasattr(vis, 'display_hint'):
-                vis_type = vis.display_hint()
-            else:
-                # std::set doesn't implement display_hint
-                vis_type = "array"
-            if vis_type == "array":
-                self._gdbvis_array(val, vis, vis.to_string() or tname)
+            # too deep or we've shown enough; leave it for "pp #N".
+            if self._depth_left <= 0 or self._expands_left <= 0:
+                self._hooks._log_stub(val, tname, node, rule_field_count(rule))
+                if self._new_stubs is not None:
+                    # (self._out is a LineRecorder and that was its last line)
+                    self._new_stubs.append((node, rule, self._out.lines[-1]))
                 return
-            elif vis_type == "map":
-                self._gdbvis_map(val, vis, vis.to_string() or tname)
+            self._expands_left -= 1
+            self._entering = node
+            # (saves _read_scalars asking again)
+            self._entering_at = (key[0], vtype)
+
+        self._depth_left -= 1
+        try:
+            handler(val, rule, tname)
+        finally:
+            self._depth_left += 1
+
+    ### Handles
+    # Node numbers are handed out per (address, tname) and stay the same until
+    # the program runs again, along with the gdb.Value they were for, so that
+    # "pp #N.mFoo" can pick up where an earlier pp left off without
+    # re-evaluating anything.
+    def _forget_handles(self, event=None):
+        self._nodes = {}
+        self._handles = {}
+        self._keys = {}
+        # node -> the name of its value's type, for the memo
+        self._typenames = {}
+        self._next_node = 1
+
+    def _trim_handles(self):
+        # (only ever between invocations, so that the #N's an invocation
+        # prints are all still good once it's done)
+        if len(self._handles) >= self.max_handles:
+            self._forget_handles()
+
+    def _node_for(self, key, val):
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = self._next_node
+            self._next_node += 1
+            self._handles[node] = val
+            self._keys[node] = key
+        if self._touched is not None:
+            self._touched.add(node)
+        return node
+
+    def _handle(self, node):
+        val = self._handles.get(node)
+        if isinstance(val, tuple):
+            # (taken on from a memoized pp; see _adopt_nodes)
+            addr, typename = val
+            val = gdb.Value(addr).cast(
+                gdb.lookup_type(typename).pointer()).dereference()
+            self._handles[node] = val
+        return val
+
+    def _node_specs(self, nodes):
+        '''(node, address, tname, type name) for each of nodes.'''
+        specs = []
+        for node in sorted(nodes):
+            if node not in self._keys:
+                # (forgotten when we ran out of handles)
+                continue
+            typename = self._typenames.get(node)
+            if typename is None:
+                vtype = self._handles[node].type
+                typename = self._typenames[node] = str(
+                    vtype.strip_typedefs().unqualified())
+            addr, tname = self._keys[node]
+            specs.append((node, addr, tname, typename))
+        return tuple(specs)
+
+    def _adopt_nodes(self, specs):
+        '''
+        Take on the handles a memoized pp handed out, unless we've since given
+        any of their numbers (or objects) to something else, in which case its
+        output would be wrong and it has to be done again.
+        '''
+        if len(self._handles) + len(specs) > self.max_handles:
+            self._forget_handles()
+        for node, addr, tname, typename in specs:
+            key = (addr, tname)
+            if (self._keys.get(node, key) != key or
+                    self._nodes.get(key, node) != node):
+                return False
+        for node, addr, tname, typename in specs:
+            key = (addr, tname)
+            if node not in self._handles:
+                self._nodes[key] = node
+                self._keys[node] = key
+                self._handles[node] = (addr, typename)
+                self._typenames[node] = typename
+                self._next_node = max(self._next_node, node + 1)
+        return True
+
+    def _eval(self, arg):
+        m = RE_HANDLE.match(arg)
+        if not m:
+            return gdb.parse_and_eval(arg)
+        node = int(m.group(1))
+        val = self._handle(node)
+        if val is None:
+            raise gdb.GdbError("No #%d (handles are forgotten when the "
+                               "program runs)" % node)
+        for step in m.group(2).split('.')[1:]:
+            val = maybe_deref(val)[step]
+        return val
+
+    def _reset_visited(self, budget, depth):
+        # The (address, tname) keys we've been to in this invocation.
+        self._visited = set()
+        self._entering = None
+        self._entering_at = None
+        self._reset_budget(budget, depth)
+
+    def _reset_budget(self, budget, depth):
+        self._nodes_left = budget
+        self._depth_left = depth
+        self._expands_left = self.expand_budget
+
+    def _inspect_arg(self, arg):
+        m = RE_SLICE.match(arg)
+        if m:
+            start, stop = [int(x) if x else None for x in m.group(2, 3)]
+            self._inspect_slice(self._eval(m.group(1)), start, stop)
+            return
+        m = RE_INDEX.match(arg)
+        if m:
+            val, table = self._lookup_table(m.group(1))
+            if table is not None:
+                self._inspect_lookup(table, m.group(2).strip())
                 return
-        elif vis:
-            # the string case is effectively equivalent to just handing off to
-            # gdb, so leave it up to the fall-through case.
-            pass
+            # (an ordinary array or pointer; anything fancier, gdb can do)
+            if val is not None:
+                item = self._index(val, m.group(2).strip())
+                if item is not None:
+                    self._inspect(item)
+                    return
+        self._inspect(self._eval(arg))
+
+    def _pp(self, arg, budget, depth):
+        self._reset_visited(budget, depth)
+        try:
+            self._inspect_arg(arg)
+        except Truncated:
+            self._hooks._log_truncated(budget)
+
+    def _pp_fit(self, arg, budget, max_lines):
+        '''
+        Breadth-first pp: show the top object with all its children as stubs,
+        then expand stubs a level at a time, shallowest first, as long as the
+        result still fits in max_lines.  Everything is rendered into a
+        LineRecorder first.  An object whose rule says it won't fit isn't read
+        at all, and one that turns out not to fit is only read up to the line
+        that doesn't.
+        '''
+        # (a line for the summary at the end)
+        max_lines -= 1
+        # (a LineRecorder of its own if we're being memoized)
+        out = self._out
+        rec = LineRecorder()
+        self._out = rec
+        self._new_stubs = []
+        self._reset_visited(budget, 1)
+        truncated = False
+        skipped = 0
+        try:
+            try:
+                self._inspect_arg(arg)
+            except Truncated:
+                truncated = True
+            lines = rec.lines
+            queue = collections.deque(self._new_stubs)
+            while queue and not truncated:
+                node, rule, stub_line = queue.popleft()
+                room = max_lines - count_lines(lines) + 1
+                estimate = rule_line_estimate(rule)
+                if estimate is not None and estimate > room:
+                    skipped += 1
+                    continue
+
+                # Expand it, one level deep, in isolation.
+                rec.reset(stub_line.indent, room)
+                self._new_stubs = []
+                visited = set(self._visited)
+                self._visited.discard(self._keys[node])
+                self._depth_left = 1
+                try:
+                    self._inspect(self._handle(node))
+                except Truncated:
+                    truncated = True
+                except Overflowed:
+                    pass
+                if count_lines(rec.lines) > room:
+                    # (forget we saw any of it)
+                    self._visited = visited
+                    skipped += 1
+                    continue
+
+                for idx, line in enumerate(lines):
+                    if line is stub_line:
+                        lines[idx:idx + 1] = rec.lines
+                        break
+                queue.extend(self._new_stubs)
+        finally:
+            self._out = out
+            self._new_stubs = None
+
+        rec.replay(lines, out)
+        unexpanded = skipped + len(queue)
+        if unexpanded:
+            out("{s}(%d objects left unexpanded to fit in %d lines)",
+                unexpanded, max_lines + 1)
+        if truncated:
+            self._hooks._log_truncated(budget)
+
+    def _pp_json(self, arg, budget, depth, path):
+        '''
+        Like _pp, but written as JSON to path by way of PPJSONHooks.  The
+        document is {"expression": arg, "value": ...}, plus "truncated" if we
+        ran out of budget.
+        '''
+        with self._json_to(path) as w:
+            w.key("expression")
+            w.value(arg)
+            w.key("value")
+            self._pp(arg, budget, depth)
+
+    @contextlib.contextmanager
+    def _json_to(self, path):
+        '''
+        Swap in PPJSONHooks so that everything logged goes into a JSON object
+        written to path, yielding the JSONStreamWriter.
+        '''
+        with open(path, 'w') as fout:
+            w = jsonstream.JSONStreamWriter(fout)
+            self._hooks = PPJSONHooks(self, w)
+            try:
+                w.begin_object()
+                yield w
+            finally:
+                w.unwind(0)
+                fout.write('\n')
+                self._hooks = self
+        pout("{s}Wrote {n}%s", path)
+
+    def _pp_snap(self, mode, name, arg, budget, depth):
+        '''
+        "pp /snap NAME EXPR" remembers the tree pp would show for EXPR as NAME.
+        "pp /diff NAME [EXPR]" prints just the paths in it that have changed
+        since, with their old and new values, and remembers the new tree in
+        its place.  Subtrees whose raw bytes still match their digests are
+        carried over without being decoded again.
+        '''
+        old = None
+        unchanged = None
+        if mode == '/diff':
+            old = self._snapshots.get(name)
+            if old is None:
+                raise gdb.GdbError("No snapshot %s (pp /snap %s EXPR first)" %
+                                   (name, name))
+            arg = arg or old[0]
+            unchanged = self._snap_unchanged(old[1])
+        elif not arg:
+            raise gdb.GdbError("Snapshot of what? (pp /snap NAME EXPR)")
+
+        root = SnapNode(arg, [])
+        snap = PPSnapHooks(self, root)
+        self._unchanged = unchanged
+        self._hooks = snap
+        try:
+            self._pp(arg, budget, depth)
+        finally:
+            self._hooks = self
+            self._unchanged = None
+        tree = root
+        if len(root.children) == 1:
+            tree = root.children[0][1]
+        self._snapshots[name] = (arg, tree, snap.truncated)
+
+        if old is None:
+            objects = sum(1 for node in _snap_walk(tree)
+                          if node.key is not None)
+            pout("{s}Snapshot {n}%s{s} of {n}%s{s}: %d objects",
+                 name, arg, objects)
         else:
-            pout("{s}No mapping or pretty-printer for {n}%s{s}, switching to gdb print.", tname)
+            changes = self._print_snap_diff(arg, old[1], tree)
+            if not changes:
+                pout("{s}No changes in {n}%s", arg)
+            if snap.reused:
+                pout("{s}(%d objects unchanged, and not decoded again)",
+                     snap.reused)
+        if snap.truncated is not None:
+            self._hooks._log_truncated(snap.truncated)
 
-        # TODO implement our own form of fallback iteration over fields using
-        # heuristics here.
-        # gdb will do its standard thing here.
-        pout("{n}%s", str(val))
+    def _snap_unchanged(self, tree):
+        '''
+        Re-read the raw bytes of everything in tree that has a digest, and
+        return {key: node} for the objects whose digests still match.
+        '''
+        inferior = gdb.selected_inferior()
+        # id(node) -> its digest as of now, or None if it's changed
+        fresh = {}
+        def digest(node):
+            if id(node) in fresh:
+                return fresh[id(node)]
+            fresh[id(node)] = None
+            addr, length = node.span
+            try:
+                h = _digest(inferior.read_memory(addr, length).tobytes()
+                            if length else b'')
+            except gdb.MemoryError:
+                return None
+            for dep in node.deps:
+                d = digest(dep)
+                if d is None or d != dep.digest:
+                    return None
+                h.update(d)
+            fresh[id(node)] = h.digest()
+            return fresh[id(node)]
+        unchanged = {}
+        for node in _snap_walk(tree):
+            if (node.key is not None and node.digest is not None and
+                    digest(node) == node.digest):
+                unchanged[node.key] = node
+        return unchanged
+
+    def _print_snap_diff(self, path, old, new):
+        '''Print where two snapshot trees differ, returning how many places.'''
+        if old is new or (old.digest is not None and old.digest == new.digest):
+            return 0
+        if (old.children is None or new.children is None or
+                old.text != new.text):
+            if (old.children is None and new.children is None and
+                    old.text == new.text):
+                return 0
+            pout("{k}%s{n}: {e}%s {s}→ {n}%s", path, _snap_summary(old),
+                 _snap_summary(new))
+            return 1
+        changes = 0
+        olds = dict(old.children)
+        news = dict(new.children)
+        for name, child in new.children:
+            if name in olds:
+                changes += self._print_snap_diff(_snap_path(path, name),
+                                                 olds[name], child)
+            else:
+                pout("{k}%s{n}: {s}(none) → {n}%s",
+                     _snap_path(path, name), _snap_summary(child))
+                changes += 1
+        for name, child in old.children:
+            if name not in news:
+                pout("{k}%s{n}: {e}%s {s}→ (none)",
+                     _snap_path(path, name), _snap_summary(child))
+                changes += 1
+        return changes
 
     def invoke(self, arg, from_tty):
         verbose = False
-        # We want a flag here...
-        if arg.startswith('/v'):
-            verbose = True
+        budget = self.node_budget
+        depth = self.stub_depth
+        json_path = None
+        fit_lines = None
+        snap_mode = None
+        # Flags come first, e.g. "pp /v /budget=20000 foo".
+        while arg.startswith('/'):
+            flag, _, arg = arg.partition(' ')
+            arg = arg.lstrip()
+            if flag == '/v':
+                verbose = True
+            elif flag.startswith('/budget='):
+                budget = int(flag[len('/budget='):])
+            elif flag.startswith('/depth='):
+                depth = int(flag[len('/depth='):])
+            elif flag == '/fit':
+                fit_lines = terminal_lines()
+            elif flag.startswith('/lines='):
+                fit_lines = int(flag[len('/lines='):])
+            elif flag == '/json':
+                json_path, _, arg = arg.partition(' ')
+                json_path = os.path.expanduser(json_path)
+                arg = arg.lstrip()
+            elif flag in ('/snap', '/diff'):
+                snap_mode = flag
+                snap_name, _, arg = arg.partition(' ')
+                arg = arg.lstrip()
+            else:
+                pout("{e}Unknown flag {n}%s", flag)
+                return
+        if verbose:
             pout._verbose = True
-            arg = arg[3:]
+        self._reload_rules()
+        self._trim_handles()
         # zero out our indentation in the event of exceptions breaking things.
         pout.i(-1000)
-        val = gdb.parse_and_eval(arg)
-        self._inspect(val)
-        if verbose:
-            pout._verbose = False
+        try:
+            if json_path:
+                self._pp_json(arg, budget, depth, json_path)
+            elif snap_mode:
+                self._pp_snap(snap_mode, snap_name, arg, budget, depth)
+            elif verbose:
+                self._render(arg, budget, depth, fit_lines)
+            else:
+                self._pp_memoized(arg, budget, depth, fit_lines)
+        finally:
+            if verbose:
+                pout._verbose = False
+
+    def _render(self, arg, budget, depth, fit_lines):
+        if fit_lines:
+            self._pp_fit(arg, budget, fit_lines)
+        else:
+            self._pp(arg, budget, depth)
+
+    def _pp_memoized(self, arg, budget, depth, fit_lines):
+        '''
+        Under rr, the same pp at the same moment always says the same thing,
+        so if we've been here before just print what we printed then.
+        Otherwise render it as usual, recording it for next time.
+        '''
+        where = rrmemo.here()
+        if where is None:
+            self._render(arg, budget, depth, fit_lines)
+            return
+        # (how wide the terminal is decides what fits on a line)
+        key = where + (arg, budget, depth, fit_lines,
+                       pout._get_terminal_columns())
+        self._memo.retag((self._rule_files.stamps, mozstrings.max_chars,
+                          self.expand_budget, self.fallback_fields))
+        cached = self._memo.get(key)
+        if cached is not None and self._adopt_nodes(cached[1]):
+            LineRecorder().replay([_Line(*line) for line in cached[0]])
+            return
+
+        rec = LineRecorder()
+        self._out = rec
+        self._touched = set()
+        try:
+            self._render(arg, budget, depth, fit_lines)
+            # (only once it's all gone through; half an answer isn't one)
+            self._memo.put(key, (
+                tuple((line.indent, line.fmt, tuple(_plain(a) for a in
+                                                    line.args))
+                      for line in rec.lines),
+                self._node_specs(self._touched)))
+        finally:
+            self._out = pout
+            self._touched = None
+            rec.replay(rec.lines)
+
+
+### Native gdb pretty-printers
+# The same rules, for everything else that prints values: "print", "info
+# locals", "frame", cbt's args.  These are plain gdb pretty-printers, so they
+# show fields and elements gdb's way, and gdb's own limits (print elements,
+# print max-depth) apply.  Smart pointers and friends ("traverse") show the
+# pointer they lead to rather than following it.
+
+class RulePrinter(object):
+    def __init__(self, cmd, val, rule):
+        self.cmd = cmd
+        self.val = val
+        self.rule = rule
+
+class StringRulePrinter(RulePrinter):
+    def to_string(self):
+        return mozstrings.format_string(self.val)
+
+class TraverseRulePrinter(RulePrinter):
+    def to_string(self):
+        cur = self.val
+        for step in self.rule["traverse"]:
+            # (stop at null pointers, like pp)
+            if not cur:
+                break
+            cur = maybe_deref(cur)[step]
+        return cur
+
+class IterateRulePrinter(RulePrinter):
+    def to_string(self):
+        return None
+
+    def display_hint(self):
+        return 'array'
+
+    def children(self):
+        irule = self.rule["iterate"]
+        if "sentinel" not in irule:
+            return
+        problems = []
+        for i, elem in enumerate(self.cmd._walk_list(
+                self.val, irule, irule["advance"], problems.append)):
+            yield '[%d]' % i, elem
+        for problem in problems:
+            yield 'error', problem
+
+class BitflagsRulePrinter(RulePrinter):
+    def to_string(self):
+        return bitflags_text(self.rule["bitflags"], int(self.val | 0))
+
+class FieldsRulePrinter(RulePrinter):
+    '''terse, simple and groups rules; the fields are flattened.'''
+    def to_string(self):
+        return None
+
+    def children(self):
+        for fieldName, displayMode in rule_fields(self.rule):
+            try:
+                fieldVal = self.val[fieldName]
+                if displayMode is not True:
+                    # (a bitflags rule for what's just an integer to gdb)
+                    handler, rule, tname, tracked = self.cmd._dispatch_for(
+                        None, displayMode)
+                    if rule and "bitflags" in rule:
+                        fieldVal = bitflags_text(rule["bitflags"],
+                                                 int(fieldVal | 0))
+            except gdb.error as e:
+                fieldVal = '<error: %s>' % e
+            yield fieldName, fieldVal
+
+def bitflags_text(brule, val_bits):
+    bit_pieces, leftover = pprules.decode_bitflags(brule, val_bits)
+    if leftover:
+        bit_pieces.append('+0x%x' % leftover)
+    return '%s (0x%x)' % (' | '.join(bit_pieces), val_bits)
+
+class RulePrettyPrinters(object):
+    '''
+    The one gdb pretty-printer lookup for all of pp's rules.  Rather than gdb
+    trying a regexp per rule, it's the command's dispatch cache, keyed by type
+    name, that decides, so the cost doesn't grow with the rules.  Use "disable
+    pretty-printer global gdbaudy-pp" to turn it off.
+
+    Edited rule files get picked up here too, but gdb asks us about every
+    value it prints, so we only check for edits every reload_interval seconds.
+    '''
+    reload_interval = 1.0
+    PRINTERS = {
+        "string": StringRulePrinter,
+        "traverse": TraverseRulePrinter,
+        "iterate": IterateRulePrinter,
+        "bitflags": BitflagsRulePrinter,
+        "terse": FieldsRulePrinter,
+        "simple": FieldsRulePrinter,
+        "groups": FieldsRulePrinter,
+    }
+
+    def __init__(self, cmd):
+        self.name = 'gdbaudy-pp'
+        self.enabled = True
+        self.subprinters = None
+        self.cmd = cmd
+        self._next_reload = 0
+
+    def __call__(self, val):
+        vtype = val.type
+        if vtype.name is None:
+            return None
+        now = time.monotonic()
+        if now >= self._next_reload:
+            self._next_reload = now + self.reload_interval
+            self.cmd._reload_rules()
+        handler, rule, tname, tracked = self.cmd._dispatch_for(vtype)
+        if not rule:
+            return None
+        # (same precedence as pp's)
+        for kind, _ in self.cmd._rule_handlers:
+            if kind in rule:
+                # (and like _print_string, a string whose layout we don't know
+                # goes by its traverse if it has one, or gdb's plain fields)
+                if kind == "string" and not mozstrings.is_string(val):
+                    if "traverse" not in rule:
+                        return None
+                    kind = "traverse"
+                return self.PRINTERS[kind](self.cmd, val, rule)
+        return None
+
+def register_printers(cmd):
+    # (replacing ourselves if we're being re-imported)
+    gdb.pretty_printers[:] = [printer for printer in gdb.pretty_printers
+                              if getattr(printer, 'name', None) != 'gdbaudy-pp']
+    gdb.pretty_printers.append(RulePrettyPrinters(cmd))
+
+
+### Points of interest
+def lookup_singleton(symbol):
+    try:
+        return gdb.parse_and_eval(symbol)
+    except gdb.error:
+        # (gdb's expression parser can choke on "(anonymous namespace)")
+        lookup_static = getattr(gdb, 'lookup_static_symbol', None)
+        sym = ((lookup_static and lookup_static(symbol)) or
+               gdb.lookup_global_symbol(symbol))
+        if sym is None:
+            raise
+        return sym.value()
+
+class PointsOfInterestCommand(gdb.Command):
+    """Pretty-print the points of interest (mainly singletons) listed in
+ppi-mozilla.yaml.
+
+"ppi" lists them.  "ppi NAME..." or "ppi all" pp's them in one pass, so anything
+reachable from more than one of them is only shown the first time.
+"ppi /json FILE NAME...|all" writes them all to FILE as one JSON snapshot.
+/budget=N and /depth=N are as for pp, and apply to each one separately.
+
+The singletons' symbols are only looked up once; after that we remember where
+they live until the program's libraries change.
+"""
+    def __init__(self, pp):
+        gdb.Command.__init__(self, "ppi", gdb.COMMAND_NONE)
+        self.pp = pp
+        self._poi_files = pprules.RuleFiles()
+        self._forget_singletons()
+        connect_events('ppi', [
+            ('new_objfile', self._forget_singletons),
+            ('clear_objfiles', self._forget_singletons),
+        ])
+
+    def _forget_singletons(self, event=None):
+        # symbol -> (address, pointer type)
+        self._singletons = {}
+
+    def _pois(self):
+        # (picks up edits, like pp's rules)
+        self._poi_files.refresh([PPI_CONFIG_PATH])
+        return self._poi_files.mapping
+
+    def _singleton(self, symbol):
+        cached = self._singletons.get(symbol)
+        if cached is not None:
+            addr, ptr_type = cached
+            return gdb.Value(addr).cast(ptr_type).dereference()
+        val = lookup_singleton(symbol)
+        addr = val.address
+        if addr is not None:
+            self._singletons[symbol] = (int(addr), val.type.pointer())
+        return val
+
+    def _evaluate(self, expr):
+        m = RE_POI.match(expr)
+        val = self._singleton(m.group(1).strip())
+        for step in RE_POI_STEP.findall(m.group(2)):
+            val = maybe_deref(val)[step]
+        return val
+
+    def _show(self, pois, names, budget, depth):
+        pp = self.pp
+        pp._reset_visited(budget, depth)
+        for key in names:
+            poi = pois[key]
+            expr = poi.get('singleton', '')
+            pp._reset_budget(budget, depth)
+            pp._hooks._log_enter_poi(key, poi.get('name', key), expr)
+            try:
+                pp._inspect(self._evaluate(expr))
+            except Truncated:
+                pp._hooks._log_truncated(budget)
+            except Exception as e:
+                pp._hooks._log_error("Exception inspecting: %s" % e)
+            finally:
+                pp._hooks._log_exit_poi(key)
+
+    def invoke(self, arg, from_tty):
+        budget = self.pp.node_budget
+        depth = self.pp.stub_depth
+        json_path = None
+        while arg.startswith('/'):
+            flag, _, arg = arg.partition(' ')
+            arg = arg.lstrip()
+            if flag.startswith('/budget='):
+                budget = int(flag[len('/budget='):])
+            elif flag.startswith('/depth='):
+                depth = int(flag[len('/depth='):])
+            elif flag == '/json':
+                json_path, _, arg = arg.partition(' ')
+                json_path = os.path.expanduser(json_path)
+                arg = arg.lstrip()
+            else:
+                pout("{e}Unknown flag {n}%s", flag)
+                return
+
+        pois = self._pois()
+        names = arg.split()
+        if not names:
+            for key, poi in pois.items():
+                pout("{k}%s{n}: {fn}%s {s}%s", key, poi.get('name', key),
+                     poi.get('singleton', ''))
+            return
+        if names == ['all']:
+            names = list(pois)
+        unknown = [name for name in names if name not in pois]
+        if unknown:
+            pout("{e}No such point of interest: {n}%s", ' '.join(unknown))
+            return
+
+        self.pp._reload_rules()
+        self.pp._trim_handles()
+        pout.i(-1000)
+        if json_path:
+            with self.pp._json_to(json_path) as w:
+                w.key("pois")
+                w.begin_object()
+                self._show(pois, names, budget, depth)
+        else:
+            self._show(pois, names, budget, depth)
 
 
-PrettyPrintCommand()
+pp_command = PrettyPrintCommand()
+register_printers(pp_command)
+PointsOfInterestCommand(pp_command)
@@ -0,0 +1,309 @@
+# Compiles the pp YAML knowledge base (pp-mozilla.yaml) into a normalized rule
+# table and caches the result on disk.
+#
+# strictyaml is lovely for hand-edited config but slow, and we were paying for
+# it (and for importing it) every time gdb started.  The compiled table is just
+# dicts, tuples and strings, so it round-trips through marshal, which loads in
+# a millisecond or two.  The cache is keyed by the YAML's mtime/size, falling
+# back to a content hash so that a `touch` doesn't force a re-parse.
+#
+# RuleFiles keeps an eye on the YAML (plus any extra rule files) so pp can pick
+# up edits as you make them.  The raw mapping is kept alongside the compiled
+# rules, so after an edit only the entries that actually changed get compiled
+# again, and everything else keeps its (identical) rule object.
+
+import hashlib
+import marshal
+import os
+import sys
+
+# Bump this when the shape of the compiled rules changes so stale caches are
+# ignored.
+RULES_FORMAT = 3
+
+def _display_mode(displayMode):
+    # strictyaml hands us every scalar as a string.
+    if displayMode == 'true' or displayMode is True:
+        return True
+    return displayMode
+
+def _flatten_fields(fieldDefs):
+    '''
+    The YAML field lists are lists of singleton dicts, which is nice to write
+    but annoying to walk.  Flatten to a tuple of (fieldName, displayMode).
+    '''
+    fields = []
+    # (an empty "simple:" comes through as an empty string)
+    for fieldDef in fieldDefs or ():
+        for fieldName, displayMode in fieldDef.items():
+            fields.append((fieldName, _display_mode(displayMode)))
+    return tuple(fields)
+
+def _compile_bitflags(brule):
+    '''
+    Turn the list of singleton {NAME: BIT} dicts into tables we can decode a
+    value with in a single pass over its set bits.  A plain number is a bit
+    position; a "0x" number is a mask, which may cover several bits.  We end up
+    with:
+    - "bits": single-bit mask -> name
+    - "masks": (mask, name) for the multi-bit masks, widest first so that the
+      most specific match claims its bits
+    - "zero": the name to use when no bits are set, if any.
+    '''
+    bits = {}
+    masks = []
+    for bitDef in brule['bits']:
+        for bitName, bitPos in bitDef.items():
+            bitPos = str(bitPos).strip()
+            if bitPos.lower().startswith('0x'):
+                mask = int(bitPos, 16)
+            else:
+                mask = 1 << int(bitPos)
+            if mask & (mask - 1):
+                masks.append((mask, bitName))
+            else:
+                bits.setdefault(mask, bitName)
+    masks.sort(key=lambda pair: (-bin(pair[0]).count('1'), pair[0]))
+    return {
+        'zero': brule.get('zero'),
+        'bits': bits,
+        'masks': tuple(masks),
+    }
+
+def decode_bitflags(brule, val_bits):
+    '''
+    Decode val_bits against a compiled bitflags rule, returning (names,
+    leftover) where leftover has the set bits that no name accounted for.
+    Names come out in order of their lowest bit.
+    '''
+    if not val_bits:
+        zero = brule['zero']
+        return (zero and [zero] or []), 0
+
+    found = []
+    remaining = val_bits
+    for mask, bitName in brule['masks']:
+        if remaining & mask == mask:
+            found.append((mask & -mask, bitName))
+            remaining &= ~mask
+
+    bits = brule['bits']
+    scan = remaining
+    while scan:
+        low = scan & -scan
+        bitName = bits.get(low)
+        if bitName is not None:
+            found.append((low, bitName))
+            remaining &= ~low
+        scan ^= low
+
+    found.sort()
+    return [bitName for low, bitName in found], remaining
+
+def compile_rule(raw):
+    rule = {}
+    for key, value in raw.items():
+        if key in ('simple', 'terse'):
+            rule[key] = _flatten_fields(value)
+        elif key == 'groups':
+            rule[key] = tuple((groupName, _flatten_fields(fieldDefs))
+                              for groupDef in value
+                              for groupName, fieldDefs in groupDef.items())
+        elif key == 'traverse':
+            rule[key] = tuple(value)
+        elif key == 'bitflags':
+            rule[key] = _compile_bitflags(value)
+        else:
+            rule[key] = value
+    return rule
+
+def compile_rules(mapping, previous=None):
+    '''
+    Given the raw YAML mapping, return a dict from type name to compiled rule
+    with all the aliases ("nsCOMPtr: RefPtr") resolved, so lookups never need to
+    pierce them.  Aliases to types we don't have rules for are dropped.
+
+    previous is an earlier (mapping, compiled rules); entries whose raw YAML
+    hasn't changed since then reuse the rule compiled back then.
+    '''
+    oldMapping, oldCompiled = previous or ({}, {})
+    compiled = {}
+    for name, raw in mapping.items():
+        if isinstance(raw, str):
+            continue
+        if name in oldCompiled and oldMapping.get(name) == raw:
+            compiled[name] = oldCompiled[name]
+        else:
+            compiled[name] = compile_rule(raw)
+
+    for name, raw in mapping.items():
+        if not isinstance(raw, str):
+            continue
+        # follow the chain, being paranoid about cycles.
+        seen = set([name])
+        target = raw
+        while isinstance(mapping.get(target), str) and target not in seen:
+            seen.add(target)
+            target = mapping[target]
+        if target in compiled:
+            compiled[name] = compiled[target]
+    return compiled
+
+def parse_mapping(text):
+    from strictyaml import load
+    # This recursively flattens the YAML instances to dicts and lists and
+    # scalars.
+    return load(text).data
+
+def parse_rules(text):
+    return compile_rules(parse_mapping(text))
+
+def cache_path_for(config_path):
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    config_path = os.path.abspath(config_path)
+    # (different checkouts get different cache files)
+    pathHash = hashlib.sha1(config_path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(base, 'gdbaudy', '%s-%s.rules' % (
+        os.path.basename(config_path), pathHash))
+
+def _cache_key():
+    # marshal's format is only promised to be stable within a python version.
+    return (RULES_FORMAT, sys.version_info[0], sys.version_info[1])
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = marshal.load(f)
+        if cached.get('key') == _cache_key():
+            return cached
+    except Exception:
+        pass
+    return None
+
+def _write_cache(cache_path, cached):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = '%s.%d' % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(cached, f)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        # a read-only home directory just means we re-parse every time.
+        pass
+
+def load_mapping(config_path, previous=None):
+    '''
+    Return (raw mapping, compiled rules) for the YAML file at config_path, from
+    the cache if it's still good.  previous is as for compile_rules.
+    '''
+    st = os.stat(config_path)
+    cache_path = cache_path_for(config_path)
+    cached = _read_cache(cache_path)
+    if (cached and cached['mtime'] == st.st_mtime and
+            cached['size'] == st.st_size):
+        if previous:
+            # (keep the rule objects we already had for unchanged entries)
+            return cached['mapping'], compile_rules(cached['mapping'],
+                                                    previous)
+        return cached['mapping'], cached['rules']
+
+    with open(config_path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if cached and cached['hash'] == digest:
+        mapping, rules = cached['mapping'], cached['rules']
+        if previous:
+            rules = compile_rules(mapping, previous)
+    else:
+        mapping = parse_mapping(data.decode('utf-8'))
+        rules = compile_rules(mapping, previous)
+
+    _write_cache(cache_path, {
+        'key': _cache_key(),
+        'mtime': st.st_mtime,
+        'size': st.st_size,
+        'hash': digest,
+        'mapping': mapping,
+        'rules': rules,
+    })
+    return mapping, rules
+
+def load_rules(config_path):
+    '''
+    Return the compiled rule table for the YAML file at config_path, from the
+    cache if it's still good.
+    '''
+    return load_mapping(config_path)[1]
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+class RuleFiles(object):
+    '''
+    The rules from a list of YAML files, later files' entries winning over
+    earlier ones, re-read whenever one of them changes.
+    '''
+    def __init__(self):
+        self.paths = ()
+        # (mtime, size) of each of paths, as of the last refresh that found a
+        # change
+        self.stamps = ()
+        self.mapping = {}
+        self.rules = {}
+        # path -> (stamp, raw mapping, compiled rules); the stamp's None for a
+        # missing file
+        self._files = {}
+
+    def refresh(self, paths):
+        '''
+        Make sure we're up to date with the files in paths.  Returns None if
+        nothing changed, otherwise the set of type names whose rules are now
+        different (new, gone, or edited).  A file that's missing or broken
+        just keeps what we last had from it, or contributes nothing.
+        '''
+        paths = tuple(paths)
+        stamps = [_stamp(path) for path in paths]
+        if paths == self.paths and all(
+                path in self._files and self._files[path][0] == stamp
+                for path, stamp in zip(paths, stamps)):
+            return None
+
+        mapping = {}
+        # the compiled rule for each non-alias entry, from whichever file won
+        owned = {}
+        for path, stamp in zip(paths, stamps):
+            known = self._files.get(path)
+            if known is None or known[0] != stamp:
+                # (a missing or broken file still gets its stamp noted, so
+                # that we don't look at it again until it changes)
+                loaded = known[1:] if known else ({}, {})
+                if stamp is not None:
+                    previous = known[1:] if known and known[1] else None
+                    if not previous and self.rules:
+                        previous = (self.mapping, self.rules)
+                    try:
+                        loaded = load_mapping(path, previous)
+                    except Exception as e:
+                        sys.stderr.write('gdbaudy: not loading %s: %s\n' %
+                                         (path, e))
+                known = self._files[path] = (stamp,) + tuple(loaded)
+            stamp, fileMapping, fileRules = known
+            mapping.update(fileMapping)
+            owned.update((name, fileRules[name]) for name, raw in
+                         fileMapping.items() if not isinstance(raw, str))
+
+        # (nothing actually gets compiled here; this just resolves aliases
+        # across files)
+        rules = compile_rules(mapping, (mapping, owned))
+        changed = set(name for name in set(rules) | set(self.rules)
+                      if rules.get(name) is not self.rules.get(name))
+        self.paths = paths
+        self.stamps = tuple(stamps)
+        self.mapping = mapping
+        self.rules = rules
+        return changed
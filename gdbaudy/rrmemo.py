@@ -0,0 +1,254 @@
+# Memoization keyed on rr's notion of "when".
+#
+# Under rr replay, what's in the program at a given event and tick count is
+# always the same, so anything we worked out from it (pp's output, tricelog's
+# captures) is still good when we come back there, say after a
+# reverse-continue, or in the next session on the same trace.  Outside of rr
+# there's no such promise and nothing gets memoized.
+#
+# The memos are LRU-bounded dicts.  With `python gdbaudy.rrmemo.persist = True`
+# they're also saved (via marshal) under ~/.cache/gdbaudy/, one file per memo
+# per rr trace directory, whenever the program resumes and when gdb exits.
+
+import atexit
+import collections
+import hashlib
+import marshal
+import os
+import sys
+
+import gdb
+import gdbaudy
+
+# (if we're being re-imported, the last import's save_all is about to be
+# replaced, and shouldn't be left behind to run at exit too)
+if 'save_all' in globals():
+    atexit.unregister(save_all)
+
+persist = False
+
+# Bump this when the shape of what's saved changes.
+MEMO_FORMAT = 1
+
+_UNKNOWN = object()
+
+# (event, ticks) where we're stopped, or None if we haven't asked rr yet.
+_current = None
+# We asked and rr didn't know what we were talking about.
+_not_rr = False
+# Someone wrote to memory, so the event no longer tells us what's in it.
+_tainted = False
+# The trace directory, or the program's filename if we can't find one.
+_trace = _UNKNOWN
+
+# every EventMemo, so they can be saved together (kept if we're being
+# re-imported, since the modules holding them may not be)
+_memos = globals().get('_memos', [])
+
+def _post_colon(cmd):
+    # (like tricelog's execExtractPostColon; "Current event: 1234")
+    s = gdb.execute(cmd, to_string=True)
+    return int(s[s.index(':') + 2:])
+
+def current_event():
+    '''
+    (event, ticks) for where rr has us stopped, asked once per stop.  None if
+    we're not under rr replay, or memory's been changed behind rr's back.
+    '''
+    global _current, _not_rr
+    if _not_rr or _tainted:
+        return None
+    if _current is None:
+        try:
+            _current = (_post_colon('when'), _post_colon('when-ticks'))
+        except (gdb.error, ValueError):
+            _not_rr = True
+            return None
+    return _current
+
+def frame_key(frame):
+    try:
+        level = frame.level()
+    except AttributeError:
+        # (gdb < 11; the pc will mostly do)
+        level = None
+    return (frame.pc(), level)
+
+def here(event=None, frame=None):
+    '''
+    A key for the current moment: the rr event and ticks (or event, if the
+    caller already asked), the selected thread, and frame (or the selected
+    frame), since that's what expressions get evaluated against.  None if
+    we're not under rr.
+    '''
+    if event is None:
+        event = current_event()
+        if event is None:
+            return None
+    elif _tainted:
+        return None
+    try:
+        if frame is None:
+            frame = gdb.selected_frame()
+        tid = gdb.selected_thread().ptid[1]
+    except gdb.error:
+        return None
+    return tuple(event) + (tid,) + frame_key(frame)
+
+def _find_trace_dir():
+    try:
+        filename = gdb.current_progspace().filename
+    except (AttributeError, gdb.error):
+        return None
+    if not filename:
+        return None
+    # rr replays a hard link to (or copy of) the executable that lives in the
+    # trace directory, next to its "version" and "events" files.
+    path = os.path.dirname(os.path.abspath(filename))
+    while path != os.path.dirname(path):
+        if (os.path.isfile(os.path.join(path, 'version')) and
+                os.path.exists(os.path.join(path, 'events'))):
+            return path
+        path = os.path.dirname(path)
+    return filename
+
+def trace_dir():
+    global _trace
+    if _trace is _UNKNOWN:
+        _trace = _find_trace_dir()
+    return _trace
+
+def _cache_path(name, trace):
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    traceHash = hashlib.sha1(trace.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(base, 'gdbaudy', 'rrmemo-%s-%s.marshal' % (
+        name, traceHash))
+
+def _cache_key():
+    # marshal's format is only promised to be stable within a python version.
+    return (MEMO_FORMAT, sys.version_info[0], sys.version_info[1])
+
+class EventMemo(object):
+    '''
+    A bounded (least recently used entries go first) dict for results that
+    only depend on where rr has us, keyed by tuples starting with here() or
+    current_event().  Values have to be marshal-able if persist is on.
+
+    tag is whatever else the results depend on (rule files, limits...);
+    retag() with something different and everything's forgotten.
+    '''
+    def __init__(self, name, max_entries=256):
+        self.name = name
+        self.max_entries = max_entries
+        self.tag = None
+        self._entries = collections.OrderedDict()
+        # the trace the entries are for
+        self._trace = _UNKNOWN
+        self._dirty = False
+        # (a re-imported module's memo takes over from its last one)
+        _memos[:] = [memo for memo in _memos if memo.name != name]
+        _memos.append(self)
+
+    def retag(self, tag):
+        if tag != self.tag:
+            self.tag = tag
+            self.clear()
+
+    def clear(self):
+        self._entries.clear()
+        self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        self._sync()
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._sync()
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def _sync(self):
+        # A different program means different events.
+        trace = trace_dir()
+        if trace == self._trace:
+            return
+        self.save()
+        self._entries.clear()
+        self._dirty = False
+        self._trace = trace
+        if persist and trace and os.path.isdir(trace):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(_cache_path(self.name, self._trace), 'rb') as f:
+                saved = marshal.load(f)
+            if saved['key'] != _cache_key() or saved['tag'] != self.tag:
+                return
+            self._entries.update(saved['entries'])
+        except Exception:
+            pass
+
+    def save(self):
+        trace = self._trace
+        if not (persist and self._dirty and trace and trace is not _UNKNOWN
+                and os.path.isdir(trace)):
+            return
+        self._dirty = False
+        path = _cache_path(self.name, trace)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '%s.%d' % (path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                marshal.dump({'key': _cache_key(), 'tag': self.tag,
+                              'entries': list(self._entries.items())}, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            # (not being able to save just means we work it out again)
+            pass
+
+def save_all(event=None):
+    for memo in _memos:
+        memo.save()
+
+def moved(event=None):
+    '''
+    Forget where rr had us.  Stop events take care of this, but a breakpoint
+    whose stop() says to keep going never gets one.
+    '''
+    global _current
+    _current = None
+
+def _resumed(event=None):
+    moved()
+    save_all()
+
+def _memory_changed(event=None):
+    global _tainted
+    _tainted = True
+
+def _new_program(event=None):
+    global _not_rr, _tainted, _trace
+    moved()
+    _not_rr = False
+    _tainted = False
+    _trace = _UNKNOWN
+
+gdbaudy.connect_events('rrmemo', [
+    ('stop', moved),
+    ('cont', _resumed),
+    ('memory_changed', _memory_changed),
+    ('new_objfile', _new_program),
+    ('clear_objfiles', _new_program),
+])
+atexit.register(save_all)
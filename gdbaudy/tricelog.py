@@ -7,6 +7,7 @@ import toml
 import traceback
 
 from gdb.FrameIterator import FrameIterator
+from gdbaudy import connect_events, mozstrings, rrmemo
 
 RE_IS_GECKO = re.compile('^(gecko|mozilla)')
 def normalize_path(path):
@@ -83,8 +84,55 @@ def execExtractInsideParens(cmd):
     idxClose = s.index(')', idxOpen + 1)
     return s[idxOpen+1:idxClose]
 
+# tid -> thread name.  rr doesn't populate InferiorThread.name, but it does
+# provide the name as the thread's "extra", which only "info thread" shows,
+# so we ask once per thread and keep the answer until a new thread turns up or
+# the program stops.  (Our breakpoints keep going without stopping, so a thread
+# that renames itself partway through a run keeps its old name until then.)
+_thread_names = {}
+
+def thread_name(thread):
+    tid = thread.ptid[1]
+    name = _thread_names.get(tid)
+    if name is None:
+        name = _thread_names[tid] = execExtractInsideParens(
+            'info thread ' + str(thread.num))
+    return name
+
+def _forget_thread_names(event=None):
+    _thread_names.clear()
+
+connect_events('tricelog', [
+    ('new_thread', _forget_thread_names),
+    ('stop', _forget_thread_names),
+])
+
+
+# Under rr, stringified captures are remembered by where they were made (see
+# rrmemo), so revisiting an event costs nothing.
+capture_memo = rrmemo.EventMemo('capture', 4096)
+
+def _capture_key(traverseSeq, where):
+    thing = traverseSeq[0]
+    if isinstance(thing, gdb.Value):
+        addr = thing.address
+        if addr is None:
+            return None
+        event = where and where[:2] or rrmemo.current_event()
+        if event is None:
+            return None
+        start = event + ('value', int(addr), str(thing.type))
+    elif isinstance(thing, gdb.Frame):
+        start = rrmemo.here(where and where[:2], thing)
+    else:
+        # (the first string is an expression in the selected frame)
+        where = where or rrmemo.here()
+        start = where and where + (thing,)
+    if start is None:
+        return None
+    return start + tuple(traverseSeq[1:])
 
-def magic_capture(traverseSeq, verbose=False, stringify=True):
+def magic_capture(traverseSeq, verbose=False, stringify=True, where=None):
     '''
     Capture helper that takes a list of fields to traverse, stringifying the
     final value when all fields have been traversed.
@@ -95,7 +143,26 @@ def magic_capture(traverseSeq, verbose=False, stringify=True):
     - A gdb.Value which will be used as the starting value.
     - A gdb.Frame which will be used as the starting value with the next string
       being passed to read_var before resuming normal traversal.
+
+    where is rrmemo.here() if the caller has already asked.
     '''
+    key = None
+    if stringify:
+        try:
+            capture_memo.retag(mozstrings.max_chars)
+            key = _capture_key(traverseSeq, where)
+        except Exception:
+            key = None
+        if key is not None:
+            cached = capture_memo.get(key)
+            if cached is not None:
+                return cached
+    name, cur = _capture(traverseSeq, verbose, stringify)
+    if key is not None and name is not None:
+        capture_memo.put(key, (name, cur))
+    return name, cur
+
+def _capture(traverseSeq, verbose, stringify):
     try:
         # traversal is currently hackily derived from the "pp" command's
         # traverse logic.  This all wants to be cleaned up.
@@ -145,8 +212,12 @@ def magic_capture(traverseSeq, verbose=False, stringify=True):
         if stringify:
             # Note that this is different than doing value.string() which is
             # only for actual strings.  By doing str(), we'll actually get
-            # `0xPOINTER "string contents"`.
-            cur = str(cur)
+            # `0xPOINTER "string contents"`.  Gecko strings we decode ourselves
+            # since they can be huge.
+            if mozstrings.is_string(cur):
+                cur = mozstrings.format_string(cur)
+            else:
+                cur = str(cur)
         return name, cur
     except:
         if verbose:
@@ -164,24 +235,33 @@ class LoggingBreakpoint(gdb.Breakpoint):
         data = {}
 
         ## RR replay sourced info
-        data['event'] = execExtractPostColon('when')
-        data['tick'] = execExtractPostColon('when-ticks')
-        data['tid'] = execExtractPostColon('when-tid')
-        data['time'] = execExtractPostColon('elapsed-time', float)
+        # Ask rr where once, and share it with the captures.  (gdb resuming
+        # after the last hit sent a cont event, so rrmemo isn't still holding
+        # that one; but another of our breakpoints here may already have asked.)
+        event = rrmemo.current_event()
+        if event is None:
+            # (memory's been poked, so rrmemo won't vouch for it, but we still
+            # want to log it)
+            event = (execExtractPostColon('when'),
+                     execExtractPostColon('when-ticks'))
+        data['event'], data['tick'] = event
+        # rr ptid's look like (12481, 12481, 0), the second being the tid.
+        thread = gdb.selected_thread()
+        data['tid'] = thread.ptid[1]
+        # (another round trip to rr, so only if the config asks for it)
+        if self.info.get('time'):
+            data['time'] = execExtractPostColon('elapsed-time', float)
 
         ## get the thread name.
-        # This is a little circumspect because the InferiorThread.name currently
-        # isn't populated by rr, but it is provided as the thread's "extra".
-        # And we can use "info thread" to retrieve it.
-        tnum = gdb.selected_thread().num
-        data['tname'] = execExtractInsideParens('info thread ' + str(tnum))
+        data['tname'] = thread_name(thread)
 
         data['spec'] = self.info['spec']
 
         if self.info.get('capture'):
             captured = data['captured'] = {}
+            where = rrmemo.here(event)
             for traverseSeq in self.info['capture']:
-                name, value = magic_capture(traverseSeq)
+                name, value = magic_capture(traverseSeq, where=where)
                 if name is not None:
                     captured[name] = value
 